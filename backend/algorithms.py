@@ -0,0 +1,196 @@
+import threading
+import time
+
+INF = float('inf')
+NO_PREDECESSOR = -9999
+
+class GraphView:
+    # What an algorithm may read for one query: the networkx graph, its typed
+    # road arrays and the traffic weights snapshot taken when the query started.
+    # `weights` is the live TrafficWeights, to check routes against roads closed
+    # while the query ran.
+    def __init__(self, graph, arrays=None, snapshot=None, weights=None):
+        self.graph = graph
+        self.arrays = arrays
+        self.snapshot = snapshot
+        self.weights = weights
+
+    def edge_path(self, path, weight='length'):
+        # Edge ids for a node path, derived after the search: between two junctions
+        # the cheapest open parallel road, which is the one every search prices the hop by.
+        # Open means open now, not when the snapshot was taken: a road closed since
+        # is swapped for an open parallel one, and with none left the route is None
+        import numpy as np
+        travel_time = self.snapshot.travel_time if self.snapshot is not None else None
+        latest = self.weights.current() if self.weights is not None else None
+        if travel_time is not None and latest is not None and latest.blocked_version != self.snapshot.blocked_version:
+            # Closed or reopened roads; traffic speeds stay those of the snapshot
+            travel_time = np.where(np.isfinite(latest.travel_time),
+                                   np.where(np.isfinite(travel_time), travel_time, latest.travel_time), INF)
+        edges = self.arrays.edge_path(path, travel_time, weight)
+        if travel_time is not None and not np.isfinite(travel_time[edges]).all():
+            return None
+        return edges
+
+class Algorithm:
+    # func(view, source, target, weight, deadline) -> (node path or None, stats dict).
+    # run() maps the path to edge ids afterwards with GraphView.edge_path
+    def __init__(self, name, func, weight='length', description=''):
+        self.name = name
+        self.func = func
+        self.weight = weight
+        self.description = description
+
+    def run(self, view, source, target, deadline=INF):
+        result = self.func(view, source, target, self.weight, deadline)
+        # Searches wrapped in add_timeout give None when they run out of time
+        if result is None:
+            return None, {}
+        path, stats = result
+        if not path:
+            return None, stats or {}
+        # None as well when a road on the path was closed during the search
+        return view.edge_path(path, self.weight), stats or {}
+
+    def describe(self):
+        return {'name': self.name, 'weight': self.weight, 'description': self.description}
+
+class AlgorithmRegistry:
+    def __init__(self):
+        self.algorithms = {}
+
+    def add(self, name, func, weight='length', description=''):
+        if name in self.algorithms:
+            raise ValueError(f"Algorithm '{name}' is already registered")
+        self.algorithms[name] = Algorithm(name, func, weight, description)
+        return self.algorithms[name]
+
+    def register(self, name, weight='length', description=''):
+        # Decorator form of add()
+        def decorator(func):
+            self.add(name, func, weight, description)
+            return func
+        return decorator
+
+    def names(self):
+        return list(self.algorithms)
+
+    def select(self, names=None):
+        # Registered algorithms in registration order, all of them when names is empty
+        if not names:
+            return list(self.algorithms.values())
+        unknown = [name for name in names if name not in self.algorithms]
+        if unknown:
+            raise KeyError(f"Unknown algorithms {unknown}, expected some of {self.names()}")
+        return [algorithm for name, algorithm in self.algorithms.items() if name in names]
+
+    def describe(self):
+        return [algorithm.describe() for algorithm in self.algorithms.values()]
+
+registry = AlgorithmRegistry()
+
+def graph_search(func):
+    # Adapts a func(graph, source, target) -> path search on the length weight
+    def run(view, source, target, weight, deadline):
+        return func(view.graph, source, target), {}
+    return run
+
+def tree_path(node_ids, predecessors, t):
+    # Node ids from the root of a csgraph predecessor array to road array index t
+    path = []
+    while t != NO_PREDECESSOR:
+        path.append(int(node_ids[t]))
+        t = predecessors[t]
+    path.reverse()
+    return path
+
+class CSGraphBackend:
+    # scipy.sparse.csgraph on a CSR export of the road arrays. Roads closed by
+    # obstacles are left out. A length matrix is rebuilt when roads are closed
+    # or reopened, a travel time matrix with every new weights snapshot.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.matrices = {}
+        self.build_time = None
+
+    def matrix(self, view, weight='length', reverse=False):
+        key = (weight, reverse)
+        snapshot = view.snapshot
+        version = snapshot.version if weight == 'travel_time' else snapshot.blocked_version
+        with self.lock:
+            cached = self.matrices.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        matrix = self._build(view.arrays, view.snapshot, weight, reverse)
+        with self.lock:
+            self.matrices[key] = (version, matrix)
+        return matrix
+
+    def _build(self, arrays, snapshot, weight, reverse):
+        import numpy as np
+        from scipy.sparse import csr_matrix
+
+        start_time = time.time()
+        travel_time = snapshot.travel_time
+        open_roads = np.isfinite(travel_time)
+        weights = travel_time if weight == 'travel_time' else arrays.length.astype(np.float64)
+        sources, targets = arrays.edge_source[open_roads], arrays.edge_target[open_roads]
+        weights = weights[open_roads]
+        if reverse:
+            sources, targets = targets, sources
+
+        # One entry per node pair, the cheapest of parallel roads: csgraph does
+        # not define which of several entries for the same pair it uses
+        order = np.lexsort((weights, targets, sources))
+        sources, targets, weights = sources[order], targets[order], weights[order]
+        first = np.ones(len(sources), dtype=np.bool_)
+        first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        sources, targets, weights = sources[first], targets[first], weights[first]
+
+        node_count = arrays.node_count
+        indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+        # Zero-length roads would read as missing entries
+        weights = np.maximum(weights, 1e-9)
+        matrix = csr_matrix((weights, targets, indptr), shape=(node_count, node_count))
+        self.build_time = time.time() - start_time
+        return matrix
+
+    def tree(self, view, source, weight='length', reverse=False):
+        # Full shortest path tree of source as (distances, predecessors), indexed like the road arrays
+        from scipy.sparse.csgraph import dijkstra
+        matrix = self.matrix(view, weight, reverse)
+        s = int(view.arrays.index_of(source))
+        return dijkstra(matrix, directed=True, indices=s, return_predecessors=True)
+
+    def shortest_path(self, view, source, target, weight='length', deadline=INF):
+        # One full single-source run in C; scipy has no early exit at a target
+        import numpy as np
+        distances, predecessors = self.tree(view, source, weight)
+        t = int(view.arrays.index_of(target))
+        stats = {'reached': int(np.isfinite(distances).sum())}
+        if not np.isfinite(distances[t]):
+            return None, stats
+        return tree_path(view.arrays.node_ids, predecessors, t), stats
+
+    def paths_from(self, view, source, targets, reverse=False, weight='length'):
+        # Same result shape as routing.shortest_paths_from: target -> (distance, path)
+        import numpy as np
+        targets = list(targets)
+        distances, predecessors = self.tree(view, source, weight, reverse)
+        index = view.arrays.index_of(targets).tolist()
+        results = {}
+        for target, t in zip(targets, index):
+            if not np.isfinite(distances[t]):
+                continue
+            path = tree_path(view.arrays.node_ids, predecessors, t)
+            if reverse:
+                path.reverse()
+            results[target] = (float(distances[t]), path)
+        return results
+
+    def report(self):
+        with self.lock:
+            cached = {f"{weight}{'_reverse' if reverse else ''}": version
+                      for (weight, reverse), (version, _) in self.matrices.items()}
+        return {'matrices': cached, 'build_time': self.build_time}
@@ -0,0 +1,277 @@
+import threading
+import time
+from array import array
+from collections import deque
+
+from search_state import pool_for
+
+# Detour search used to prove a component survives a road closure
+max_repair_nodes = 20000
+
+class ConnectivityIndex:
+    # Strongly connected component labels plus the condensation DAG, kept in
+    # step with obstacle edits. Same component means reachable; otherwise the
+    # topological order rejects most pairs at once and the rest walk the
+    # (small) DAG, with answers cached until the next edit.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.labels = None
+        self.dag = None
+        self.cross_edges = None
+        self.topo = None
+        self.reach_cache = {}
+        self.base = None
+        self.dirty = True
+        self.version = 0
+        self.rebuilds = 0
+        self.build_time = None
+
+    def build(self, graph):
+        import networkx as nx
+        start_time = time.time()
+        pool = pool_for(graph)
+        index = pool.index
+
+        labels = array('i', [0]) * len(pool.nodes)
+        for comp_id, component in enumerate(nx.strongly_connected_components(graph)):
+            for node in component:
+                labels[index[node]] = comp_id
+        comp_count = comp_id + 1 if graph.number_of_nodes() else 0
+
+        self.labels = labels
+        self.dag = [set() for _ in range(comp_count)]
+        self.cross_edges = {}
+        for u, neighbors in graph.adjacency():
+            for v in neighbors:
+                self._add_cross_edge(labels[index[u]], labels[index[v]])
+        self.topo = self._topological_positions()
+
+        self.reach_cache = {}
+        self.dirty = False
+        self.rebuilds += 1
+        self.build_time = time.time() - start_time
+        print(f"Connectivity labels: {comp_count} components in {self.build_time:.2f}s")
+
+    def snapshot_base(self):
+        # Labels of the unobstructed graph, restored by /clear_obstacles
+        self.base = (array('i', self.labels), [set(s) for s in self.dag], dict(self.cross_edges), list(self.topo))
+
+    def load(self, graph):
+        with self.lock:
+            self.build(graph)
+            self.snapshot_base()
+
+    def reset_to_base(self, graph):
+        with self.lock:
+            self.version += 1
+            if self.base is None:
+                self.dirty = True
+                return
+            labels, dag, cross_edges, topo = self.base
+            self.labels = array('i', labels)
+            self.dag = [set(s) for s in dag]
+            self.cross_edges = dict(cross_edges)
+            self.topo = list(topo)
+            self.reach_cache = {}
+            self.dirty = False
+
+    def remove_edges(self, graph, removed):
+        # Blocked roads (entries start with u, v), already gone from `graph`.
+        # Only a u -> v link with no parallel road left can split a component;
+        # when the split is not cheap to prove the index is rebuilt on the next query.
+        with self.lock:
+            self.version += 1
+            self.reach_cache = {}
+            if self.dirty or not removed:
+                return
+
+            index = pool_for(graph).index
+            labels = self.labels
+            lost = {}
+            for u, v in {(edge[0], edge[1]) for edge in removed}:
+                # A parallel road between the same junctions keeps the link
+                if graph.has_edge(u, v):
+                    continue
+                cu, cv = labels[index[u]], labels[index[v]]
+                if cu == cv:
+                    lost.setdefault(cu, []).append((u, v))
+                else:
+                    self._drop_cross_edge(cu, cv)
+
+            split = False
+            for comp, edges in lost.items():
+                trimmed = self._repair_component(graph, index, comp, edges)
+                if trimmed is None:
+                    self.dirty = True
+                    return
+                if trimmed:
+                    self._split_off(graph, index, trimmed)
+                    split = True
+
+            # Dropping DAG edges keeps the topological order valid; new components need a new one
+            if split:
+                self.topo = self._topological_positions()
+
+    def _drop_cross_edge(self, cu, cv):
+        count = self.cross_edges.get((cu, cv), 0) - 1
+        if count <= 0:
+            self.cross_edges.pop((cu, cv), None)
+            self.dag[cu].discard(cv)
+        else:
+            self.cross_edges[(cu, cv)] = count
+
+    def _repair_component(self, graph, index, comp, lost):
+        # Returns the nodes that fall out of the component as singletons, or
+        # None when the rest could not cheaply be proven strongly connected.
+        labels = self.labels
+
+        def inside(node):
+            return labels[index[node]] == comp and node not in trimmed
+
+        # Trim: a node without an incoming or outgoing road inside the
+        # component can not be on a cycle, so it becomes its own component
+        trimmed = set()
+        stack = [node for edge in lost for node in edge]
+        while stack:
+            node = stack.pop()
+            if node in trimmed:
+                continue
+            has_in = any(inside(w) and w != node for w in graph.predecessors(node))
+            has_out = any(inside(w) and w != node for w in graph.successors(node))
+            if has_in and has_out:
+                continue
+            trimmed.add(node)
+            if len(trimmed) > max_repair_nodes:
+                return None
+            stack.extend(w for w in graph.predecessors(node) if inside(w))
+            stack.extend(w for w in graph.successors(node) if inside(w))
+
+        # Every broken hop of an old cycle starts at an exit and ends at an
+        # entry. If all exits reach one hub and the hub reaches all entries,
+        # each hop has a detour and the rest of the component stays intact.
+        exits, entries = set(), set()
+        for u, v in lost:
+            if u not in trimmed:
+                exits.add(u)
+            if v not in trimmed:
+                entries.add(v)
+        for node in trimmed:
+            exits.update(w for w in graph.predecessors(node) if inside(w))
+            entries.update(w for w in graph.successors(node) if inside(w))
+
+        if not exits and not entries:
+            return trimmed
+        hub = next(iter(entries or exits))
+        if not self._reaches_all(graph.successors, inside, hub, entries):
+            return None
+        if not self._reaches_all(graph.predecessors, inside, hub, exits):
+            return None
+        return trimmed
+
+    def _reaches_all(self, neighbors, inside, hub, wanted):
+        missing = set(wanted)
+        missing.discard(hub)
+        seen = {hub}
+        queue = deque([hub])
+        while queue and missing:
+            node = queue.popleft()
+            for neighbor in neighbors(node):
+                if neighbor in seen or not inside(neighbor):
+                    continue
+                seen.add(neighbor)
+                missing.discard(neighbor)
+                if len(seen) > max_repair_nodes:
+                    return False
+                queue.append(neighbor)
+        return not missing
+
+    def _split_off(self, graph, index, trimmed):
+        labels = self.labels
+        # Roads between a trimmed node and other components were counted
+        # under the node's old label
+        for node in trimmed:
+            old = labels[index[node]]
+            for w in graph.successors(node):
+                if w not in trimmed and labels[index[w]] != old:
+                    self._drop_cross_edge(old, labels[index[w]])
+            for w in graph.predecessors(node):
+                if w not in trimmed and labels[index[w]] != old:
+                    self._drop_cross_edge(labels[index[w]], old)
+        for node in trimmed:
+            labels[index[node]] = len(self.dag)
+            self.dag.append(set())
+        for node in trimmed:
+            cx = labels[index[node]]
+            for w in graph.successors(node):
+                self._add_cross_edge(cx, labels[index[w]])
+            for w in graph.predecessors(node):
+                if w not in trimmed:
+                    self._add_cross_edge(labels[index[w]], cx)
+
+    def _add_cross_edge(self, cu, cv):
+        if cu != cv:
+            self.cross_edges[(cu, cv)] = self.cross_edges.get((cu, cv), 0) + 1
+            self.dag[cu].add(cv)
+
+    def _topological_positions(self):
+        comp_count = len(self.dag)
+        indegree = [0] * comp_count
+        for successors in self.dag:
+            for c in successors:
+                indegree[c] += 1
+
+        # Topological position of every component (Kahn's algorithm)
+        topo = [0] * comp_count
+        ready = deque(c for c in range(comp_count) if indegree[c] == 0)
+        position = 0
+        while ready:
+            c = ready.popleft()
+            topo[c] = position
+            position += 1
+            for nxt in self.dag[c]:
+                indegree[nxt] -= 1
+                if indegree[nxt] == 0:
+                    ready.append(nxt)
+        return topo
+
+    def can_reach(self, graph, source, target):
+        with self.lock:
+            if self.dirty or self.labels is None:
+                # Lazy rebuild: bursts of obstacles pay for it once, on the next query
+                self.build(graph)
+
+            index = pool_for(graph).index
+            cs, ct = self.labels[index[source]], self.labels[index[target]]
+            if cs == ct:
+                return True
+            if self.topo[cs] > self.topo[ct]:
+                return False
+
+            key = (cs, ct)
+            if key not in self.reach_cache:
+                self.reach_cache[key] = self._dag_reaches(cs, ct)
+            return self.reach_cache[key]
+
+    def _dag_reaches(self, cs, ct):
+        limit = self.topo[ct]
+        seen = {cs}
+        stack = [cs]
+        while stack:
+            c = stack.pop()
+            for nxt in self.dag[c]:
+                if nxt == ct:
+                    return True
+                if nxt not in seen and self.topo[nxt] < limit:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return False
+
+    def report(self):
+        with self.lock:
+            return {
+                'version': self.version,
+                'components': len(self.dag) if self.dag is not None else None,
+                'dirty': self.dirty,
+                'rebuilds': self.rebuilds,
+                'build_time': self.build_time
+            }
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from algorithms import tree_path
+
+hot_pairs_file = 'cache/hot_pairs.json'
+# Pairs warmed after startup and /clear_obstacles, busiest first
+hot_pair_limit = 300
+# Origins among them that keep their whole shortest path tree, so any
+# destination from them is answered without a search
+tree_origin_limit = 20
+# Counts are merged into the file after this many new requests
+save_every = 50
+
+class HotRoutes:
+    # Popular snapped (start, end) pairs and their precomputed shortest routes
+    # by length. Everything precomputed belongs to one obstacle state (epoch);
+    # a warm-up that finishes after the map changed is thrown away.
+    def __init__(self, path=hot_pairs_file):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.pending = Counter()
+        self.arrays = None
+        self.trees = {}
+        self.routes = {}
+        self.epoch = 0
+        self.state = 'cold'
+        self.warm_time = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                pairs = json.load(f).get('pairs', [])
+            with self.lock:
+                self.counts = Counter({(int(s), int(t)): int(count) for s, t, count in pairs})
+            print(f"Loaded {len(pairs)} hot route pairs")
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Could not read {self.path}: {e}")
+
+    def record(self, source, target):
+        with self.lock:
+            key = (int(source), int(target))
+            self.counts[key] += 1
+            self.pending[key] += 1
+            due = sum(self.pending.values()) >= save_every
+        if due:
+            self.save()
+
+    def save(self):
+        # Other workers write the same file, so add our new counts to what is
+        # there instead of overwriting it
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        if not pending:
+            return
+        try:
+            merged = Counter()
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    merged = Counter({(int(s), int(t)): int(count) for s, t, count in json.load(f).get('pairs', [])})
+            merged.update(pending)
+            top = merged.most_common(hot_pair_limit * 4)
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump({'saved': time.time(), 'pairs': [[s, t, count] for (s, t), count in top]}, f)
+            os.replace(temporary, self.path)
+            with self.lock:
+                for key, count in merged.items():
+                    self.counts[key] = max(self.counts[key], count)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Could not save {self.path}: {e}")
+
+    def top_pairs(self, limit=hot_pair_limit):
+        with self.lock:
+            return self.counts.most_common(limit)
+
+    def invalidate(self):
+        # The map changed: nothing precomputed is valid any more
+        with self.lock:
+            self.epoch += 1
+            self.trees = {}
+            self.routes = {}
+            self.state = 'cold'
+
+    def current_epoch(self):
+        with self.lock:
+            return self.epoch
+
+    def warm(self, view, backend, epoch):
+        # One C Dijkstra per distinct origin among the hot pairs. epoch must be
+        # read before view was taken, so a map change in between is noticed
+        with self.lock:
+            if epoch != self.epoch:
+                return False
+            self.state = 'warming'
+        start_time = time.time()
+
+        origins = {}
+        for (source, target), count in self.top_pairs():
+            entry = origins.setdefault(source, [0, []])
+            entry[0] += count
+            entry[1].append(target)
+        busiest = sorted(origins, key=lambda origin: origins[origin][0], reverse=True)[:tree_origin_limit]
+        busiest = set(busiest)
+
+        arrays = view.arrays
+        trees, routes = {}, {}
+        for source, (_, targets) in origins.items():
+            if epoch != self.epoch:
+                return False
+            # The saved pairs may come from an older map
+            if source not in view.graph:
+                continue
+            targets = [target for target in targets if target in view.graph]
+            distances, predecessors = backend.tree(view, source)
+            if source in busiest:
+                trees[source] = predecessors.astype('int32')
+                continue
+            index = arrays.index_of(targets).tolist()
+            for target, t in zip(targets, index):
+                if distances[t] != float('inf'):
+                    routes[(source, target)] = tree_path(arrays.node_ids, predecessors, t)
+
+        with self.lock:
+            if epoch != self.epoch:
+                return False
+            self.arrays = arrays
+            self.trees = trees
+            self.routes = routes
+            self.state = 'warm'
+            self.warm_time = time.time() - start_time
+        print(f"Warmed {len(routes)} hot routes and {len(trees)} origin trees in {self.warm_time:.2f}s")
+        return True
+
+    def route(self, source, target):
+        # Shortest route by length from memory, or None. Counts one hit or
+        # miss, so call it once per request
+        with self.lock:
+            path = self.routes.get((source, target))
+            tree = self.trees.get(source)
+            arrays = self.arrays
+            if path is None and tree is None:
+                self.misses += 1
+                return None
+        if path is None:
+            s, t = int(arrays.index_of(source)), int(arrays.index_of(target))
+            unreachable = t >= arrays.node_count or arrays.node_ids[t] != target or (tree[t] < 0 and t != s)
+            if unreachable:
+                with self.lock:
+                    self.misses += 1
+                return None
+            path = tree_path(arrays.node_ids, tree, t)
+        with self.lock:
+            self.hits += 1
+        return list(path)
+
+    def report(self):
+        with self.lock:
+            return {
+                'status': self.state,
+                'tracked_pairs': len(self.counts),
+                'routes': len(self.routes),
+                'trees': len(self.trees),
+                'warm_time': self.warm_time,
+                'hits': self.hits,
+                'misses': self.misses
+            }
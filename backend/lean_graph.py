@@ -0,0 +1,259 @@
+import re
+import sys
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+default_speed_kph = 40
+MB = 1024 * 1024
+
+def parse_speed(data):
+    speed = data.get('speed_kph')
+    if speed is None:
+        speed = data.get('maxspeed')
+    if isinstance(speed, list):
+        speed = speed[0] if speed else None
+    if isinstance(speed, (int, float)):
+        return float(speed)
+    if isinstance(speed, str):
+        match = re.search(r'\d+(\.\d+)?', speed)
+        if match:
+            value = float(match.group())
+            return value * 1.609 if 'mph' in speed else value
+    return float(default_speed_kph)
+
+def parse_oneway(value):
+    if isinstance(value, str):
+        return value.lower() in ('true', 'yes', '1', '-1')
+    return bool(value)
+
+def parse_name(value):
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value if isinstance(value, str) else ''
+
+def edge_geometry(graph, u, v, data):
+    # Interior points of the road as (lat, lng), ordered from u to v
+    geometry = data.get('geometry')
+    if geometry is None:
+        return []
+    coords = [(lat, lng) for lng, lat in geometry.coords]
+    if len(coords) < 2:
+        return []
+    u_lat, u_lng = graph.nodes[u]['y'], graph.nodes[u]['x']
+    first, last = coords[0], coords[-1]
+    if (first[0] - u_lat) ** 2 + (first[1] - u_lng) ** 2 > (last[0] - u_lat) ** 2 + (last[1] - u_lng) ** 2:
+        coords.reverse()
+    return coords[1:-1]
+
+class RoadArrays:
+    # Typed CSR view of the road graph. Edges are numbered in source order so
+    # an edge id is a row in every edge array; parallel roads keep their own id.
+    def __init__(self, graph, keep_geometry=True):
+        node_ids = np.fromiter(graph.nodes, dtype=np.int64, count=graph.number_of_nodes())
+        node_ids.sort()
+        self.node_ids = node_ids
+        self.lat = np.array([graph.nodes[node]['y'] for node in node_ids], dtype=np.float64)
+        self.lng = np.array([graph.nodes[node]['x'] for node in node_ids], dtype=np.float64)
+
+        sources, targets, keys, lengths, speeds, oneways, name_ids = [], [], [], [], [], [], []
+        geometries = []
+        names = {'': 0}
+
+        for u, v, key, data in graph.edges(keys=True, data=True):
+            sources.append(u)
+            targets.append(v)
+            keys.append(key)
+            lengths.append(data.get('length', 1))
+            speeds.append(parse_speed(data))
+            oneways.append(parse_oneway(data.get('oneway', False)))
+            name = parse_name(data.get('name'))
+            name_ids.append(names.setdefault(name, len(names)))
+            if keep_geometry:
+                geometries.append(edge_geometry(graph, u, v, data))
+
+        source_index = self.index_of(np.array(sources, dtype=np.int64))
+        order = np.argsort(source_index, kind='stable')
+        node_count = len(node_ids)
+
+        self.edge_source = source_index[order].astype(np.int32)
+        self.edge_target = self.index_of(np.array(targets, dtype=np.int64))[order].astype(np.int32)
+        self.edge_key = np.array(keys, dtype=np.int32)[order]
+        self.length = np.array(lengths, dtype=np.float32)[order]
+        self.speed = np.array(speeds, dtype=np.float32)[order]
+        self.oneway = np.array(oneways, dtype=np.bool_)[order]
+        self.name_id = np.array(name_ids, dtype=np.int32)[order]
+        self.names = list(names)
+
+        self.indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.edge_source, minlength=node_count), out=self.indptr[1:])
+
+        # Edge ids ordered by (source, target, length), to turn a node path back
+        # into the roads it used
+        pair_keys = self.edge_source.astype(np.int64) * node_count + self.edge_target
+        self.pair_order = np.lexsort((self.length, pair_keys)).astype(np.int32)
+        self.pair_keys = pair_keys[self.pair_order]
+
+        # Incoming edges per node, as edge ids, for reverse searches
+        self.in_edges = np.argsort(self.edge_target, kind='stable').astype(np.int32)
+        self.in_indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.edge_target, minlength=node_count), out=self.in_indptr[1:])
+
+        self.has_geometry = keep_geometry
+        if keep_geometry:
+            geometries = [geometries[e] for e in order]
+            counts = np.fromiter((len(points) for points in geometries), dtype=np.int64, count=len(geometries))
+            self.geometry_indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=self.geometry_indptr[1:])
+            self.geometry_points = np.array(
+                [point for points in geometries for point in points], dtype=np.float64
+            ).reshape(-1, 2)
+        else:
+            self.geometry_indptr = None
+            self.geometry_points = None
+
+    @property
+    def node_count(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_target)
+
+    def index_of(self, nodes):
+        return np.searchsorted(self.node_ids, nodes)
+
+    def edge_path(self, path, travel_time=None, weight='length'):
+        # Edge ids along a node path. Where parallel roads join two junctions
+        # this picks the cheapest open one (finite travel_time), the shortest
+        # or the fastest for weight 'travel_time', which is how searches price
+        # the hop; it is not a record of the road a search relaxed
+        nodes = self.index_of(np.asarray(path, dtype=np.int64))
+        if len(nodes) < 2:
+            return np.empty(0, dtype=np.int64)
+        keys = nodes[:-1] * self.node_count + nodes[1:]
+        low = np.searchsorted(self.pair_keys, keys, side='left')
+        high = np.searchsorted(self.pair_keys, keys, side='right')
+        if (high == low).any():
+            raise ValueError('Path uses a road that is not in the road arrays')
+        edges = self.pair_order[low].astype(np.int64)
+        if travel_time is not None:
+            for i in np.flatnonzero(high - low > 1).tolist():
+                roads = self.pair_order[low[i]:high[i]]
+                seconds = travel_time[roads]
+                if weight == 'travel_time':
+                    edges[i] = roads[np.argmin(seconds)]
+                elif not np.isfinite(seconds[0]) and np.isfinite(seconds).any():
+                    edges[i] = roads[np.argmax(np.isfinite(seconds))]
+        return edges
+
+    def route_length(self, edges):
+        return float(self.length[edges].sum(dtype=np.float64))
+
+    def route_points(self, edges):
+        # [lat, lng] along the edges: each road's start junction and interior
+        # geometry, then the end of the last road
+        edges = np.asarray(edges, dtype=np.int64)
+        if not len(edges):
+            return []
+        if self.has_geometry:
+            first = self.geometry_indptr[edges]
+            counts = self.geometry_indptr[edges + 1] - first
+        else:
+            first = counts = np.zeros(len(edges), dtype=np.int64)
+        offsets = np.zeros(len(edges), dtype=np.int64)
+        np.cumsum(counts[:-1] + 1, out=offsets[1:])
+        total = int(counts.sum())
+        points = np.empty((len(edges) + total + 1, 2), dtype=np.float64)
+
+        starts = self.edge_source[edges]
+        points[offsets, 0], points[offsets, 1] = self.lat[starts], self.lng[starts]
+        if total:
+            inner = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            points[np.repeat(offsets + 1, counts) + inner] = self.geometry_points[np.repeat(first, counts) + inner]
+        end = self.edge_target[edges[-1]]
+        points[-1] = self.lat[end], self.lng[end]
+        return points.tolist()
+
+    def memory_usage(self):
+        usage = {}
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray):
+                usage[name] = value.nbytes
+        usage['names'] = sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names)
+        return usage
+
+class NodePositions(Mapping):
+    # Drop-in for the node -> (lat, lng) dict, backed by the road arrays. The
+    # A* heuristic reads it on every push, so coordinates are kept as flat
+    # arrays in the order of `index` (node -> position, e.g. the numbering of
+    # the pooled search state) instead of a searchsorted per lookup.
+    def __init__(self, arrays, index=None):
+        if index is None:
+            index = {node: i for i, node in enumerate(arrays.node_ids.tolist())}
+        rows = arrays.index_of(np.fromiter(index, dtype=np.int64, count=len(index)))
+        positions = np.fromiter(index.values(), dtype=np.int64, count=len(index))
+        lat, lng = np.empty(len(index)), np.empty(len(index))
+        lat[positions], lng[positions] = arrays.lat[rows], arrays.lng[rows]
+        self.index = index
+        self.lat = array('d', lat.tobytes())
+        self.lng = array('d', lng.tobytes())
+
+    def __getitem__(self, node):
+        i = self.index[node]
+        return (self.lat[i], self.lng[i])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+def slim_graph(graph, keep_geometry=False):
+    # Strip everything routing does not read from the networkx graph: nodes
+    # keep their coordinates, edges keep their length (and geometry on request)
+    edge_fields = ('length', 'geometry') if keep_geometry else ('length',)
+    for _, data in graph.nodes(data=True):
+        for field in [f for f in data if f not in ('x', 'y')]:
+            del data[field]
+    for _, _, data in graph.edges(data=True):
+        for field in [f for f in data if f not in edge_fields]:
+            del data[field]
+
+def estimate_graph_bytes(graph):
+    # Shallow sizes of the adjacency and attribute containers. Walks every edge,
+    # so it is meant for reports, not for the request path.
+    if graph is None:
+        return 0
+    size = sys.getsizeof(graph._node) + sys.getsizeof(graph._adj)
+    if hasattr(graph, '_pred'):
+        size += sys.getsizeof(graph._pred)
+        for neighbors in graph._pred.values():
+            size += sys.getsizeof(neighbors)
+    for data in graph._node.values():
+        size += sys.getsizeof(data) + sum(sys.getsizeof(v) for v in data.values())
+    for neighbors in graph._adj.values():
+        size += sys.getsizeof(neighbors)
+        for edges in neighbors.values():
+            size += sys.getsizeof(edges)
+            for data in (edges.values() if graph.is_multigraph() else [edges]):
+                size += sys.getsizeof(data) + sum(sys.getsizeof(v) for v in data.values())
+    return size
+
+def estimate_mapping_bytes(mapping):
+    if not isinstance(mapping, dict):
+        return 0
+    return sys.getsizeof(mapping) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in mapping.items())
+
+def process_memory():
+    # Current and peak resident set size in bytes
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+        return None, peak
@@ -0,0 +1,242 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Chennai, used when driving a server whose graph we can not inspect
+default_bbox = (12.83, 80.12, 13.24, 80.33)
+default_mix = 'find_path=80,add_obstacle=15,clear_obstacles=5'
+operations = ['find_path', 'find_alternatives', 'plan_batch', 'add_obstacle', 'clear_obstacles', 'geocode']
+places = ['Marina Beach', 'T Nagar', 'Guindy', 'Adyar', 'Egmore', 'Anna Nagar', 'Velachery', 'Mylapore']
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in operations:
+            raise ValueError(f"Unknown operation '{name}', expected one of {operations}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError('Mix needs at least one operation with positive weight')
+    return mix
+
+def random_point(rng, bbox):
+    south, west, north, east = bbox
+    return {'lat': rng.uniform(south, north), 'lng': rng.uniform(west, east)}
+
+def build_plan(count, mix, bbox, seed):
+    # The whole request sequence is drawn up front so a seed always replays the same traffic
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    plan = []
+
+    for _ in range(count):
+        name = rng.choices(names, weights)[0]
+        if name in ('find_path', 'find_alternatives'):
+            body = {'start': random_point(rng, bbox), 'end': random_point(rng, bbox)}
+        elif name == 'plan_batch':
+            body = {'vehicles': [
+                {'start': random_point(rng, bbox), 'end': random_point(rng, bbox)}
+                for _ in range(rng.randint(5, 20))
+            ]}
+        elif name == 'add_obstacle':
+            body = random_point(rng, bbox)
+        elif name == 'geocode':
+            body = {'location': rng.choice(places)}
+        else:
+            body = None
+        plan.append((name, body))
+    return plan
+
+def stub_geocoder(main, bbox, seed):
+    # Replace the Nominatim lookup so runs never touch the network
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def find_location(place_name):
+        with lock:
+            return random_point(rng, bbox)
+
+    main.find_location = find_location
+
+def graph_bbox(main):
+    lats = [pos[0] for pos in main.node_positions.values()]
+    lngs = [pos[1] for pos in main.node_positions.values()]
+    return (min(lats), min(lngs), max(lats), max(lngs))
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+def make_sender(mode, url, timeout, main=None):
+    if mode == 'inprocess':
+        from fastapi.testclient import TestClient
+        local = threading.local()
+
+        def send(name, body):
+            if not hasattr(local, 'client'):
+                local.client = TestClient(main.app, raise_server_exceptions=False)
+            response = local.client.post(f'/{name}', json=body)
+            return response.status_code
+
+        return send
+
+    import requests
+    local = threading.local()
+
+    def send(name, body):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        response = local.session.post(f'{url}/{name}', json=body, timeout=timeout)
+        return response.status_code
+
+    return send
+
+def start_local_server(main, port):
+    import uvicorn
+    config = uvicorn.Config(main.app, host='127.0.0.1', port=port, log_level='warning')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+def run_load(plan, send, concurrency, rate, timeout):
+    results = []
+    results_lock = threading.Lock()
+    start_time = time.time()
+
+    def run_one(index, name, body):
+        # Open loop when a rate is given: each request has a fixed send time
+        if rate:
+            delay = start_time + index / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.time()
+        status, error = None, None
+        try:
+            status = send(name, body)
+        except Exception as e:
+            error = type(e).__name__
+        latency = time.time() - sent
+
+        timed_out = latency > timeout or (error is not None and 'Timeout' in error)
+        with results_lock:
+            results.append({
+                'operation': name,
+                'status': status,
+                'latency': latency,
+                'timeout': timed_out,
+                'error': error is not None or status is None or status >= 500
+            })
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (name, body) in enumerate(plan):
+            executor.submit(run_one, index, name, body)
+
+    return results, time.time() - start_time
+
+def summarize(results, duration):
+    def stats(items):
+        latencies = [item['latency'] for item in items]
+        count = len(items)
+        return {
+            'requests': count,
+            'errors': sum(1 for item in items if item['error']),
+            'timeouts': sum(1 for item in items if item['timeout']),
+            'client_errors': sum(1 for item in items if item['status'] and 400 <= item['status'] < 500),
+            'error_rate': sum(1 for item in items if item['error']) / count if count else 0,
+            'timeout_rate': sum(1 for item in items if item['timeout']) / count if count else 0,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None
+        }
+
+    by_operation = {}
+    for item in results:
+        by_operation.setdefault(item['operation'], []).append(item)
+
+    summary = stats(results)
+    summary['duration'] = duration
+    summary['throughput'] = len(results) / duration if duration > 0 else 0
+    summary['operations'] = {name: stats(items) for name, items in sorted(by_operation.items())}
+    return summary
+
+def print_summary(summary):
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else '       -'
+
+    print(f"\n{summary['requests']} requests in {summary['duration']:.2f}s - {summary['throughput']:.1f} req/s")
+    print(f"errors {summary['error_rate']:.1%}  timeouts {summary['timeout_rate']:.1%}")
+    print(f"{'operation':<18}{'count':>7}{'err':>6}{'4xx':>6}{'tmo':>6}{'p50 ms':>9}{'p90 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    rows = list(summary['operations'].items()) + [('total', summary)]
+    for name, row in rows:
+        print(f"{name:<18}{row['requests']:>7}{row['errors']:>6}{row['client_errors']:>6}{row['timeouts']:>6}"
+              f"{ms(row['p50'])} {ms(row['p90'])} {ms(row['p95'])} {ms(row['p99'])} {ms(row['max'])}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Load test the path finding API')
+    parser.add_argument('--mode', choices=['inprocess', 'serve', 'url'], default='inprocess',
+                        help='inprocess: ASGI test client, serve: local uvicorn in this process, url: existing server')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server for --mode url')
+    parser.add_argument('--port', type=int, default=8765, help='Port for --mode serve')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0, help='Requests per second, 0 for as fast as possible')
+    parser.add_argument('--mix', default=default_mix, help=f"Weighted operations, e.g. '{default_mix}'")
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as timed out')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--bbox', help='south,west,north,east for random points (default: graph bounds)')
+    parser.add_argument('--json', dest='json_out', help='Also write the summary to this file')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    main = None
+    bbox = tuple(float(v) for v in args.bbox.split(',')) if args.bbox else None
+
+    if args.mode == 'url':
+        if 'geocode' in mix:
+            print('Warning: geocode requests against a remote server use the real Nominatim service')
+        bbox = bbox or default_bbox
+    else:
+        import main
+        main.load_city_map()
+        main.start_graph_services()
+        bbox = bbox or graph_bbox(main)
+        stub_geocoder(main, bbox, args.seed)
+
+    url = args.url
+    if args.mode == 'serve':
+        server, thread = start_local_server(main, args.port)
+        url = f'http://127.0.0.1:{args.port}'
+
+    plan = build_plan(args.requests, mix, bbox, args.seed)
+    send = make_sender(args.mode, url, args.timeout, main)
+    print(f"Running {len(plan)} requests ({args.mode}), concurrency {args.concurrency}, "
+          f"rate {args.rate or 'max'}, seed {args.seed}")
+
+    results, duration = run_load(plan, send, args.concurrency, args.rate, args.timeout)
+    summary = summarize(results, duration)
+    print_summary(summary)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.mode == 'serve':
+        server.should_exit = True
+        thread.join(timeout=5)
+
+if __name__ == '__main__':
+    main_cli()
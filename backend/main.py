@@ -1,19 +1,35 @@
 import os
-import networkx as nx
-import osmnx as ox
+import gc
+import asyncio
 import math
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from threading import Lock, Thread, RLock, Event
 from functools import lru_cache, wraps
 from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from geopy.geocoders import Nominatim
+from typing import List, Optional
 import heapq
 import threading
 from multiprocessing import cpu_count
+from routing import find_alternative_routes, shortest_paths_from, edge_length
+from search_state import pool_for, NO_PARENT
+from connectivity import ConnectivityIndex
+from overlay import MultiLevelOverlay
+from traffic import TrafficWeights, TrafficFeed
+from algorithms import registry, graph_search, GraphView, CSGraphBackend
+from hot_routes import HotRoutes
+from tours import order_stops, tour_cost
+from map_matching import MapMatcher
+from profiling import phase, profile_request, profiling_allowed, profile_path
+from recording import RequestRecorder, route_digest
+
+# osmnx, networkx, geopy and numpy are imported where they are first used,
+# so the server accepts connections and answers health checks right away
 
 class LocationRequest(BaseModel):
     location: str
@@ -21,14 +37,62 @@ class LocationRequest(BaseModel):
 class PathRequest(BaseModel):
     start: dict
     end: dict
+    # Subset of registered algorithms to run, all of them when left out
+    algorithms: Optional[List[str]] = None
 
 class ObstacleRequest(BaseModel):
     lat: float
     lng: float
 
+class VehicleRoute(BaseModel):
+    start: dict
+    end: dict
+    id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    vehicles: List[VehicleRoute]
+    # 'python' runs the early-exit Dijkstra in routing.py, 'csgraph' scipy's C Dijkstra
+    backend: str = 'python'
+
+class TrafficRequest(BaseModel):
+    updates: List[dict]
+
+class TripRequest(BaseModel):
+    stops: List[dict]
+    # Reorder the stops between the first (and, with fixed_end, the last) one
+    optimize: bool = True
+    fixed_end: bool = False
+    round_trip: bool = False
+    backend: str = 'python'
+
+class TraceRequest(BaseModel):
+    vehicle_id: str
+    # GPS points as {lat, lng}, oldest first, continuing the vehicle's earlier chunks
+    points: List[dict]
+    # The trace is over: decide every pending point and forget the vehicle
+    final: bool = False
+
+class AlternativesRequest(BaseModel):
+    start: dict
+    end: dict
+    k: int = 3
+    method: str = 'penalty'
+    max_overlap: float = 0.7
+    max_stretch: float = 1.4
+
 os.makedirs('cache', exist_ok=True)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    if graph_ready.is_set():
+        # Preloaded in the master: threads started there did not survive the fork
+        start_graph_services()
+    else:
+        Thread(target=load_city_map_in_background, daemon=True).start()
+    yield
+    hot_routes.save()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,35 +108,162 @@ blocked_roads = []
 backup_map = None
 saved_routes = {}
 route_points = None
+route_algorithms = None
+removed_roads = []
+city_map = None
+road_arrays = None
+node_positions = None
+graph_ready = Event()
+graph_error = None
+graph_load_time = None
+graph_services_started = False
+load_lock = Lock()
+started_at = time.time()
+connectivity = ConnectivityIndex()
+# Appends /find_path and obstacle calls to RECORD_REQUESTS for offline replay
+recorder = RequestRecorder()
+overlay = MultiLevelOverlay()
+# Live edge speeds, published as versioned snapshots
+traffic = TrafficWeights()
+traffic_feed = TrafficFeed(traffic)
+csgraph = CSGraphBackend()
+# Popular start/end pairs, warmed in the background after startup and /clear_obstacles
+hot_routes = HotRoutes()
+# Streaming GPS trace matching, one Viterbi lattice per vehicle
+map_matcher = MapMatcher()
+# Route updates pushed over /ws/routes
+route_subscribers = set()
+subscribers_lock = Lock()
+published_routes = {}
+routes_version = 0
+replan_lock = Lock()
+replan_pending = Event()
+replan_thread = None
 
 # Settings
 timeout_seconds = 15
 num_workers = max(6, cpu_count())
+alternatives_budget = 5
+max_alternatives = 10
+max_batch_vehicles = 5000
+max_trip_stops = 100
+max_trace_points = 10000
+# Obstacles placed within this many seconds of each other share one replan
+replan_delay = 0.05
+# Lean mode keeps only coordinates and lengths in the networkx graph, moves
+# speed/oneway/name into typed arrays and undoes obstacles from a journal
+# instead of holding a second full copy of the graph
+lean_mode = os.environ.get('LEAN_GRAPH') == '1'
+keep_geometry = os.environ.get('KEEP_GEOMETRY') == '1'
+# Comma separated traffic feeds read after the graph is loaded: file:<path> or tcp:<host>:<port>
+traffic_sources = [spec for spec in os.environ.get('TRAFFIC_FEED', '').split(',') if spec]
+# HOT_ROUTES=1 answers length algorithms for warm pairs from memory. Off by
+# default: a cached answer takes no search time, so the algorithms no longer compare
+serve_hot_routes = os.environ.get('HOT_ROUTES') == '1'
+# Preload mode loads the graph at import time, e.g. in a gunicorn master
+# started with --preload, so forked workers share it copy-on-write
+preload_graph = os.environ.get('PRELOAD_GRAPH') == '1'
 
-# Load Chennai map
 cache_file = 'cache/graph.graphml'
-try:
-    if os.path.exists(cache_file):
-        print("Loading graph from cache...")
-        start_time = time.time()
-        city_map = ox.load_graphml(cache_file)
-        load_time = time.time() - start_time
-        print(f"Graph loaded in {load_time:.2f}s - Nodes: {len(city_map.nodes)}, Edges: {len(city_map.edges)}")
-        backup_map = city_map.copy()
-    else:
-        print("Downloading Chennai map...")
-        start_time = time.time()
-        city_map = ox.graph_from_place("Chennai, Tamil Nadu, India", network_type="drive", simplify=True)
-        download_time = time.time() - start_time
-        print(f"Graph downloaded in {download_time:.2f}s")
-        ox.save_graphml(city_map, cache_file)
-        backup_map = city_map.copy()
-except Exception as e:
-    print(f"FATAL: Could not load map: {str(e)}")
-    raise
-
-# Store coordinates for faster calculations
-node_positions = {node: (data['y'], data['x']) for node, data in city_map.nodes(data=True)}
+
+def load_city_map():
+    global city_map, backup_map, road_arrays, node_positions, graph_error, graph_load_time
+
+    with load_lock:
+        if graph_ready.is_set():
+            return
+
+        import osmnx as ox
+        from lean_graph import RoadArrays, NodePositions, slim_graph
+
+        # Load Chennai map
+        try:
+            start_time = time.time()
+            if os.path.exists(cache_file):
+                print("Loading graph from cache...")
+                graph = ox.load_graphml(cache_file)
+                load_time = time.time() - start_time
+                print(f"Graph loaded in {load_time:.2f}s - Nodes: {len(graph.nodes)}, Edges: {len(graph.edges)}")
+            else:
+                print("Downloading Chennai map...")
+                graph = ox.graph_from_place("Chennai, Tamil Nadu, India", network_type="drive", simplify=True)
+                download_time = time.time() - start_time
+                print(f"Graph downloaded in {download_time:.2f}s")
+                ox.save_graphml(graph, cache_file)
+
+            # Routing attributes as typed arrays, indexed by node and edge id
+            arrays = RoadArrays(graph, keep_geometry=keep_geometry or not lean_mode)
+
+            if lean_mode:
+                slim_graph(graph, keep_geometry)
+                # Shares the node numbering of the pooled search state
+                positions = NodePositions(arrays, pool_for(graph).index)
+                print(f"Lean graph mode: {arrays.edge_count} edges in typed arrays, geometry {'kept' if keep_geometry else 'dropped'}")
+            else:
+                backup_map = graph.copy()
+                # Store coordinates for faster calculations
+                positions = {node: (data['y'], data['x']) for node, data in graph.nodes(data=True)}
+
+            # Node numbering for the pooled search state
+            pool_for(graph)
+            connectivity.load(graph)
+            # Cells come from cache/partition.npz when it matches the graph
+            overlay.load(graph)
+            traffic.load(arrays)
+        except Exception as e:
+            graph_error = str(e)
+            print(f"FATAL: Could not load map: {str(e)}")
+            raise
+
+        city_map = graph
+        road_arrays = arrays
+        node_positions = positions
+        graph_error = None
+        graph_load_time = time.time() - start_time
+        graph_ready.set()
+        print(f"Graph ready after {graph_load_time:.2f}s")
+
+        hot_routes.load()
+
+def start_graph_services():
+    # Threads that need the loaded graph. They run in the serving process, so
+    # a gunicorn master that preloads the graph leaves them to its workers
+    global graph_services_started
+    with load_lock:
+        if graph_services_started:
+            return
+        graph_services_started = True
+
+    for spec in traffic_sources:
+        traffic_feed.add_source(spec)
+    Thread(target=warm_hot_routes, daemon=True).start()
+
+def load_city_map_in_background():
+    try:
+        load_city_map()
+        start_graph_services()
+    except Exception:
+        pass
+
+def warm_hot_routes():
+    if not serve_hot_routes:
+        return
+    try:
+        epoch = hot_routes.current_epoch()
+        hot_routes.warm(GraphView(city_map, road_arrays, traffic.current()), csgraph, epoch)
+    except Exception as e:
+        print(f"Error warming hot routes: {str(e)}")
+
+def require_graph():
+    if not graph_ready.is_set():
+        if graph_error:
+            raise HTTPException(status_code=503, detail=f'Map failed to load: {graph_error}')
+        raise HTTPException(status_code=503, detail='Map is still loading, try again shortly')
+
+if preload_graph:
+    load_city_map()
+    # Keep the graph out of the cyclic GC so collections in forked workers do not touch (and copy) its pages
+    gc.freeze()
 
 def add_timeout(func):
     @wraps(func)
@@ -88,6 +279,7 @@ def add_timeout(func):
 
 @lru_cache(maxsize=500)
 def find_location(place_name):
+    from geopy.geocoders import Nominatim
     try:
         finder = Nominatim(user_agent="chennai_pathfinder_app_v6")
         search_query = f"{place_name}, Chennai, Tamil Nadu, India"
@@ -145,101 +337,101 @@ def find_shortest_path_parallel(graph, start, end):
     start_time = time.time()
     
     try:
-        with map_lock:
-            local_graph = graph.copy()
-        
-        queue = SafeQueue()
-        distances = {node: float('inf') for node in local_graph.nodes()}
-        distances[start] = 0
-        previous = {}
-        visited = set()
+        # Labels live in pooled per-node arrays, so a query only pays for the nodes it reaches
+        pool = pool_for(graph)
+        index, nodes = pool.index, pool.nodes
         
-        visited_lock = RLock()
-        distance_lock = RLock()
-        previous_lock = RLock()
-        
-        queue.add(0, start)
-        found_target = Event()
-        
-        def worker():
-            local_visited = set()
+        with pool.borrow() as state:
+            distances, previous, stamp, visited = state.dist, state.parent, state.stamp, state.done
+            generation = state.generation
+            start_index, end_index = index[start], index[end]
+            distances[start_index] = 0
+            previous[start_index] = NO_PARENT
+            stamp[start_index] = generation
             
-            while not found_target.is_set() and not queue.is_empty():
-                try:
-                    current_dist, current_node = queue.get()
-                    
-                    if current_node is None:
-                        break
-                    
-                    if current_node in local_visited:
-                        continue
-                    
-                    with visited_lock:
-                        if current_node in visited:
-                            continue
-                        visited.add(current_node)
-                    
-                    local_visited.add(current_node)
-                    
-                    if current_node == end:
-                        found_target.set()
-                        break
-                    
+            queue = SafeQueue()
+            visited_lock = RLock()
+            distance_lock = RLock()
+            
+            queue.add(0, start_index)
+            found_target = Event()
+            
+            def worker():
+                local_visited = set()
+                
+                while not found_target.is_set() and not queue.is_empty():
                     try:
-                        neighbors = list(local_graph.neighbors(current_node))
-                    except:
-                        continue
-                    
-                    for neighbor in neighbors:
-                        if neighbor in local_visited:
+                        current_dist, current = queue.get()
+                        
+                        if current is None:
+                            break
+                        
+                        if current in local_visited:
                             continue
                         
+                        with visited_lock:
+                            if visited[current] == generation:
+                                continue
+                            visited[current] = generation
+                        
+                        local_visited.add(current)
+                        
+                        if current == end_index:
+                            found_target.set()
+                            break
+                        
+                        current_node = nodes[current]
                         try:
-                            edge_data = local_graph[current_node][neighbor]
-                            if isinstance(edge_data, dict):
-                                road_length = edge_data.get('length', edge_data.get(0, {}).get('length', 1))
-                            else:
-                                road_length = list(edge_data.values())[0].get('length', 1)
-                            
-                            new_distance = current_dist + road_length
-                            
-                            with distance_lock:
-                                if new_distance < distances[neighbor]:
-                                    distances[neighbor] = new_distance
-                                    with previous_lock:
-                                        previous[neighbor] = current_node
-                                    queue.add(new_distance, neighbor)
-                        except Exception:
+                            neighbors = list(graph.neighbors(current_node))
+                        except:
                             continue
+                        
+                        for neighbor_node in neighbors:
+                            neighbor = index[neighbor_node]
+                            if neighbor in local_visited:
+                                continue
                             
-                except Exception:
-                    continue
-        
-        workers = []
-        for _ in range(num_workers):
-            thread = Thread(target=worker, daemon=True)
-            thread.start()
-            workers.append(thread)
-        
-        start_wait = time.time()
-        while not found_target.is_set() and (time.time() - start_wait) < timeout_seconds:
-            time.sleep(0.01)
-        
-        queue.close()
-        found_target.set()
-        
-        for thread in workers:
-            thread.join(timeout=1.0)
-        
-        # Build path
-        path = []
-        if end in previous or start == end:
-            current = end
-            while current is not None:
-                path.append(current)
-                with previous_lock:
-                    current = previous.get(current)
-            path.reverse()
+                            try:
+                                road_length = edge_length(graph, current_node, neighbor_node)
+                                
+                                new_distance = current_dist + road_length
+                                
+                                with distance_lock:
+                                    if stamp[neighbor] != generation or new_distance < distances[neighbor]:
+                                        distances[neighbor] = new_distance
+                                        previous[neighbor] = current
+                                        stamp[neighbor] = generation
+                                        queue.add(new_distance, neighbor)
+                            except Exception:
+                                continue
+                                
+                    except Exception:
+                        continue
+            
+            workers = []
+            for _ in range(num_workers):
+                thread = Thread(target=worker, daemon=True)
+                thread.start()
+                workers.append(thread)
+            
+            start_wait = time.time()
+            while not found_target.is_set() and (time.time() - start_wait) < timeout_seconds:
+                time.sleep(0.01)
+            
+            queue.close()
+            found_target.set()
+            
+            for thread in workers:
+                thread.join(timeout=1.0)
+            
+            # Build path
+            path = []
+            if visited[end_index] == generation or start == end:
+                with distance_lock:
+                    path = [nodes[i] for i in state.path_to(end_index)]
+            
+            if any(thread.is_alive() for thread in workers):
+                state.retire()
         
         if not path and start != end:
             return None
@@ -258,109 +450,102 @@ def find_smart_path_parallel(graph, start, end):
     start_time = time.time()
     
     try:
-        with map_lock:
-            local_graph = graph.copy()
-        
-        queue = SafeQueue()
-        cost_so_far = {node: float('inf') for node in local_graph.nodes()}
-        cost_so_far[start] = 0
-        estimated_cost = {node: float('inf') for node in local_graph.nodes()}
-        estimated_cost[start] = calculate_straight_distance(start, end)
-        previous = {}
-        visited = set()
+        pool = pool_for(graph)
+        index, nodes = pool.index, pool.nodes
         
-        visited_lock = RLock()
-        cost_lock = RLock()
-        estimate_lock = RLock()
-        previous_lock = RLock()
-        
-        queue.add(estimated_cost[start], start)
-        found_target = Event()
-        
-        def worker():
-            local_visited = set()
+        with pool.borrow() as state:
+            cost_so_far, previous, stamp, visited = state.dist, state.parent, state.stamp, state.done
+            generation = state.generation
+            start_index, end_index = index[start], index[end]
+            cost_so_far[start_index] = 0
+            previous[start_index] = NO_PARENT
+            stamp[start_index] = generation
             
-            while not found_target.is_set() and not queue.is_empty():
-                try:
-                    current_f, current_node = queue.get()
-                    
-                    if current_node is None:
-                        break
-                    
-                    if current_node in local_visited:
-                        continue
-                    
-                    with visited_lock:
-                        if current_node in visited:
-                            continue
-                        visited.add(current_node)
-                    
-                    local_visited.add(current_node)
-                    
-                    if current_node == end:
-                        found_target.set()
-                        break
-                    
+            queue = SafeQueue()
+            visited_lock = RLock()
+            cost_lock = RLock()
+            
+            queue.add(calculate_straight_distance(start, end), start_index)
+            found_target = Event()
+            
+            def worker():
+                local_visited = set()
+                
+                while not found_target.is_set() and not queue.is_empty():
                     try:
-                        neighbors = list(local_graph.neighbors(current_node))
-                    except:
-                        continue
-                    
-                    for neighbor in neighbors:
-                        if neighbor in local_visited:
+                        current_f, current = queue.get()
+                        
+                        if current is None:
+                            break
+                        
+                        if current in local_visited:
                             continue
                         
+                        with visited_lock:
+                            if visited[current] == generation:
+                                continue
+                            visited[current] = generation
+                        
+                        local_visited.add(current)
+                        
+                        if current == end_index:
+                            found_target.set()
+                            break
+                        
+                        current_node = nodes[current]
                         try:
-                            edge_data = local_graph[current_node][neighbor]
-                            if isinstance(edge_data, dict):
-                                road_length = edge_data.get('length', edge_data.get(0, {}).get('length', 1))
-                            else:
-                                road_length = list(edge_data.values())[0].get('length', 1)
+                            neighbors = list(graph.neighbors(current_node))
+                        except:
+                            continue
+                        
+                        for neighbor_node in neighbors:
+                            neighbor = index[neighbor_node]
+                            if neighbor in local_visited:
+                                continue
                             
-                            with cost_lock:
-                                new_cost = cost_so_far[current_node] + road_length
+                            try:
+                                road_length = edge_length(graph, current_node, neighbor_node)
                                 
-                                if new_cost < cost_so_far[neighbor]:
-                                    cost_so_far[neighbor] = new_cost
-                                    with previous_lock:
-                                        previous[neighbor] = current_node
-                                    
-                                    total_cost = new_cost + calculate_straight_distance(neighbor, end)
-                                    with estimate_lock:
-                                        estimated_cost[neighbor] = total_cost
+                                with cost_lock:
+                                    new_cost = cost_so_far[current] + road_length
                                     
-                                    queue.add(total_cost, neighbor)
-                        except Exception:
-                            continue
-                            
-                except Exception:
-                    continue
-        
-        workers = []
-        for _ in range(num_workers):
-            thread = Thread(target=worker, daemon=True)
-            thread.start()
-            workers.append(thread)
-        
-        start_wait = time.time()
-        while not found_target.is_set() and (time.time() - start_wait) < timeout_seconds:
-            time.sleep(0.01)
-        
-        queue.close()
-        found_target.set()
-        
-        for thread in workers:
-            thread.join(timeout=1.0)
-        
-        # Build path
-        path = []
-        if end in previous or start == end:
-            current = end
-            while current is not None:
-                path.append(current)
-                with previous_lock:
-                    current = previous.get(current)
-            path.reverse()
+                                    if stamp[neighbor] != generation or new_cost < cost_so_far[neighbor]:
+                                        cost_so_far[neighbor] = new_cost
+                                        previous[neighbor] = current
+                                        stamp[neighbor] = generation
+                                        
+                                        total_cost = new_cost + calculate_straight_distance(neighbor_node, end)
+                                        queue.add(total_cost, neighbor)
+                            except Exception:
+                                continue
+                                
+                    except Exception:
+                        continue
+            
+            workers = []
+            for _ in range(num_workers):
+                thread = Thread(target=worker, daemon=True)
+                thread.start()
+                workers.append(thread)
+            
+            start_wait = time.time()
+            while not found_target.is_set() and (time.time() - start_wait) < timeout_seconds:
+                time.sleep(0.01)
+            
+            queue.close()
+            found_target.set()
+            
+            for thread in workers:
+                thread.join(timeout=1.0)
+            
+            # Build path
+            path = []
+            if visited[end_index] == generation or start == end:
+                with cost_lock:
+                    path = [nodes[i] for i in state.path_to(end_index)]
+            
+            if any(thread.is_alive() for thread in workers):
+                state.retire()
         
         if not path and start != end:
             return None
@@ -375,6 +560,7 @@ def find_smart_path_parallel(graph, start, end):
 
 @add_timeout
 def find_shortest_path_simple(graph, start, end):
+    import networkx as nx
     print("Starting simple shortest path")
     start_time = time.time()
     try:
@@ -393,6 +579,7 @@ def find_shortest_path_simple(graph, start, end):
 
 @add_timeout
 def find_smart_path_simple(graph, start, end):
+    import networkx as nx
     print("Starting simple smart path")
     start_time = time.time()
     try:
@@ -409,20 +596,78 @@ def find_smart_path_simple(graph, start, end):
         print("No path found in simple smart path")
         return None
 
-def block_roads_near_obstacle(graph, obstacle_location, radius=0.002):
+@add_timeout
+def find_path_overlay(graph, start, end):
+    print("Starting multi-level overlay path")
+    start_time = time.time()
+    result = overlay.shortest_path(graph, start, end, heuristic=calculate_straight_distance)
+    if result is None:
+        print("No path found in multi-level overlay path")
+        return None
+    
+    end_time = time.time()
+    print(f"Multi-level overlay path done in {end_time - start_time:.4f}s")
+    return result[1]
+
+@add_timeout
+def find_path_live_traffic(graph, start, end, snapshot=None):
+    print("Starting live traffic path")
+    start_time = time.time()
+    result = traffic.shortest_path(graph, start, end, snapshot, deadline=start_time + timeout_seconds)
+    if result is None:
+        print("No path found in live traffic path")
+        return None
+    
+    end_time = time.time()
+    print(f"Live traffic path done in {end_time - start_time:.4f}s")
+    return result[1]
+
+@add_timeout
+def find_path_csgraph(view, start, end, weight, deadline):
+    print("Starting csgraph Dijkstra path")
+    start_time = time.time()
+    path, stats = csgraph.shortest_path(view, start, end, weight, deadline)
+    if path is None:
+        print("No path found in csgraph Dijkstra path")
+        return None, stats
+    
+    end_time = time.time()
+    print(f"csgraph Dijkstra path done in {end_time - start_time:.4f}s")
+    return path, stats
+
+# Algorithms run by /find_path, in this order. A new algorithm only needs a
+# func(view, source, target, weight, deadline) -> (path, stats) registered here.
+registry.add('parallel_dijkstra', graph_search(find_shortest_path_parallel),
+             description='Dijkstra with worker threads sharing one queue')
+registry.add('parallel_astar', graph_search(find_smart_path_parallel),
+             description='A* with worker threads sharing one queue')
+registry.add('sequential_dijkstra', graph_search(find_shortest_path_simple),
+             description='networkx Dijkstra')
+registry.add('sequential_astar', graph_search(find_smart_path_simple),
+             description='networkx A* with a straight-line heuristic')
+registry.add('multilevel_overlay', graph_search(find_path_overlay),
+             description='A* over the multi-level cell overlay')
+registry.add('live_traffic', lambda view, start, end, weight, deadline: (find_path_live_traffic(view.graph, start, end, view.snapshot), {}),
+             weight='travel_time', description='A* on travel time under the live traffic weights')
+registry.add('csgraph_dijkstra', find_path_csgraph,
+             description='scipy.sparse.csgraph Dijkstra on the CSR road matrix')
+
+def block_roads_near_obstacle(graph, obstacle_location, radius=0.002, removed=None):
     lat, lng = obstacle_location
     roads_to_block = []
     
-    for u, v, data in graph.edges(data=True):
+    for u, v, key, data in graph.edges(keys=True, data=True):
         u_lat, u_lng = graph.nodes[u]['y'], graph.nodes[u]['x']
         v_lat, v_lng = graph.nodes[v]['y'], graph.nodes[v]['x']
         
         if road_hits_obstacle(u_lat, u_lng, v_lat, v_lng, lat, lng, radius):
-            roads_to_block.append((u, v))
+            roads_to_block.append((u, v, key, data))
     
     if roads_to_block:
         print(f"Blocking {len(roads_to_block)} roads near obstacle at ({lat:.4f}, {lng:.4f})")
-        graph.remove_edges_from(roads_to_block)
+        graph.remove_edges_from([(u, v, key) for u, v, key, _ in roads_to_block])
+        if removed is not None:
+            removed.extend(roads_to_block)
         return True
     return False
 
@@ -449,11 +694,25 @@ def road_hits_obstacle(x1, y1, x2, y2, obs_x, obs_y, radius):
     
     return math.sqrt((closest_x - obs_x)**2 + (closest_y - obs_y)**2) <= radius
 
-def calculate_trip_info(graph, path):
-    total_distance = sum(graph[path[i]][path[i+1]][0]['length'] for i in range(len(path)-1))
+def route_output(view, edges, weight='length', node=None):
+    # Points, distance and time of a route by array gathers over its edge ids.
+    # The points include the interior geometry of every road; a route without
+    # edges is the single junction node
+    arrays = view.arrays
+    seconds = float(view.snapshot.travel_time[edges].sum()) if weight == 'travel_time' else None
+    trip_info = trip_info_for_distance(arrays.route_length(edges), seconds)
+    return {
+        'path': arrays.route_points(edges) if len(edges) else [list(node_positions[node])],
+        'edges': edges.tolist(),
+        'distance': trip_info['distance'],
+        'travel_time': trip_info['travel_time']
+    }
+
+def trip_info_for_distance(total_distance, seconds=None):
     distance_km = total_distance / 1000
     avg_speed = 40
-    time_hours = distance_km / avg_speed
+    # Travel time from live speeds when known, else at the average speed
+    time_hours = seconds / 3600 if seconds is not None else distance_km / avg_speed
     hours = int(time_hours)
     minutes = int((time_hours - hours) * 60)
     
@@ -465,8 +724,32 @@ def calculate_trip_info(graph, path):
         }
     }
 
-def update_all_paths():
-    global saved_routes, route_points
+def memory_report():
+    from lean_graph import estimate_graph_bytes, estimate_mapping_bytes, process_memory, MB
+    rss, peak = process_memory()
+    array_usage = road_arrays.memory_usage()
+    return {
+        'pid': os.getpid(),
+        'lean_mode': lean_mode,
+        'keep_geometry': keep_geometry or not lean_mode,
+        'rss_mb': rss / MB if rss is not None else None,
+        'peak_rss_mb': peak / MB,
+        'nodes': len(city_map.nodes),
+        'edges': len(city_map.edges),
+        'blocked_roads': len(removed_roads),
+        'estimated_mb': {
+            'city_map': estimate_graph_bytes(city_map) / MB,
+            'backup_map': estimate_graph_bytes(backup_map) / MB,
+            'node_positions': estimate_mapping_bytes(node_positions) / MB,
+            'road_arrays': sum(array_usage.values()) / MB
+        },
+        'road_arrays_mb': {name: size / MB for name, size in array_usage.items()},
+        'search_states': pool_for(city_map).memory_usage()
+    }
+
+def update_all_paths(track=False):
+    import osmnx as ox
+    global saved_routes, route_points, route_algorithms
     
     if not route_points:
         return None
@@ -474,40 +757,51 @@ def update_all_paths():
     start, end = route_points
     
     try:
-        start_node = ox.nearest_nodes(city_map, start['lng'], start['lat'])
-        end_node = ox.nearest_nodes(city_map, end['lng'], end['lat'])
+        with phase('snapping'):
+            start_node = ox.nearest_nodes(city_map, start['lng'], start['lat'])
+            end_node = ox.nearest_nodes(city_map, end['lng'], end['lat'])
         
         print(f"Updating paths from {start_node} to {end_node}")
         
-        if not nx.has_path(city_map, start_node, end_node):
+        with phase('connectivity'):
+            reachable = connectivity.can_reach(city_map, start_node, end_node)
+        if not reachable:
             print("No path exists after adding obstacles")
             return {'error': 'No path exists between these points after adding obstacles.'}
+        # Only pairs with a route are worth warming
+        if track:
+            hot_routes.record(start_node, end_node)
         
         paths = {}
+        # One weight snapshot for the search and its travel time, even if the feed moves on
+        snapshot = traffic.current()
+        view = GraphView(city_map, road_arrays, snapshot, traffic)
+        algorithms = registry.select(route_algorithms)
+        # Every length algorithm looks for the same shortest route, which a warm pair already has
+        cached_path = None
+        if serve_hot_routes and any(algorithm.weight == 'length' for algorithm in algorithms):
+            cached_path = hot_routes.route(start_node, end_node)
         
-        # Try all algorithms
-        algorithms = [
-            ('parallel_dijkstra', find_shortest_path_parallel),
-            ('parallel_astar', find_smart_path_parallel),
-            ('sequential_dijkstra', find_shortest_path_simple),
-            ('sequential_astar', find_smart_path_simple)
-        ]
-        
-        for algo_name, algo_func in algorithms:
+        for algorithm in algorithms:
+            algo_name = algorithm.name
             try:
                 start_time = time.time()
-                path = algo_func(city_map, start_node, end_node)
+                with phase(f'search.{algo_name}'):
+                    if cached_path is not None and algorithm.weight == 'length':
+                        edges, stats = view.edge_path(cached_path), {'cached': True}
+                    else:
+                        edges, stats = algorithm.run(view, start_node, end_node, deadline=start_time + timeout_seconds)
                 end_time = time.time()
                 
-                if path:
-                    trip_info = calculate_trip_info(city_map, path)
-                    paths[algo_name] = {
-                        'path': [[city_map.nodes[node]['y'], city_map.nodes[node]['x']] for node in path],
-                        'time': end_time - start_time,
-                        'distance': trip_info['distance'],
-                        'travel_time': trip_info['travel_time']
-                    }
-                    print(f"{algo_name}: {end_time - start_time:.4f}s, {len(path)} nodes")
+                if edges is not None:
+                    with phase(f'metrics.{algo_name}'):
+                        paths[algo_name] = route_output(view, edges, algorithm.weight, start_node)
+                        paths[algo_name]['time'] = end_time - start_time
+                        if algorithm.weight == 'travel_time':
+                            paths[algo_name]['weights_version'] = snapshot.version
+                        if stats:
+                            paths[algo_name]['stats'] = stats
+                    print(f"{algo_name}: {end_time - start_time:.4f}s, {len(edges)} roads")
                 else:
                     paths[algo_name] = {'error': 'No path found or timeout'}
                     print(f"{algo_name}: No path found or timeout")
@@ -524,17 +818,201 @@ def update_all_paths():
         print(f"Error updating paths: {str(e)}")
         return {'error': str(e)}
 
+def group_vehicle_pairs(pairs):
+    # Each vehicle joins the bigger of its origin or destination group, so a
+    # depot shared by many vehicles costs one search instead of one per vehicle
+    origin_counts = {}
+    destination_counts = {}
+    for origin, destination in pairs:
+        origin_counts[origin] = origin_counts.get(origin, 0) + 1
+        destination_counts[destination] = destination_counts.get(destination, 0) + 1
+
+    groups = {}
+    for index, (origin, destination) in enumerate(pairs):
+        if origin_counts[origin] >= destination_counts[destination]:
+            key = ('origin', origin)
+        else:
+            key = ('destination', destination)
+        groups.setdefault(key, []).append(index)
+    return groups
+
+def plan_vehicle_group(graph, key, indexes, pairs, deadline, view=None):
+    # With a view the group runs on the csgraph backend
+    direction, shared_node = key
+    reverse = direction == 'destination'
+    targets = {pairs[i][0] if reverse else pairs[i][1] for i in indexes}
+
+    if view is not None:
+        # One csgraph run can not be stopped half way, so a group that starts
+        # after the deadline is not searched; its vehicles time out as in Python
+        results = {} if time.time() > deadline else csgraph.paths_from(view, shared_node, targets, reverse=reverse)
+    else:
+        results = shortest_paths_from(
+            graph, shared_node, targets,
+            reverse=reverse,
+            heuristic=calculate_straight_distance,
+            deadline=deadline
+        )
+
+    routes = {}
+    for i in indexes:
+        target = pairs[i][0] if reverse else pairs[i][1]
+        routes[i] = results.get(target)
+    return routes
+
+def stop_costs(graph, nodes, deadline, view=None):
+    # Stop-to-stop distance matrix and leg paths from one one-to-many search
+    # per stop. Pairs in different components are never searched.
+    count = len(nodes)
+    cost = [[0.0 if i == j else float('inf') for j in range(count)] for i in range(count)]
+    legs = {}
+
+    def search(i):
+        targets = {node for node in nodes if node != nodes[i] and connectivity.can_reach(graph, nodes[i], node)}
+        if not targets:
+            return i, {}
+        if view is not None:
+            # As in plan_vehicle_group: a csgraph run that would start after the deadline is skipped
+            if time.time() > deadline:
+                return i, {}
+            return i, csgraph.paths_from(view, nodes[i], targets)
+        return i, shortest_paths_from(graph, nodes[i], targets, deadline=deadline)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for i, results in executor.map(search, range(count)):
+            for j, node in enumerate(nodes):
+                if i != j and node in results:
+                    cost[i][j], legs[(i, j)] = results[node]
+                elif i != j and node == nodes[i]:
+                    cost[i][j], legs[(i, j)] = 0.0, [node]
+    return cost, legs
+
+def path_delta(old_path, new_path):
+    # Splice turning old_path into new_path: keep `start` points, drop `delete`, add `insert`
+    limit = min(len(old_path), len(new_path))
+    prefix = 0
+    while prefix < limit and old_path[prefix] == new_path[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old_path[-1 - suffix] == new_path[-1 - suffix]:
+        suffix += 1
+    return {
+        'start': prefix,
+        'delete': len(old_path) - prefix - suffix,
+        'insert': new_path[prefix:len(new_path) - suffix]
+    }
+
+def route_changes(old_routes, new_routes):
+    # Only algorithms whose route moved (or started/stopped failing) are listed
+    changed = {}
+    for algo_name, data in new_routes.items():
+        previous = old_routes.get(algo_name)
+        if 'error' in data:
+            if previous is None or 'error' not in previous:
+                changed[algo_name] = {'error': data['error']}
+            continue
+        old_path = previous.get('path', []) if previous else []
+        if old_path == data['path']:
+            continue
+        change = path_delta(old_path, data['path'])
+        # Edge ids are spliced like the points; the other fields are small and sent whole
+        old_edges = previous.get('edges', []) if previous else []
+        change['edges'] = path_delta(old_edges, data.get('edges', []))
+        change.update({key: value for key, value in data.items() if key not in ('path', 'edges')})
+        changed[algo_name] = change
+    return changed
+
+def route_snapshot():
+    return {'type': 'routes', 'version': routes_version, 'paths': published_routes}
+
+def publish_routes(paths, reason):
+    global published_routes, routes_version
+
+    with subscribers_lock:
+        if paths is None:
+            return
+        if 'error' in paths:
+            message = {'type': 'error', 'error': paths['error']}
+            new_routes = {}
+        elif reason == 'find_path' or not published_routes:
+            # After an error clients hold no routes, so a delta has nothing to apply to
+            message = {'type': 'routes', 'paths': paths}
+            new_routes = paths
+        else:
+            changed = route_changes(published_routes, paths)
+            new_routes = paths
+            if not changed:
+                published_routes = new_routes
+                return
+            message = {'type': 'delta', 'base_version': routes_version, 'changed': changed}
+
+        routes_version += 1
+        published_routes = new_routes
+        message.update({'version': routes_version, 'reason': reason})
+        for loop, queue in route_subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+def replan_worker():
+    while True:
+        replan_pending.wait()
+        time.sleep(replan_delay)
+        replan_pending.clear()
+        try:
+            with replan_lock:
+                if route_points:
+                    publish_routes(update_all_paths(), 'obstacles')
+        except Exception as e:
+            print(f"Error replanning routes: {str(e)}")
+
+def schedule_replan():
+    global replan_thread
+    with subscribers_lock:
+        if replan_thread is None:
+            replan_thread = Thread(target=replan_worker, daemon=True)
+            replan_thread.start()
+    replan_pending.set()
+
 # API endpoints
 @app.get('/')
 def home():
     return {
         "status": "Chennai Path Finding System",
         "version": "6.0",
-        "endpoints": ["/geocode", "/find_path", "/add_obstacle", "/clear_obstacles"],
-        "algorithms": ["parallel_dijkstra", "parallel_astar", "sequential_dijkstra", "sequential_astar"],
+        "endpoints": ["/geocode", "/find_path", "/find_alternatives", "/plan_batch", "/plan_trip", "/match_trace", "/add_obstacle", "/clear_obstacles", "/algorithms", "/traffic", "/ws/routes", "/memory", "/healthz", "/readyz"],
+        "algorithms": registry.names(),
         "note": "Find best routes in Chennai!"
     }
 
+@app.get('/healthz')
+def healthz():
+    if graph_ready.is_set():
+        graph_state = 'ready'
+    elif graph_error:
+        graph_state = 'failed'
+    else:
+        graph_state = 'loading'
+    return {
+        'status': 'ok',
+        'graph': graph_state,
+        'uptime': time.time() - started_at
+    }
+
+@app.get('/readyz')
+def readyz():
+    require_graph()
+    return {
+        'ready': True,
+        'nodes': len(city_map.nodes),
+        'edges': len(city_map.edges),
+        'load_time': graph_load_time,
+        'connectivity': connectivity.report(),
+        'overlay': overlay.report(),
+        'traffic': traffic.report(),
+        'csgraph': csgraph.report(),
+        'hot_routes': hot_routes.report(),
+        'map_matching': map_matcher.report()
+    }
+
 @app.post('/geocode')
 def geocode_place(request: LocationRequest):
     try:
@@ -549,26 +1027,35 @@ def geocode_place(request: LocationRequest):
 
 @app.post('/add_obstacle')
 def place_obstacle(request: ObstacleRequest):
+    require_graph()
     try:
         if not request.lat or not request.lng:
             raise HTTPException(status_code=400, detail='Missing coordinates')
         
         obstacle = (request.lat, request.lng)
-        blocked_roads.append(obstacle)
-        print(f"Added obstacle at {obstacle}")
-        
-        roads_modified = block_roads_near_obstacle(city_map, obstacle)
-        updated_paths = None
+        with recorder.capture('add_obstacle', {'lat': request.lat, 'lng': request.lng}) as record:
+            blocked_roads.append(obstacle)
+            print(f"Added obstacle at {obstacle}")
+            
+            removed_before = len(removed_roads)
+            roads_modified = block_roads_near_obstacle(city_map, obstacle, removed=removed_roads)
+            if roads_modified:
+                connectivity.remove_edges(city_map, removed_roads[removed_before:])
+                overlay.remove_edges(city_map, removed_roads[removed_before:])
+                traffic.block_edges(removed_roads[removed_before:])
+                hot_routes.invalidate()
+            record['result'] = {'recalculate': roads_modified}
         
-        if roads_modified and route_points:
-            updated_paths = update_all_paths()
-            print("Updated paths due to obstacle")
+        # Routes are replanned in the background and pushed over /ws/routes
+        replan_scheduled = bool(roads_modified and route_points)
+        if replan_scheduled:
+            schedule_replan()
         
         return {
             'success': True,
             'obstacle_placed': True,
             'recalculate': roads_modified,
-            'updated_paths': updated_paths
+            'replan_scheduled': replan_scheduled
         }
     except Exception as e:
         print(f"Error adding obstacle: {str(e)}")
@@ -576,47 +1063,426 @@ def place_obstacle(request: ObstacleRequest):
 
 @app.post('/clear_obstacles')
 def clear_obstacles():
+    require_graph()
     try:
         global city_map
-        blocked_roads.clear()
-        city_map = backup_map.copy()
+        with recorder.capture('clear_obstacles'):
+            blocked_roads.clear()
+            if lean_mode:
+                city_map.add_edges_from(removed_roads)
+            else:
+                city_map = backup_map.copy()
+            removed_roads.clear()
+            # Weights and cached routes first, so they follow the map even if an index fails to reset
+            traffic.reset_blocked()
+            hot_routes.invalidate()
+            connectivity.reset_to_base(city_map)
+            overlay.reset_to_base(city_map)
         print("Cleared all obstacles and reset map")
+        Thread(target=warm_hot_routes, daemon=True).start()
         
-        updated_paths = None
-        if route_points:
-            updated_paths = update_all_paths()
-            print("Updated paths after clearing obstacles")
+        replan_scheduled = bool(route_points)
+        if replan_scheduled:
+            schedule_replan()
         
         return {
             'success': True,
-            'updated_paths': updated_paths
+            'replan_scheduled': replan_scheduled
         }
     except Exception as e:
         print(f"Error clearing obstacles: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get('/algorithms')
+def algorithms():
+    return {'algorithms': registry.describe()}
+
+@app.get('/traffic')
+def traffic_status():
+    require_graph()
+    return traffic_feed.report()
+
+@app.post('/traffic')
+def update_traffic(request: TrafficRequest):
+    # Applies the updates as one batch and answers with the new weights version
+    require_graph()
+    try:
+        version, rejected = traffic_feed.apply_lines(request.updates)
+        return {'success': True, 'version': version if version is not None else traffic.current().version, 'rejected': rejected}
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f'Invalid traffic update: {e}')
+
+@app.post('/traffic/reset')
+def reset_traffic():
+    require_graph()
+    return {'success': True, 'version': traffic.reset()}
+
 @app.post('/find_path')
-def find_route(request: PathRequest):
-    global route_points
+def find_route(request: PathRequest, http_request: Request):
+    global route_points, route_algorithms
+    require_graph()
     
+    body = {'start': request.start, 'end': request.end}
+    if request.algorithms:
+        body['algorithms'] = request.algorithms
     try:
-        if not request.start or not request.end:
-            raise HTTPException(status_code=400, detail='Missing start or end point')
+        with profile_request(http_request, 'find_path') as profile, \
+                recorder.capture('find_path', body) as record:
+            if not request.start or not request.end:
+                raise HTTPException(status_code=400, detail='Missing start or end point')
+            try:
+                registry.select(request.algorithms)
+            except KeyError as e:
+                raise HTTPException(status_code=400, detail=e.args[0])
         
-        route_points = (request.start, request.end)
-        paths = update_all_paths()
+            # Waiting here means a background replan or another /find_path holds the lock
+            with phase('replan_lock'):
+                replan_lock.acquire()
+            try:
+                route_points = (request.start, request.end)
+                # Replans after obstacles run the same algorithms
+                route_algorithms = request.algorithms
+                paths = update_all_paths(track=True)
+                publish_routes(paths, 'find_path')
+            finally:
+                replan_lock.release()
         
-        if isinstance(paths, dict) and 'error' in paths:
-            raise HTTPException(status_code=400, detail=paths['error'])
+            if isinstance(paths, dict) and 'error' in paths:
+                raise HTTPException(status_code=400, detail=paths['error'])
         
-        return {'paths': paths}
+            record['result'] = route_digest(paths)
+            result = {'paths': paths}
+            return profile.respond(result) if profile else result
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error finding path: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post('/find_alternatives')
+def find_alternatives(request: AlternativesRequest, http_request: Request):
+    import osmnx as ox
+    require_graph()
+    try:
+        with profile_request(http_request, 'find_alternatives') as profile:
+            if not request.start or not request.end:
+                raise HTTPException(status_code=400, detail='Missing start or end point')
+            if request.k < 1 or request.k > max_alternatives:
+                raise HTTPException(status_code=400, detail=f'k must be between 1 and {max_alternatives}')
+            if request.method not in ('yen', 'penalty'):
+                raise HTTPException(status_code=400, detail="method must be 'yen' or 'penalty'")
+            if request.max_stretch < 1 or not 0 <= request.max_overlap <= 1:
+                raise HTTPException(status_code=400, detail='max_stretch must be >= 1 and max_overlap within [0, 1]')
+
+            with phase('snapping'):
+                start_node = ox.nearest_nodes(city_map, request.start['lng'], request.start['lat'])
+                end_node = ox.nearest_nodes(city_map, request.end['lng'], request.end['lat'])
+            with phase('connectivity'):
+                reachable = connectivity.can_reach(city_map, start_node, end_node)
+            if not reachable:
+                raise HTTPException(status_code=400, detail='No path exists between these points.')
+
+            with phase(f'search.{request.method}'):
+                result = find_alternative_routes(
+                    city_map, start_node, end_node,
+                    k=request.k,
+                    method=request.method,
+                    max_overlap=request.max_overlap,
+                    max_stretch=request.max_stretch,
+                    budget=alternatives_budget
+                )
+            if result is None:
+                raise HTTPException(status_code=400, detail='No path exists between these points.')
+
+            routes = []
+            view = GraphView(city_map, road_arrays, traffic.current(), traffic)
+            with phase('metrics'):
+                for route in result['routes']:
+                    edges = view.edge_path(route['nodes'])
+                    if edges is None:
+                        # An obstacle closed one of its roads since the search
+                        continue
+                    output = route_output(view, edges, node=route['nodes'][0])
+                    output['stretch'] = route['stretch']
+                    output['overlap'] = route['overlap']
+                    routes.append(output)
+            print(f"{request.method} alternatives: {len(routes)} routes from {result['searches']} searches in {result['time']:.4f}s")
+
+            response = {
+                'routes': routes,
+                'method': request.method,
+                'searches': result['searches'],
+                'time': result['time']
+            }
+            return profile.respond(response) if profile else response
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error finding alternatives: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/plan_batch')
+def plan_batch(request: BatchRequest, http_request: Request):
+    import osmnx as ox
+    require_graph()
+    try:
+        with profile_request(http_request, 'plan_batch') as profile:
+            if not request.vehicles:
+                raise HTTPException(status_code=400, detail='No vehicles to plan')
+            if len(request.vehicles) > max_batch_vehicles:
+                raise HTTPException(status_code=400, detail=f'At most {max_batch_vehicles} vehicles per batch')
+            if request.backend not in ('python', 'csgraph'):
+                raise HTTPException(status_code=400, detail="backend must be 'python' or 'csgraph'")
+
+            total_start = time.time()
+            graph = city_map
+            view = GraphView(graph, road_arrays, traffic.current(), traffic)
+            search_view = view if request.backend == 'csgraph' else None
+
+            # Snap every start and end point in one vectorised lookup
+            lngs = [v.start['lng'] for v in request.vehicles] + [v.end['lng'] for v in request.vehicles]
+            lats = [v.start['lat'] for v in request.vehicles] + [v.end['lat'] for v in request.vehicles]
+            with phase('snapping'):
+                nodes = ox.nearest_nodes(graph, lngs, lats)
+            count = len(request.vehicles)
+            pairs = list(zip(nodes[:count], nodes[count:]))
+            snap_time = time.time() - total_start
+
+            search_start = time.time()
+            deadline = search_start + timeout_seconds
+
+            # Unreachable pairs would otherwise search the whole graph before giving up
+            with phase('connectivity'):
+                reachable = [i for i, (origin, destination) in enumerate(pairs)
+                             if connectivity.can_reach(graph, origin, destination)]
+            groups = {
+                key: [reachable[i] for i in indexes]
+                for key, indexes in group_vehicle_pairs([pairs[i] for i in reachable]).items()
+            }
+            routes = {}
+
+            with phase('search'), ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = [
+                    executor.submit(plan_vehicle_group, graph, key, indexes, pairs, deadline, search_view)
+                    for key, indexes in groups.items()
+                ]
+                for future in as_completed(futures):
+                    routes.update(future.result())
+            search_time = time.time() - search_start
+
+            results = []
+            routed = 0
+            for i, vehicle in enumerate(request.vehicles):
+                vehicle_id = vehicle.id if vehicle.id is not None else str(i)
+                route = routes.get(i)
+                if route is None:
+                    if not connectivity.can_reach(graph, *pairs[i]):
+                        results.append({'id': vehicle_id, 'error': 'No path exists between these points.'})
+                    else:
+                        results.append({'id': vehicle_id, 'error': 'No path found or timeout'})
+                    continue
+                _, path = route
+                edges = view.edge_path(path)
+                if edges is None:
+                    results.append({'id': vehicle_id, 'error': 'A road on the route was closed during planning.'})
+                    continue
+                results.append({'id': vehicle_id, **route_output(view, edges, node=path[0])})
+                routed += 1
+
+            total_time = time.time() - total_start
+            print(f"Planned {routed}/{count} vehicles in {len(groups)} groups in {total_time:.4f}s")
+
+            response = {
+                'routes': results,
+                'timing': {
+                    'vehicles': count,
+                    'backend': request.backend,
+                    'routed': routed,
+                    'groups': len(groups),
+                    'workers': num_workers,
+                    'snap_time': snap_time,
+                    'search_time': search_time,
+                    'total_time': total_time
+                }
+            }
+            return profile.respond(response) if profile else response
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error planning batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/plan_trip')
+def plan_trip(request: TripRequest, http_request: Request):
+    import osmnx as ox
+    require_graph()
+    try:
+        with profile_request(http_request, 'plan_trip') as profile:
+            count = len(request.stops)
+            if count < 2:
+                raise HTTPException(status_code=400, detail='A trip needs at least two stops')
+            if count > max_trip_stops:
+                raise HTTPException(status_code=400, detail=f'At most {max_trip_stops} stops per trip')
+            if request.backend not in ('python', 'csgraph'):
+                raise HTTPException(status_code=400, detail="backend must be 'python' or 'csgraph'")
+
+            total_start = time.time()
+            graph = city_map
+            with phase('snapping'):
+                nodes = ox.nearest_nodes(graph, [stop['lng'] for stop in request.stops], [stop['lat'] for stop in request.stops])
+                nodes = [int(node) for node in nodes]
+
+            matrix_start = time.time()
+            deadline = matrix_start + timeout_seconds
+            view = GraphView(graph, road_arrays, traffic.current(), traffic)
+            with phase('search'):
+                cost, legs = stop_costs(graph, nodes, deadline, view if request.backend == 'csgraph' else None)
+            matrix_time = time.time() - matrix_start
+
+            order_start = time.time()
+            given = list(range(count))
+            with phase('ordering'):
+                if request.optimize:
+                    order = order_stops(cost, request.fixed_end, request.round_trip, deadline=time.time() + timeout_seconds)
+                else:
+                    order = given
+            order_time = time.time() - order_start
+
+            visits = order + [order[0]] if request.round_trip else order
+            missing = [(a, b) for a, b in zip(visits, visits[1:]) if (a, b) not in legs]
+            if missing:
+                a, b = missing[0]
+                raise HTTPException(status_code=400, detail=f'No path exists from stop {a} to stop {b}.')
+
+            with phase('metrics'):
+                import numpy as np
+                route_legs = []
+                leg_edges = []
+                for a, b in zip(visits, visits[1:]):
+                    leg = legs[(a, b)]
+                    edges = view.edge_path(leg)
+                    if edges is None:
+                        raise HTTPException(status_code=400, detail=f'A road from stop {a} to stop {b} was closed during planning.')
+                    route_legs.append({'from': a, 'to': b, **route_output(view, edges, node=leg[0])})
+                    leg_edges.append(edges)
+                trip = route_output(view, np.concatenate(leg_edges), node=nodes[0])
+
+            total_time = time.time() - total_start
+            print(f"Planned trip over {count} stops in {total_time:.4f}s")
+
+            response = {
+                'order': order,
+                'legs': route_legs,
+                **trip,
+                'given_order_distance': tour_cost(cost, given, request.round_trip) / 1000,
+                'timing': {
+                    'stops': count,
+                    'backend': request.backend,
+                    'matrix_time': matrix_time,
+                    'order_time': order_time,
+                    'total_time': total_time
+                }
+            }
+            return profile.respond(response) if profile else response
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error planning trip: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/match_trace')
+def match_trace(request: TraceRequest, http_request: Request):
+    require_graph()
+    try:
+        with profile_request(http_request, 'match_trace') as profile:
+            if len(request.points) > max_trace_points:
+                raise HTTPException(status_code=400, detail=f'At most {max_trace_points} points per request')
+            try:
+                points = [(float(point['lat']), float(point['lng'])) for point in request.points]
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail='Every point needs a numeric lat and lng')
+
+            total_start = time.time()
+            with phase('index'):
+                map_matcher.load(road_arrays)
+            match_start = time.time()
+            with phase('matching'):
+                matched, unmatched, pending = map_matcher.feed(request.vehicle_id, points, request.final)
+            match_time = time.time() - match_start
+            total_time = time.time() - total_start
+
+            response = {
+                'vehicle_id': request.vehicle_id,
+                'matched': matched,
+                'unmatched': unmatched,
+                'pending': pending,
+                'timing': {
+                    'points': len(points),
+                    'match_time': match_time,
+                    'total_time': total_time,
+                    'points_per_second': len(points) / match_time if match_time > 0 else None
+                }
+            }
+            return profile.respond(response) if profile else response
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error matching trace: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.websocket('/ws/routes')
+async def route_updates(websocket: WebSocket):
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    subscriber = (loop, queue)
+    
+    # Registering and taking the snapshot together: every later message is newer
+    with subscribers_lock:
+        route_subscribers.add(subscriber)
+        queue.put_nowait(route_snapshot())
+    
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+    
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            # A client that missed a delta asks for the full routes again
+            if await websocket.receive_text() == 'snapshot':
+                with subscribers_lock:
+                    queue.put_nowait(route_snapshot())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        with subscribers_lock:
+            route_subscribers.discard(subscriber)
+
+@app.get('/profiles/{file_name}')
+def get_profile(file_name: str, http_request: Request):
+    # Stored profiles are behind the same token as taking them
+    if not profiling_allowed(http_request):
+        raise HTTPException(status_code=404, detail='Profile not found')
+    path = profile_path(file_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail='Profile not found')
+    return FileResponse(path, media_type='application/json')
+
+@app.get('/memory')
+def memory():
+    require_graph()
+    return memory_report()
+
 if __name__ == '__main__':
+    import sys
+    if '--memory-report' in sys.argv:
+        import json
+        load_city_map()
+        print(json.dumps(memory_report(), indent=2))
+        sys.exit(0)
+
     import uvicorn
     port = int(os.environ.get('PORT', 8000))
     uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,446 @@
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+
+INF = float('inf')
+
+# GPS noise (standard deviation of the distance to the true road), metres
+gps_sigma = 10.0
+# Scale of the allowed difference between driven and straight-line distance
+# of consecutive points, metres
+route_beta = 20.0
+# Roads further than this from a point are not candidates for it
+search_radius = 50.0
+max_candidates = 8
+# Points closer than this to the previous kept point add nothing but noise
+min_spacing = 2 * gps_sigma
+# The road distance between two points may be at most this multiple of their
+# straight-line distance plus slack, and never more than max_route_distance
+route_factor = 2.0
+route_slack = 200.0
+max_route_distance = 3000.0
+# Bounded searches are cached per start junction, up to this many
+search_cache_size = 20000
+# Long roads are cut into pieces no longer than this for the spatial index
+piece_length = 40.0
+# A vehicle's points wait at most this long for the Viterbi paths to agree
+# before the currently best one is taken
+max_lag = 30
+# Vehicles that sent nothing for this long are forgotten
+session_timeout = 600
+
+class RoadIndex:
+    # Roads as short straight pieces in a KD-tree, on a flat projection of the
+    # city in metres. Each piece knows its edge id and where along the road it starts.
+    def __init__(self, arrays):
+        import numpy as np
+        from scipy.spatial import cKDTree
+
+        self.arrays = arrays
+        self.lat0 = float(arrays.lat.mean())
+        self.lng0 = float(arrays.lng.mean())
+        self.kx = 111320.0 * math.cos(math.radians(self.lat0))
+        self.ky = 110540.0
+        x, y = self.project(arrays.lat, arrays.lng)
+
+        # Points of every road from u to v, interior geometry included when kept
+        edge_count = arrays.edge_count
+        if arrays.has_geometry:
+            interior = np.diff(arrays.geometry_indptr)
+        else:
+            interior = np.zeros(edge_count, dtype=np.int64)
+        point_counts = interior + 2
+        starts = np.zeros(edge_count, dtype=np.int64)
+        np.cumsum(point_counts[:-1], out=starts[1:])
+        px = np.empty(int(point_counts.sum()))
+        py = np.empty_like(px)
+        px[starts], py[starts] = x[arrays.edge_source], y[arrays.edge_source]
+        ends = starts + point_counts - 1
+        px[ends], py[ends] = x[arrays.edge_target], y[arrays.edge_target]
+        if arrays.has_geometry and len(arrays.geometry_points):
+            slots = np.repeat(starts + 1 - arrays.geometry_indptr[:-1], interior) + np.arange(int(interior.sum()))
+            px[slots], py[slots] = self.project(arrays.geometry_points[:, 0], arrays.geometry_points[:, 1])
+
+        # Straight segments between consecutive points of the same road
+        is_start = np.ones(len(px), dtype=np.bool_)
+        is_start[ends] = False
+        first = np.flatnonzero(is_start)
+        segment_edge = np.repeat(np.arange(edge_count), point_counts - 1)
+        ax, ay, bx, by = px[first], py[first], px[first + 1], py[first + 1]
+        segment_length = np.hypot(bx - ax, by - ay)
+        before = np.cumsum(segment_length) - segment_length
+        first_segment = np.zeros(edge_count, dtype=np.int64)
+        np.cumsum(point_counts[:-1] - 1, out=first_segment[1:])
+        segment_offset = before - before[first_segment][segment_edge]
+        self.drawn_length = np.add.reduceat(segment_length, first_segment)
+
+        # Pieces of at most piece_length, so a point near a piece is near its middle
+        parts = np.maximum(1, np.ceil(segment_length / piece_length)).astype(np.int64)
+        segment = np.repeat(np.arange(len(parts)), parts)
+        part = np.arange(len(segment)) - np.repeat(np.cumsum(parts) - parts, parts)
+        f0, f1 = part / parts[segment], (part + 1) / parts[segment]
+        dx, dy = (bx - ax)[segment], (by - ay)[segment]
+        self.ax, self.ay = ax[segment] + dx * f0, ay[segment] + dy * f0
+        self.bx, self.by = ax[segment] + dx * f1, ay[segment] + dy * f1
+        self.edge = segment_edge[segment]
+        self.offset = segment_offset[segment] + segment_length[segment] * f0
+        self.tree = cKDTree(np.column_stack(((self.ax + self.bx) / 2, (self.ay + self.by) / 2)))
+
+    def project(self, lat, lng):
+        return (lng - self.lng0) * self.kx, (lat - self.lat0) * self.ky
+
+    def unproject(self, x, y):
+        return self.lat0 + y / self.ky, self.lng0 + x / self.kx
+
+    def candidates(self, x, y):
+        # Per point, up to max_candidates (edge, offset along it, distance, x, y)
+        # for the closest point of each road within search_radius, closest first
+        import numpy as np
+
+        count = len(x)
+        if not count:
+            return []
+        found = self.tree.query_ball_point(np.column_stack((x, y)), search_radius + piece_length / 2)
+        sizes = np.fromiter((len(pieces) for pieces in found), dtype=np.int64, count=count)
+        results = [[] for _ in range(count)]
+        if not sizes.sum():
+            return results
+        pieces = np.fromiter((piece for found_pieces in found for piece in found_pieces), dtype=np.int64, count=int(sizes.sum()))
+        point = np.repeat(np.arange(count), sizes)
+
+        # Closest point of each piece
+        ax, ay = self.ax[pieces], self.ay[pieces]
+        dx, dy = self.bx[pieces] - ax, self.by[pieces] - ay
+        squared = dx * dx + dy * dy
+        t = ((x[point] - ax) * dx + (y[point] - ay) * dy) / np.where(squared > 0, squared, 1)
+        t = np.clip(t, 0, 1)
+        cx, cy = ax + t * dx, ay + t * dy
+        distance = np.hypot(x[point] - cx, y[point] - cy)
+
+        near = distance <= search_radius
+        pieces, point, distance, cx, cy, t = pieces[near], point[near], distance[near], cx[near], cy[near], t[near]
+        edge = self.edge[pieces]
+
+        # Best piece per road and point, then the closest roads per point
+        order = np.lexsort((distance, edge, point))
+        keep = np.ones(len(order), dtype=np.bool_)
+        keep[1:] = (point[order][1:] != point[order][:-1]) | (edge[order][1:] != edge[order][:-1])
+        order = order[keep]
+        order = order[np.lexsort((distance[order], point[order]))]
+        point_sorted = point[order]
+        group_start = np.searchsorted(point_sorted, point_sorted)
+        order = order[np.arange(len(order)) - group_start < max_candidates]
+
+        # Position along the road in road-length metres rather than drawn metres
+        along = self.offset[pieces[order]] + t[order] * np.hypot(dx[near][order], dy[near][order])
+        edges = edge[order]
+        drawn = self.drawn_length[edges]
+        along = along / np.where(drawn > 0, drawn, 1) * self.arrays.length[edges]
+
+        for p, e, o, d, px, py in zip(point[order].tolist(), edges.tolist(), along.tolist(),
+                                      distance[order].tolist(), cx[order].tolist(), cy[order].tolist()):
+            results[p].append((e, o, d, px, py))
+        return results
+
+class RoadDistances:
+    # Shortest road distances from a junction up to a limit, by length, on the
+    # road arrays. Obstacles are ignored: a trace is where the vehicle did drive.
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.indptr = arrays.indptr.tolist()
+        self.targets = arrays.edge_target.tolist()
+        self.lengths = arrays.length.tolist()
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, source, limit):
+        # (distance, previous junction) of every junction within limit of source
+        with self.lock:
+            cached = self.cache.get(source)
+            if cached is not None and cached[0] >= limit:
+                self.cache.move_to_end(source)
+                self.hits += 1
+                return cached[1], cached[2]
+            self.misses += 1
+
+        # Rounded up, so a slightly longer limit later is still a cache hit
+        limit = min(max_route_distance, math.ceil(limit / 250) * 250)
+        indptr, targets, lengths = self.indptr, self.targets, self.lengths
+        dist = {source: 0.0}
+        previous = {source: -1}
+        heap = [(0.0, source)]
+        done = set()
+        while heap:
+            d, i = heapq.heappop(heap)
+            if i in done:
+                continue
+            done.add(i)
+            for e in range(indptr[i], indptr[i + 1]):
+                j = targets[e]
+                new_dist = d + lengths[e]
+                if new_dist <= limit and new_dist < dist.get(j, INF):
+                    dist[j] = new_dist
+                    previous[j] = i
+                    heapq.heappush(heap, (new_dist, j))
+
+        with self.lock:
+            self.cache[source] = (limit, dist, previous)
+            self.cache.move_to_end(source)
+            while len(self.cache) > search_cache_size:
+                self.cache.popitem(last=False)
+        return dist, previous
+
+    def between(self, a, b, limit, with_path=False):
+        # Road distance from candidate a to candidate b, both (edge, offset, ...),
+        # and the junctions passed on the way. None when longer than limit
+        arrays = self.arrays
+        edge_a, offset_a, edge_b, offset_b = a[0], a[1], b[0], b[1]
+        if edge_a == edge_b and offset_b >= offset_a - gps_sigma:
+            # Same road, allowing for a point that jitters back a little
+            return max(0.0, offset_b - offset_a), []
+        head = self.lengths[edge_a] - offset_a
+        remaining = limit - head - offset_b
+        if remaining < 0:
+            return None
+        source, target = int(arrays.edge_target[edge_a]), int(arrays.edge_source[edge_b])
+        dist, previous = self.search(source, remaining)
+        middle = dist.get(target)
+        if middle is None or middle > remaining:
+            return None
+        path = []
+        if with_path:
+            node = target
+            while node != -1:
+                path.append(node)
+                node = previous[node]
+            path.reverse()
+        return head + middle + offset_b, path
+
+    def report(self):
+        with self.lock:
+            return {'cached_searches': len(self.cache), 'hits': self.hits, 'misses': self.misses}
+
+class TraceSession:
+    # Viterbi lattice of one vehicle since the last point everything agreed on
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = []
+        # steps[0] was already reported when anchored
+        self.anchored = False
+        self.last_xy = None
+        self.received = 0
+        self.skipped = 0
+        self.updated = time.time()
+
+class MapMatcher:
+    # Online HMM map matching (Newson and Krumm): hidden states are positions
+    # on roads near each GPS point, emissions score the distance to the point,
+    # transitions how far the road distance between consecutive positions is
+    # from their straight-line distance. A point is reported once all still
+    # possible paths agree on it, or after max_lag points at the latest.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.distances = None
+        self.sessions = {}
+        self.last_expiry = time.time()
+        self.build_time = None
+        self.points = 0
+
+    def load(self, arrays):
+        # The index is built on first use, a few seconds for the whole city
+        with self.lock:
+            if self.index is not None and self.index.arrays is arrays:
+                return
+            start_time = time.time()
+            self.index = RoadIndex(arrays)
+            self.distances = RoadDistances(arrays)
+            self.sessions = {}
+            self.build_time = time.time() - start_time
+        print(f"Built map matching index of {len(self.index.edge)} road pieces in {self.build_time:.2f}s")
+
+    def session(self, vehicle_id):
+        now = time.time()
+        with self.lock:
+            if now - self.last_expiry > 60:
+                self.last_expiry = now
+                for key in [key for key, session in self.sessions.items() if now - session.updated > session_timeout]:
+                    del self.sessions[key]
+            session = self.sessions.get(vehicle_id)
+            if session is None:
+                session = self.sessions[vehicle_id] = TraceSession()
+            session.updated = now
+            return session
+
+    def feed(self, vehicle_id, points, final=False):
+        # points are (lat, lng) pairs in the order they were recorded. Returns
+        # the points decided by this call and the indexes of points without a road in reach
+        import numpy as np
+
+        index, distances = self.index, self.distances
+        session = self.session(vehicle_id)
+        lat = np.array([point[0] for point in points], dtype=np.float64)
+        lng = np.array([point[1] for point in points], dtype=np.float64)
+        x, y = index.project(lat, lng)
+        found = index.candidates(x, y)
+
+        matched, unmatched = [], []
+        with session.lock:
+            for px, py, candidates in zip(x.tolist(), y.tolist(), found):
+                number = session.received
+                session.received += 1
+                if session.last_xy is not None and math.hypot(px - session.last_xy[0], py - session.last_xy[1]) < min_spacing:
+                    session.skipped += 1
+                    continue
+                if not candidates:
+                    unmatched.append(number)
+                    continue
+                step = self._step(session, number, (px, py), candidates)
+                if step is None:
+                    # No road route from any earlier position: the trace starts over here
+                    matched.extend(self._flush(session))
+                    step = self._first_step(number, (px, py), candidates)
+                session.steps.append(step)
+                session.last_xy = (px, py)
+                matched.extend(self._converged(session))
+            if final:
+                matched.extend(self._flush(session))
+            pending = len(session.steps) - (1 if session.anchored else 0)
+        if final:
+            with self.lock:
+                self.sessions.pop(vehicle_id, None)
+        with self.lock:
+            self.points += len(points)
+        return matched, unmatched, pending
+
+    def _first_step(self, number, xy, candidates):
+        return {
+            'number': number,
+            'xy': xy,
+            'candidates': candidates,
+            'scores': [-0.5 * (c[2] / gps_sigma) ** 2 for c in candidates],
+            'back': [None] * len(candidates),
+            'limit': None
+        }
+
+    def _step(self, session, number, xy, candidates):
+        if not session.steps:
+            return self._first_step(number, xy, candidates)
+        previous = session.steps[-1]
+        straight = math.hypot(xy[0] - previous['xy'][0], xy[1] - previous['xy'][1])
+        limit = min(max_route_distance, straight * route_factor + route_slack)
+
+        scores, back = [], []
+        for candidate in candidates:
+            best, best_from = -INF, None
+            for i, (a, score) in enumerate(zip(previous['candidates'], previous['scores'])):
+                if score == -INF or score <= best:
+                    continue
+                route = self.distances.between(a, candidate, limit)
+                if route is None:
+                    continue
+                total = score - abs(route[0] - straight) / route_beta
+                if total > best:
+                    best, best_from = total, i
+            scores.append(best - 0.5 * (candidate[2] / gps_sigma) ** 2 if best_from is not None else -INF)
+            back.append(best_from)
+        if all(score == -INF for score in scores):
+            return None
+        # Keep the scores near zero over long traces
+        top = max(scores)
+        scores = [score - top for score in scores]
+        return {'number': number, 'xy': xy, 'candidates': candidates, 'scores': scores, 'back': back, 'limit': limit}
+
+    def _converged(self, session):
+        steps = session.steps
+        last = steps[-1]
+        alive = {i for i, score in enumerate(last['scores']) if score != -INF}
+        lowest = 1 if session.anchored else 0
+        for k in range(len(steps) - 1, lowest, -1):
+            alive = {steps[k]['back'][i] for i in alive}
+            if len(alive) == 1:
+                decided = k - 1
+                chosen = self._backtrack(steps, decided, alive.pop(), lowest)
+                session.steps = steps[decided:]
+                session.anchored = True
+                return self._report(chosen)
+        if len(steps) - lowest > max_lag:
+            return self._flush(session, keep_last=True)
+        return []
+
+    def _flush(self, session, keep_last=False):
+        # Decide everything pending by the best path so far
+        steps = session.steps
+        lowest = 1 if session.anchored else 0
+        if len(steps) <= lowest:
+            session.steps, session.anchored = [], False
+            return []
+        last = steps[-1]
+        best = max(range(len(last['scores'])), key=lambda i: last['scores'][i])
+        chosen = self._backtrack(steps, len(steps) - 1, best, lowest)
+        if keep_last:
+            # Later points may only follow the position just reported
+            step = dict(last)
+            step['candidates'], step['scores'], step['back'] = [last['candidates'][best]], [0.0], [None]
+            session.steps, session.anchored = [step], True
+        else:
+            session.steps, session.anchored = [], False
+        return self._report(chosen)
+
+    def _backtrack(self, steps, k, i, lowest):
+        # (step, candidate) from steps[lowest] to steps[k], following the back pointers
+        chosen = []
+        while k >= lowest:
+            chosen.append((steps[k], i))
+            i = steps[k]['back'][i]
+            k -= 1
+        chosen.reverse()
+        # The position before the first one, to route from
+        if lowest and chosen and chosen[0][0]['back'][chosen[0][1]] is not None:
+            chosen.insert(0, (steps[lowest - 1], chosen[0][0]['back'][chosen[0][1]]))
+            return chosen
+        return [(None, None)] + chosen
+
+    def _report(self, chosen):
+        arrays, index = self.index.arrays, self.index
+        results = []
+        (previous_step, previous), chosen = chosen[0], chosen[1:]
+        for step, i in chosen:
+            candidate = step['candidates'][i]
+            edge, offset, error, px, py = candidate
+            lat, lng = index.unproject(px, py)
+            route = []
+            starts = step['back'][i] is None or previous_step is None
+            if not starts:
+                a = previous_step['candidates'][previous]
+                found = self.distances.between(a, candidate, step['limit'], with_path=True)
+                if found is not None:
+                    route = [[float(arrays.lat[node]), float(arrays.lng[node])] for node in found[1]]
+            results.append({
+                'index': step['number'],
+                'lat': lat,
+                'lng': lng,
+                'error': error,
+                'edge': [int(arrays.node_ids[arrays.edge_source[edge]]), int(arrays.node_ids[arrays.edge_target[edge]])],
+                'offset': offset,
+                'start': starts,
+                'route': route
+            })
+            previous_step, previous = step, i
+        return results
+
+    def report(self):
+        with self.lock:
+            report = {
+                'ready': self.index is not None,
+                'build_time': self.build_time,
+                'vehicles': len(self.sessions),
+                'points': self.points
+            }
+        if self.distances is not None:
+            report.update(self.distances.report())
+        return report
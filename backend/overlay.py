@@ -0,0 +1,386 @@
+import heapq
+import os
+import threading
+import time
+from array import array
+
+from routing import edge_length
+from search_state import pool_for, NO_PARENT
+
+INF = float('inf')
+
+# Maximum nodes per cell, finest level first. Each level nests in the next.
+cell_sizes = (128, 1024)
+partition_file = 'cache/partition.npz'
+
+def partition_graph(graph, nodes, sizes=cell_sizes):
+    # Recursive coordinate bisection: split along the longer side at the
+    # median until every part fits. Coarse cells are cut first and fine cells
+    # inside them, so a fine cell never spans two coarse ones.
+    import numpy as np
+    lat = np.array([graph.nodes[node]['y'] for node in nodes], dtype=np.float64)
+    lng = np.array([graph.nodes[node]['x'] for node in nodes], dtype=np.float64)
+    if len(nodes):
+        lng = lng * np.cos(np.radians(lat.mean()))
+
+    levels = []
+    groups = [np.arange(len(nodes))]
+    for size in reversed(sizes):
+        parts = []
+        for group in groups:
+            stack = [group]
+            while stack:
+                members = stack.pop()
+                if len(members) <= size:
+                    parts.append(members)
+                    continue
+                ys, xs = lat[members], lng[members]
+                coords = ys if np.ptp(ys) >= np.ptp(xs) else xs
+                half = len(members) // 2
+                order = np.argpartition(coords, half)
+                stack.append(members[order[half:]])
+                stack.append(members[order[:half]])
+        cells = np.empty(len(nodes), dtype=np.int32)
+        for cell, members in enumerate(parts):
+            cells[members] = cell
+        levels.append(cells)
+        groups = parts
+    levels.reverse()
+    return levels
+
+def save_partition(path, nodes, sizes, levels):
+    import numpy as np
+    np.savez(path, nodes=np.array(nodes, dtype=np.int64), sizes=np.array(sizes), cells=np.vstack(levels))
+
+def load_partition(path, nodes, sizes):
+    # Cells for `nodes` from a saved partition, or None if it was made for another graph
+    import numpy as np
+    if not os.path.exists(path):
+        return None
+    data = np.load(path)
+    if tuple(data['sizes'].tolist()) != tuple(sizes) or len(data['nodes']) != len(nodes):
+        return None
+    order = np.argsort(data['nodes'])
+    saved = data['nodes'][order]
+    wanted = np.array(nodes, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(saved, wanted), len(saved) - 1)
+    if not np.array_equal(saved[positions], wanted):
+        return None
+    return [row[order][positions] for row in data['cells']]
+
+class MultiLevelOverlay:
+    # Partition-based overlay in the style of customizable route planning.
+    # Level k > 0 of the overlay holds the boundary nodes of the level k - 1
+    # cells, joined by the cut roads between cells and by a clique per cell
+    # with the shortest distance inside the cell between its boundary nodes.
+    # The partition never changes; an obstacle only re-computes the cliques
+    # of the cells its roads lie in.
+    def __init__(self, sizes=None):
+        self.sizes = tuple(sizes or cell_sizes)
+        self.lock = threading.Lock()
+        self.nodes = None
+        self.index = None
+        self.cells = None
+        self.boundary = None
+        self.members = None
+        self.cliques = None
+        self.base = None
+        self.touched = set()
+        self.version = 0
+        self.partition_time = None
+        self.build_time = None
+        self.last_update = None
+
+    def load(self, graph, path=partition_file):
+        with self.lock:
+            self.partition(graph, path)
+            self.customize_all(graph)
+            # Cliques are replaced, never edited, so a shallow copy keeps the unobstructed ones
+            self.base = [dict(cliques) for cliques in self.cliques]
+            self.touched = set()
+
+    def partition(self, graph, path=None):
+        start_time = time.time()
+        pool = pool_for(graph)
+        self.nodes, self.index = pool.nodes, pool.index
+
+        levels = load_partition(path, self.nodes, self.sizes) if path else None
+        if levels is None:
+            levels = partition_graph(graph, self.nodes, self.sizes)
+            if path:
+                save_partition(path, self.nodes, self.sizes, levels)
+        self.cells = [array('i', cells.tolist()) for cells in levels]
+
+        # A node is a boundary node of its cell when a road leaves or enters the cell there.
+        # Nodes in one fine cell share every coarser cell, so the first shared level ends the scan.
+        index = self.index
+        boundary = [set() for _ in self.cells]
+        for u, v in graph.edges():
+            i, j = index[u], index[v]
+            for k, cells in enumerate(self.cells):
+                if cells[i] == cells[j]:
+                    break
+                boundary[k].add(i)
+                boundary[k].add(j)
+
+        self.boundary = []
+        for k, cells in enumerate(self.cells):
+            by_cell = {}
+            for i in sorted(boundary[k]):
+                by_cell.setdefault(cells[i], []).append(i)
+            self.boundary.append(by_cell)
+
+        # Nodes of overlay level k inside each level k cell: every road node
+        # for the finest level, the boundary nodes of the finer cells above it
+        self.members = []
+        for k, cells in enumerate(self.cells):
+            inner = range(len(self.nodes)) if k == 0 else (i for b in self.boundary[k - 1].values() for i in b)
+            by_cell = {}
+            for i in inner:
+                by_cell.setdefault(cells[i], []).append(i)
+            self.members.append(by_cell)
+        self.partition_time = time.time() - start_time
+
+    def customize_all(self, graph):
+        start_time = time.time()
+        self.cliques = [{} for _ in self.cells]
+        for k in range(len(self.cells)):
+            for cell in self.boundary[k]:
+                self._customize_cell(graph, k, cell)
+        self.build_time = time.time() - start_time
+        print(f"Overlay customized: {self.report_cells()} in {self.build_time:.2f}s")
+
+    def _edges(self, graph, k, i):
+        # Out-edges of node i in overlay level k (level 0 is the road graph) as
+        # (node, length, hop), where hop names the cell of a clique edge
+        node = self.nodes[i]
+        index = self.index
+        if k == 0:
+            for neighbor in graph.successors(node):
+                yield index[neighbor], edge_length(graph, node, neighbor), None
+            return
+
+        cells = self.cells[k - 1]
+        cell = cells[i]
+        hop = (k - 1, cell)
+        for j, length in self.cliques[k - 1][cell].get(i, ()):
+            yield j, length, hop
+        for neighbor in graph.successors(node):
+            j = index[neighbor]
+            if cells[j] != cell:
+                yield j, edge_length(graph, node, neighbor), None
+
+    def _customize_cell(self, graph, k, cell):
+        # Distances between all overlay nodes of the cell (Floyd-Warshall on a
+        # dense matrix), then the boundary rows become the cell's clique
+        import numpy as np
+        members = self.members[k][cell]
+        position = {i: p for p, i in enumerate(members)}
+        rows, cols, lengths = [], [], []
+        for p, i in enumerate(members):
+            for j, length, _ in self._edges(graph, k, i):
+                q = position.get(j)
+                if q is not None:
+                    rows.append(p)
+                    cols.append(q)
+                    lengths.append(length)
+
+        n = len(members)
+        matrix = np.full((n, n), INF)
+        np.fill_diagonal(matrix, 0)
+        np.minimum.at(matrix, (rows, cols), lengths)
+        for m in range(n):
+            np.minimum(matrix, matrix[:, m, None] + matrix[m], out=matrix)
+
+        bounds = self.boundary[k].get(cell, [])
+        picked = [position[b] for b in bounds]
+        clique = {}
+        for b, row in zip(bounds, matrix[np.ix_(picked, picked)].tolist()):
+            clique[b] = tuple((c, d) for c, d in zip(bounds, row) if c != b and d < INF)
+        self.cliques[k][cell] = clique
+
+    def _unpack(self, graph, hop, a, b):
+        # Road-level path behind a clique edge: the shortest a -> b path inside the cell
+        k, cell = hop
+        cells = self.cells[k]
+        index, nodes = self.index, self.nodes
+        dist = {a: 0}
+        parent = {a: None}
+        done = set()
+        heap = [(0, a)]
+        while heap:
+            d, i = heapq.heappop(heap)
+            if i in done:
+                continue
+            done.add(i)
+            if i == b:
+                break
+            node = nodes[i]
+            for neighbor in graph.successors(node):
+                j = index[neighbor]
+                if cells[j] != cell or j in done:
+                    continue
+                new_dist = d + edge_length(graph, node, neighbor)
+                if new_dist < dist.get(j, INF):
+                    dist[j] = new_dist
+                    parent[j] = i
+                    heapq.heappush(heap, (new_dist, j))
+
+        path = []
+        i = b
+        while i is not None:
+            path.append(nodes[i])
+            i = parent[i]
+        path.reverse()
+        return path
+
+    def shortest_path(self, graph, source, target, heuristic=None, deadline=INF):
+        # (length, nodes) of the shortest route, or None if there is none.
+        # Near the source and target the search runs on roads; everywhere else
+        # on the coarsest level whose cell holds neither of them.
+        pool = pool_for(graph)
+        index = self.index
+        s, t = index[source], index[target]
+        levels = len(self.cells)
+        source_cells = [cells[s] for cells in self.cells]
+        target_cells = [cells[t] for cells in self.cells]
+
+        def level_of(i):
+            for k in range(levels, 0, -1):
+                cell = self.cells[k - 1][i]
+                if cell != source_cells[k - 1] and cell != target_cells[k - 1]:
+                    return k
+            return 0
+
+        def estimate(i):
+            return heuristic(self.nodes[i], target) if heuristic else 0
+
+        via = {}
+        with pool.borrow() as state:
+            dist, parent, stamp, done, heap = state.dist, state.parent, state.stamp, state.done, state.heap
+            gen = state.generation
+            dist[s] = 0
+            parent[s] = NO_PARENT
+            stamp[s] = gen
+            heap.append((estimate(s), s))
+            settled = 0
+
+            while heap:
+                _, i = heapq.heappop(heap)
+                if done[i] == gen:
+                    continue
+                done[i] = gen
+                if i == t:
+                    break
+                settled += 1
+                if settled % 1024 == 0 and time.time() > deadline:
+                    return None
+
+                d = dist[i]
+                for j, length, hop in self._edges(graph, level_of(i), i):
+                    if done[j] == gen:
+                        continue
+                    new_dist = d + length
+                    if stamp[j] != gen or new_dist < dist[j]:
+                        dist[j] = new_dist
+                        parent[j] = i
+                        stamp[j] = gen
+                        if hop is None:
+                            via.pop(j, None)
+                        else:
+                            via[j] = hop
+                        heapq.heappush(heap, (new_dist + estimate(j), j))
+
+            if done[t] != gen:
+                return None
+            length = dist[t]
+            overlay_path = state.path_to(t)
+
+        path = [source]
+        for a, b in zip(overlay_path, overlay_path[1:]):
+            hop = via.get(b)
+            if hop is None:
+                path.append(self.nodes[b])
+            else:
+                path.extend(self._unpack(graph, hop, a, b)[1:])
+        return length, path
+
+    def remove_edges(self, graph, removed):
+        # Re-customizes every cell that holds both ends of a blocked road
+        # (entries start with u, v; `graph` no longer has them). A cell without
+        # boundary nodes has no clique, so no route through the overlay uses it.
+        with self.lock:
+            if self.cliques is None or not removed:
+                return
+            start_time = time.time()
+            index = self.index
+            touched = [set() for _ in self.cells]
+            for edge in removed:
+                i, j = index[edge[0]], index[edge[1]]
+                for k, cells in enumerate(self.cells):
+                    if cells[i] == cells[j] and cells[i] in self.boundary[k]:
+                        touched[k].add(cells[i])
+
+            # Finer levels first: coarse cliques are built from the fine ones
+            for k, cell_ids in enumerate(touched):
+                for cell in cell_ids:
+                    self._customize_cell(graph, k, cell)
+                    self.touched.add((k, cell))
+
+            self.version += 1
+            self.last_update = {
+                'cells': [len(cell_ids) for cell_ids in touched],
+                'time': time.time() - start_time
+            }
+            print(f"Overlay re-customized {sum(self.last_update['cells'])} cells in {self.last_update['time'] * 1000:.1f}ms")
+
+    def reset_to_base(self, graph):
+        with self.lock:
+            if self.base is None:
+                return
+            for k, cell in self.touched:
+                if cell in self.base[k]:
+                    self.cliques[k][cell] = self.base[k][cell]
+                else:
+                    self.cliques[k].pop(cell, None)
+            self.touched = set()
+            self.version += 1
+
+    def report_cells(self):
+        return ', '.join(
+            f"{len(set(cells))} cells / {sum(len(b) for b in self.boundary[k].values())} boundary nodes"
+            for k, cells in enumerate(self.cells)
+        )
+
+    def report(self):
+        with self.lock:
+            if self.cliques is None:
+                return {'ready': False}
+            return {
+                'ready': True,
+                'version': self.version,
+                'cell_sizes': list(self.sizes),
+                'cells': [len(set(cells)) for cells in self.cells],
+                'boundary_nodes': [sum(len(b) for b in boundary.values()) for boundary in self.boundary],
+                'clique_edges': [sum(len(row) for clique in cliques.values() for row in clique.values())
+                                 for cliques in self.cliques],
+                'modified_cells': len(self.touched),
+                'partition_time': self.partition_time,
+                'build_time': self.build_time,
+                'last_update': self.last_update
+            }
+
+if __name__ == '__main__':
+    # Offline step: partition the cached graph once so servers start from the saved cells
+    import sys
+    import osmnx as ox
+    graph_file = sys.argv[1] if len(sys.argv) > 1 else 'cache/graph.graphml'
+    graph = ox.load_graphml(graph_file)
+    pool = pool_for(graph)
+    start_time = time.time()
+    levels = partition_graph(graph, pool.nodes)
+    save_partition(partition_file, pool.nodes, cell_sizes, levels)
+    print(f"Partitioned {len(pool.nodes)} nodes in {time.time() - start_time:.2f}s, saved to {partition_file}")
+
+    overlay = MultiLevelOverlay()
+    overlay.load(graph)
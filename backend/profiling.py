@@ -0,0 +1,190 @@
+import contextvars
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Off unless PROFILE_TOKEN is set. A request opts in by sending the token in
+# the X-Profile-Token header or as ?profile=<token>.
+profile_token = os.environ.get('PROFILE_TOKEN')
+profile_dir = 'cache/profiles'
+sample_interval = float(os.environ.get('PROFILE_INTERVAL_MS', 1)) / 1000
+speedscope_schema = 'https://www.speedscope.app/file-format-schema.json'
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+def profiling_allowed(request):
+    if not profile_token:
+        return False
+    supplied = request.headers.get('x-profile-token') or request.query_params.get('profile')
+    return bool(supplied) and hmac.compare_digest(supplied, profile_token)
+
+@contextmanager
+def phase(name):
+    # Adds the time spent in the block to the active request profile, if any
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start_time)
+
+class StackSampler:
+    # Wall-clock sampling of the request thread and every thread started while
+    # it runs (search workers, timeout executors), so time spent waiting on a
+    # lock shows up as well as time spent computing
+    def __init__(self, thread_id, interval=sample_interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.ignored = {thread.ident for thread in threading.enumerate()} - {thread_id}
+        self.frames = []
+        self.frame_ids = {}
+        self.samples = {}
+        self.thread_names = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            self.thread.join()
+
+    def _run(self):
+        self.ignored.add(threading.get_ident())
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            now = time.perf_counter()
+            weight = now - last
+            last = now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in self.ignored:
+                    continue
+                if thread_id not in self.thread_names:
+                    self.thread_names[thread_id] = self._thread_name(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(thread_id, []).append((stack, weight))
+
+    def _thread_name(self, thread_id):
+        if thread_id == self.thread_id:
+            return 'request'
+        for thread in threading.enumerate():
+            if thread.ident == thread_id:
+                return thread.name
+        return str(thread_id)
+
+    def _frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        frame_id = self.frame_ids.get(key)
+        if frame_id is None:
+            frame_id = len(self.frames)
+            self.frame_ids[key] = frame_id
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return frame_id
+
+    def sample_count(self):
+        return sum(len(samples) for samples in self.samples.values())
+
+    def speedscope(self, name):
+        # One sampled profile per thread, request thread first
+        profiles = []
+        order = sorted(self.samples, key=lambda thread_id: thread_id != self.thread_id)
+        for thread_id in order:
+            samples = self.samples[thread_id]
+            weights = [weight for _, weight in samples]
+            profiles.append({
+                'type': 'sampled',
+                'name': self.thread_names[thread_id],
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': [stack for stack, _ in samples],
+                'weights': weights
+            })
+        return {
+            '$schema': speedscope_schema,
+            'name': name,
+            'exporter': 'chennai-pathfinder',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': profiles
+        }
+
+class RequestProfile:
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.started = time.perf_counter()
+        self.sampler = StackSampler(threading.get_ident())
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def phase_summary(self):
+        # Totals per phase, with 'search.parallel_astar' style entries also summed under 'search'
+        summary = dict(self.phases)
+        for name, seconds in self.phases.items():
+            group = name.split('.', 1)[0]
+            if group != name:
+                summary[group] = summary.get(group, 0) + seconds
+        return summary
+
+    def respond(self, payload):
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import Response
+
+        # Serialization as FastAPI would do it for the plain response
+        with phase('serialization'):
+            json.dumps(jsonable_encoder(payload))
+        self.sampler.stop()
+        total = time.perf_counter() - self.started
+
+        os.makedirs(profile_dir, exist_ok=True)
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}-{os.getpid()}-{id(self):x}.speedscope.json"
+        with open(os.path.join(profile_dir, file_name), 'w') as f:
+            json.dump(self.sampler.speedscope(f"{self.name} ({total * 1000:.1f} ms)"), f)
+
+        summary = {
+            'total': total,
+            'phases': self.phase_summary(),
+            'samples': self.sampler.sample_count(),
+            'threads': len(self.sampler.samples),
+            'speedscope': f'/profiles/{file_name}'
+        }
+        print(f"Profiled {self.name} in {total:.4f}s: {summary['phases']}")
+        content = json.dumps(jsonable_encoder(dict(payload, profile=summary)))
+        return Response(content=content, media_type='application/json')
+
+@contextmanager
+def profile_request(request, name):
+    # Yields a RequestProfile when the request asked for profiling and holds the token, else None
+    if not profiling_allowed(request):
+        yield None
+        return
+    profile = RequestProfile(name)
+    token = current_profile.set(profile)
+    profile.sampler.start()
+    try:
+        yield profile
+    finally:
+        profile.sampler.stop()
+        current_profile.reset(token)
+
+def profile_path(file_name):
+    # Only bare names of stored profiles can be fetched
+    if os.path.basename(file_name) != file_name or not file_name.endswith('.speedscope.json'):
+        return None
+    path = os.path.join(profile_dir, file_name)
+    return path if os.path.isfile(path) else None
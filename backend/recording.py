@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Off unless RECORD_REQUESTS names a file. Every recorded call is one compact
+# JSON line appended to it, in the order the calls finished.
+record_file = os.environ.get('RECORD_REQUESTS')
+recorded_operations = ('find_path', 'add_obstacle', 'clear_obstacles')
+
+def route_digest(paths):
+    # Per algorithm: distance, point count and a hash of the points, so two runs
+    # can be compared without storing every coordinate
+    digest = {}
+    for name, route in (paths or {}).items():
+        if 'path' not in route:
+            digest[name] = {'error': route.get('error')}
+            continue
+        points = json.dumps(route['path'], separators=(',', ':'))
+        digest[name] = {
+            'distance': route['distance'],
+            'points': len(route['path']),
+            'hash': hashlib.sha1(points.encode()).hexdigest()[:16]
+        }
+    return digest
+
+class RequestRecorder:
+    def __init__(self, path=record_file):
+        self.path = path
+        self.lock = Lock()
+        self.started = time.time()
+        self.file = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.file = open(self.path, 'a', buffering=1)
+            self.file.write(line)
+
+    @contextmanager
+    def capture(self, operation, body=None):
+        # Yields a dict the endpoint fills with 'result'; the status comes from
+        # the HTTPException raised inside, if any
+        entry = {}
+        if not self.enabled:
+            yield entry
+            return
+        sent = time.time()
+        status = 200
+        try:
+            yield entry
+        except Exception as e:
+            status = getattr(e, 'status_code', 500)
+            raise
+        finally:
+            record = {
+                'ts': round(sent, 6),
+                'op': operation,
+                'body': body,
+                'status': status,
+                'latency': round(time.time() - sent, 6)
+            }
+            if 'result' in entry:
+                record['result'] = entry['result']
+            self.write(record)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def load_recording(path):
+    # Recorded entries in the order they were sent, each with 'offset' seconds since the first
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                if entry.get('op') in recorded_operations:
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry['ts'])
+    if entries:
+        first = entries[0]['ts']
+        for entry in entries:
+            entry['offset'] = entry['ts'] - first
+    return entries
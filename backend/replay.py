@@ -0,0 +1,222 @@
+import argparse
+import json
+import math
+import sys
+import time
+
+from loadtest import percentile, summarize, print_summary
+from recording import load_recording, route_digest
+
+# Route distances closer than this (in metres, or relative for long routes) count
+# as equal, so ties between equally short paths are not flagged. The parallel
+# searches race for the frontier and may pick another of several equally short
+# routes, or add the same edges up in another order; a longer or shorter route
+# is still a change
+distance_tolerance = 1e-6
+relative_tolerance = 1e-9
+
+def response_result(operation, response):
+    if response.status_code != 200:
+        return None
+    if operation == 'find_path':
+        return route_digest(response.json().get('paths'))
+    if operation == 'add_obstacle':
+        return {'recalculate': response.json().get('recalculate')}
+    return None
+
+def replay(entries, main, speed):
+    # Requests are sent one at a time in recorded order, so obstacles are applied
+    # in the same sequence on every run. speed 0 sends as fast as possible, 1 keeps
+    # the recorded gaps, 2 halves them
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app, raise_server_exceptions=False)
+
+    results = []
+    start_time = time.time()
+    for entry in entries:
+        if speed:
+            delay = start_time + entry['offset'] / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        operation = entry['op']
+        sent = time.time()
+        if entry.get('body') is None:
+            response = client.post(f'/{operation}')
+        else:
+            response = client.post(f'/{operation}', json=entry['body'])
+        latency = time.time() - sent
+
+        results.append({
+            'operation': operation,
+            'status': response.status_code,
+            'latency': latency,
+            'timeout': False,
+            'error': response.status_code >= 500,
+            'result': response_result(operation, response)
+        })
+    return results, time.time() - start_time
+
+def same_length(old_route, new_route):
+    if not (old_route and new_route and 'distance' in old_route and 'distance' in new_route):
+        return False
+    return math.isclose(old_route['distance'], new_route['distance'],
+                        rel_tol=relative_tolerance, abs_tol=distance_tolerance)
+
+def diff_results(base, new):
+    # Per request, compare status and routes of the two runs
+    differences = []
+    for index, (old, current) in enumerate(zip(base, new)):
+        if old['operation'] != current['operation']:
+            differences.append({'index': index, 'kind': 'operation', 'base': old['operation'], 'new': current['operation']})
+            continue
+        if old['status'] != current['status']:
+            differences.append({'index': index, 'kind': 'status', 'operation': old['operation'],
+                                'base': old['status'], 'new': current['status']})
+            continue
+        old_result, new_result = old.get('result') or {}, current.get('result') or {}
+        if old['operation'] != 'find_path':
+            if old_result != new_result:
+                differences.append({'index': index, 'kind': 'result', 'operation': old['operation'],
+                                    'base': old_result, 'new': new_result})
+            continue
+        for algorithm in sorted(set(old_result) | set(new_result)):
+            old_route, new_route = old_result.get(algorithm), new_result.get(algorithm)
+            if old_route == new_route:
+                continue
+            # Same length through different roads is a tie
+            kind = 'tie' if same_length(old_route, new_route) else 'route'
+            differences.append({'index': index, 'kind': kind, 'operation': 'find_path',
+                                'algorithm': algorithm, 'base': old_route, 'new': new_route})
+    if len(base) != len(new):
+        differences.append({'kind': 'length', 'base': len(base), 'new': len(new)})
+    return differences
+
+def compare_latency(base, new):
+    # p50/p90/p99 per operation and their relative change
+    def by_operation(results):
+        groups = {}
+        for item in results:
+            groups.setdefault(item['operation'], []).append(item['latency'])
+        return groups
+
+    base_groups, new_groups = by_operation(base), by_operation(new)
+    comparison = {}
+    for operation in sorted(set(base_groups) | set(new_groups)):
+        row = {}
+        for pct in (50, 90, 99):
+            old_value = percentile(base_groups.get(operation, []), pct)
+            new_value = percentile(new_groups.get(operation, []), pct)
+            change = (new_value - old_value) / old_value if old_value and new_value is not None else None
+            row[f'p{pct}'] = {'base': old_value, 'new': new_value, 'change': change}
+        comparison[operation] = row
+    return comparison
+
+def recorded_results(entries):
+    # The recording itself as a run, to diff a replay against production
+    return [{
+        'operation': entry['op'],
+        'status': entry['status'],
+        'latency': entry['latency'],
+        'timeout': False,
+        'error': entry['status'] >= 500,
+        'result': entry.get('result')
+    } for entry in entries]
+
+def load_run(path):
+    # A run file written by 'run --out', or a recording (one JSON object per line)
+    with open(path) as f:
+        try:
+            run = json.load(f)
+        except json.JSONDecodeError:
+            run = None
+    if isinstance(run, dict) and 'results' in run:
+        return run['results']
+    return recorded_results(load_recording(path))
+
+def print_differences(differences, limit):
+    counts = {}
+    for item in differences:
+        counts[item['kind']] = counts.get(item['kind'], 0) + 1
+    print(f"\n{len(differences)} differences: " + (', '.join(f'{kind} {count}' for kind, count in sorted(counts.items())) or 'none'))
+    for item in [item for item in differences if item['kind'] != 'tie'][:limit]:
+        print(f"  #{item.get('index', '-')} {item['kind']} {item.get('operation', '')} {item.get('algorithm', '')}: "
+              f"{item['base']} -> {item['new']}")
+
+def print_latency(comparison):
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else '       -'
+
+    def pct(value):
+        return f"{value:+7.1%}" if value is not None else '      -'
+
+    print(f"\n{'operation':<18}{'':>5}{'base ms':>9}{'new ms':>9}{'change':>8}")
+    for operation, row in comparison.items():
+        for name, values in row.items():
+            print(f"{operation:<18}{name:>5}{ms(values['base'])} {ms(values['new'])} {pct(values['change'])}")
+
+def run_command(args):
+    import main
+    entries = load_recording(args.recording)
+    if not entries:
+        print(f'No requests recorded in {args.recording}')
+        return 1
+
+    main.load_city_map()
+    main.start_graph_services()
+    print(f"Replaying {len(entries)} requests from {args.recording} at speed {args.speed or 'max'}")
+    results, duration = replay(entries, main, args.speed)
+    summary = summarize(results, duration)
+    print_summary(summary)
+
+    # Routes the server returned in production, as far as they were recorded
+    differences = diff_results(recorded_results(entries), results)
+    print_differences(differences, args.show)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'label': args.label, 'recording': args.recording, 'speed': args.speed,
+                       'summary': summary, 'results': results}, f)
+        print(f'\nWrote {args.out}')
+    return 0
+
+def compare_command(args):
+    base, new = load_run(args.base), load_run(args.new)
+    differences = diff_results(base, new)
+    comparison = compare_latency(base, new)
+    print_differences(differences, args.show)
+    print_latency(comparison)
+
+    failed = any(item['kind'] != 'tie' for item in differences)
+    if args.max_regression is not None:
+        for operation, row in comparison.items():
+            change = row['p50']['change']
+            if change is not None and change > args.max_regression:
+                print(f"{operation}: p50 regressed by {change:.1%}")
+                failed = True
+    return 1 if failed else 0
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Replay recorded API traffic and compare runs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Replay a RECORD_REQUESTS log against a fresh app in this process')
+    run.add_argument('recording')
+    run.add_argument('--speed', type=float, default=0, help='0: as fast as possible, 1: recorded timing, 2: twice as fast')
+    run.add_argument('--out', help='Write the run (results and summary) to this file for compare')
+    run.add_argument('--label', default='', help='Name of the build, kept in the run file')
+    run.add_argument('--show', type=int, default=10, help='Differences to print')
+
+    compare = commands.add_parser('compare', help='Diff routes and latencies of two runs (or a run and a recording)')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--max-regression', type=float,
+                         help='Fail when any p50 grows by more than this fraction, e.g. 0.1')
+    compare.add_argument('--show', type=int, default=10, help='Differences to print')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        return run_command(args)
+    return compare_command(args)
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,377 @@
+import heapq
+import time
+
+from search_state import pool_for, NO_PARENT
+
+INF = float('inf')
+
+
+def edge_length(graph, u, v):
+    # Parallel roads between the same junctions: the search always takes the shortest
+    return min(data.get('length', 1) for data in graph[u][v].values())
+
+def path_length(graph, path):
+    return sum(edge_length(graph, path[i], path[i+1]) for i in range(len(path)-1))
+
+def shortest_path_tree_to(graph, target, source=None, stretch=INF):
+    # Reverse Dijkstra from the target. Once the source is settled the search
+    # only continues out to `stretch` times its distance: nodes further from
+    # the target can not lie on an acceptable alternative.
+    pool = pool_for(graph)
+    index, nodes = pool.index, pool.nodes
+    settled = []
+
+    with pool.borrow() as state:
+        dist, parent, stamp, done, heap = state.dist, state.parent, state.stamp, state.done, state.heap
+        gen = state.generation
+        t = index[target]
+        dist[t] = 0
+        parent[t] = NO_PARENT
+        stamp[t] = gen
+        heap.append((0, t))
+        limit = INF
+
+        while heap:
+            d, i = heapq.heappop(heap)
+            if done[i] == gen:
+                continue
+            if d > limit:
+                break
+            done[i] = gen
+            node = nodes[i]
+            settled.append(i)
+            if node == source:
+                limit = d * stretch
+
+            for prev in graph.predecessors(node):
+                j = index[prev]
+                if done[j] == gen:
+                    continue
+                new_dist = d + edge_length(graph, prev, node)
+                if stamp[j] != gen or new_dist < dist[j]:
+                    dist[j] = new_dist
+                    parent[j] = i
+                    stamp[j] = gen
+                    heapq.heappush(heap, (new_dist, j))
+
+        # Only settled labels leave the pooled state, so membership means "settled"
+        tree_dist = {nodes[i]: dist[i] for i in settled}
+        next_hop = {nodes[i]: (nodes[parent[i]] if parent[i] != NO_PARENT else None) for i in settled}
+    return tree_dist, next_hop
+
+def tree_path(next_hop, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = next_hop[node]
+    return path
+
+def _guided_search(graph, source, target, tree_dist, next_hop, cost, tree_ok,
+                   banned_nodes=frozenset(), banned_edges=frozenset(), deadline=INF):
+    # A* using the reverse tree distances as heuristic. They are exact on the
+    # unmodified graph, so they stay admissible and consistent when edges are
+    # removed or penalised. As soon as a node whose tree path is still usable
+    # reaches the top of the queue, the rest of the route is read off the tree.
+    if source not in tree_dist:
+        return None
+
+    pool = pool_for(graph)
+    index, nodes = pool.index, pool.nodes
+
+    with pool.borrow() as state:
+        dist, parent, stamp, done, heap = state.dist, state.parent, state.stamp, state.done, state.heap
+        gen = state.generation
+        s = index[source]
+        dist[s] = 0
+        parent[s] = NO_PARENT
+        stamp[s] = gen
+        heap.append((tree_dist[source], 0, s))
+        pops = 0
+
+        while heap:
+            f, d, i = heapq.heappop(heap)
+            if done[i] == gen:
+                continue
+            done[i] = gen
+            node = nodes[i]
+
+            pops += 1
+            if pops % 256 == 0 and time.time() > deadline:
+                return None
+
+            if node == target or tree_ok(node):
+                path = [nodes[j] for j in state.path_to(i)]
+                return path + tree_path(next_hop, node)[1:]
+
+            for neighbor in graph.successors(node):
+                if neighbor in banned_nodes or neighbor not in tree_dist:
+                    continue
+                j = index[neighbor]
+                if done[j] == gen or (node, neighbor) in banned_edges:
+                    continue
+                new_dist = d + cost(node, neighbor)
+                if stamp[j] != gen or new_dist < dist[j]:
+                    dist[j] = new_dist
+                    parent[j] = i
+                    stamp[j] = gen
+                    heapq.heappush(heap, (new_dist + tree_dist[neighbor], new_dist, j))
+
+    return None
+
+def _tree_checker(next_hop, is_bad_node, is_bad_edge):
+    # Memoised "is the tree path from this node still usable" test
+    memo = {}
+
+    def tree_ok(node):
+        chain = []
+        current = node
+        ok = True
+        while current is not None:
+            if current in memo:
+                ok = memo[current]
+                break
+            if is_bad_node(current):
+                ok = False
+                break
+            nxt = next_hop[current]
+            chain.append(current)
+            if nxt is not None and is_bad_edge(current, nxt):
+                ok = False
+                break
+            current = nxt
+        for visited in chain:
+            memo[visited] = ok
+        return ok
+
+    return tree_ok
+
+def _road_key(u, v):
+    return (u, v) if u <= v else (v, u)
+
+class RouteSet:
+    def __init__(self, graph, best_length, k, max_overlap, max_stretch):
+        self.graph = graph
+        self.best_length = best_length
+        self.k = k
+        self.max_overlap = max_overlap
+        self.max_stretch = max_stretch
+        self.routes = []
+        self.road_sets = []
+
+    def full(self):
+        return len(self.routes) >= self.k
+
+    def offer(self, path, length=None):
+        if length is None:
+            length = path_length(self.graph, path)
+        stretch = length / self.best_length if self.best_length > 0 else 1.0
+        if stretch > self.max_stretch:
+            return False
+
+        roads = {}
+        for i in range(len(path)-1):
+            roads[_road_key(path[i], path[i+1])] = edge_length(self.graph, path[i], path[i+1])
+
+        overlap = 0.0
+        if length > 0:
+            for accepted in self.road_sets:
+                shared = sum(l for road, l in roads.items() if road in accepted)
+                overlap = max(overlap, shared / length)
+                if overlap > self.max_overlap:
+                    return False
+
+        self.routes.append({
+            'nodes': path,
+            'length': length,
+            'stretch': stretch,
+            'overlap': overlap
+        })
+        self.road_sets.append(roads)
+        return True
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def _yen_routes(graph, source, target, tree_dist, next_hop, limit, route_set, deadline, max_paths):
+    first = tree_path(next_hop, source)
+    found = [first]
+    seen = {tuple(first)}
+    candidates = []
+    counter = 0
+    route_set.offer(first, tree_dist[source])
+    current = first
+
+    while not route_set.full() and len(found) < max_paths and time.time() < deadline:
+        prefixes = [_common_prefix(path, current) for path in found]
+        root_length = 0
+
+        for i in range(len(current)-1):
+            spur = current[i]
+            if i > 0:
+                root_length += edge_length(graph, current[i-1], current[i])
+            if root_length + tree_dist[spur] > limit:
+                continue
+
+            banned_edges = {(path[i], path[i+1]) for path, prefix in zip(found, prefixes)
+                            if prefix > i and len(path) > i + 1}
+            banned_nodes = set(current[:i])
+
+            # The spur may not be re-entered, and its own tree edge may be one of the banned ones
+            bad_nodes = banned_nodes | {spur}
+            checker = _tree_checker(
+                next_hop,
+                lambda node, bad=bad_nodes: node in bad,
+                lambda u, v, banned=banned_edges: (u, v) in banned
+            )
+
+            def tree_ok(node, spur=spur, checker=checker, banned=banned_edges):
+                if node != spur:
+                    return checker(node)
+                nxt = next_hop[spur]
+                return (spur, nxt) not in banned and checker(nxt)
+
+            spur_path = _guided_search(
+                graph, spur, target, tree_dist, next_hop,
+                lambda u, v: edge_length(graph, u, v),
+                tree_ok, bad_nodes, banned_edges, deadline
+            )
+            if not spur_path:
+                continue
+
+            route = current[:i] + spur_path
+            key = tuple(route)
+            if key in seen:
+                continue
+            length = root_length + path_length(graph, spur_path)
+            if length > limit:
+                continue
+            seen.add(key)
+            counter += 1
+            heapq.heappush(candidates, (length, counter, route))
+
+        if not candidates:
+            break
+        length, _, current = heapq.heappop(candidates)
+        found.append(current)
+        route_set.offer(current, length)
+
+    return len(found)
+
+def _penalty_routes(graph, source, target, tree_dist, next_hop, route_set, deadline, max_paths, penalty_factor):
+    penalties = {}
+
+    def cost(u, v):
+        return edge_length(graph, u, v) * penalties.get((u, v), 1.0)
+
+    tried = set()
+    searches = 0
+    while not route_set.full() and searches < max_paths and time.time() < deadline:
+        tree_ok = _tree_checker(next_hop, lambda node: False, lambda u, v: (u, v) in penalties)
+        path = _guided_search(graph, source, target, tree_dist, next_hop, cost, tree_ok, deadline=deadline)
+        searches += 1
+        if not path:
+            break
+        if tuple(path) not in tried:
+            tried.add(tuple(path))
+            route_set.offer(path)
+
+        # Penalise both directions so the next route does not just drive the same road back
+        for i in range(len(path)-1):
+            for edge in ((path[i], path[i+1]), (path[i+1], path[i])):
+                penalties[edge] = penalties.get(edge, 1.0) * penalty_factor
+
+    return searches
+
+def find_alternative_routes(graph, source, target, k=3, method='penalty', max_overlap=0.7,
+                            max_stretch=1.4, budget=5.0, max_paths=None, penalty_factor=1.5):
+    start_time = time.time()
+    deadline = start_time + budget
+    if max_paths is None:
+        max_paths = k * 20
+
+    # One reverse tree serves as exact heuristic and shortcut for every later search
+    tree_dist, next_hop = shortest_path_tree_to(graph, target, source, max_stretch)
+    if source not in tree_dist:
+        return None
+
+    best_length = tree_dist[source]
+    limit = best_length * max_stretch
+    route_set = RouteSet(graph, best_length, k, max_overlap, max_stretch)
+
+    if source == target:
+        route_set.offer([source], 0)
+        searches = 0
+    elif method == 'yen':
+        searches = _yen_routes(graph, source, target, tree_dist, next_hop, limit, route_set, deadline, max_paths)
+    else:
+        searches = _penalty_routes(graph, source, target, tree_dist, next_hop, route_set, deadline, max_paths, penalty_factor)
+
+    return {
+        'routes': route_set.routes,
+        'searches': searches,
+        'time': time.time() - start_time
+    }
+
+def shortest_paths_from(graph, source, targets, reverse=False, heuristic=None, deadline=INF):
+    # One-to-many Dijkstra that stops once every target is settled. With
+    # reverse=True it runs many-to-one over incoming edges instead. A single
+    # target with a heuristic runs as A*.
+    remaining = set(targets)
+    use_heuristic = heuristic is not None and len(remaining) == 1
+    goal = next(iter(remaining)) if use_heuristic else None
+
+    pool = pool_for(graph)
+    index, nodes = pool.index, pool.nodes
+    results = {}
+
+    with pool.borrow() as state:
+        dist, parent, stamp, done, heap = state.dist, state.parent, state.stamp, state.done, state.heap
+        gen = state.generation
+        s = index[source]
+        dist[s] = 0
+        parent[s] = NO_PARENT
+        stamp[s] = gen
+        heap.append((0, 0, s))
+        pops = 0
+
+        while heap and remaining:
+            _, d, i = heapq.heappop(heap)
+            if done[i] == gen:
+                continue
+            done[i] = gen
+            node = nodes[i]
+            remaining.discard(node)
+
+            pops += 1
+            if pops % 256 == 0 and time.time() > deadline:
+                break
+
+            neighbors = graph.predecessors(node) if reverse else graph.successors(node)
+            for neighbor in neighbors:
+                j = index[neighbor]
+                if done[j] == gen:
+                    continue
+                if reverse:
+                    new_dist = d + edge_length(graph, neighbor, node)
+                else:
+                    new_dist = d + edge_length(graph, node, neighbor)
+                if stamp[j] != gen or new_dist < dist[j]:
+                    dist[j] = new_dist
+                    parent[j] = i
+                    stamp[j] = gen
+                    estimate = new_dist + heuristic(neighbor, goal) if use_heuristic else new_dist
+                    heapq.heappush(heap, (estimate, new_dist, j))
+
+        for target in targets:
+            t = index.get(target)
+            if t is None or done[t] != gen:
+                continue
+            path = [nodes[j] for j in state.path_to(t)]
+            if reverse:
+                path.reverse()
+            results[target] = (dist[t], path)
+    return results
@@ -0,0 +1,97 @@
+import threading
+from array import array
+from contextlib import contextmanager
+
+INF = float('inf')
+NO_PARENT = -1
+max_generation = 0xFFFFFFFF
+
+class SearchState:
+    # Per-node labels that survive between queries. A label only counts when
+    # its stamp equals the current generation, so starting a query is O(1)
+    # and a query only ever touches the nodes it reaches.
+    def __init__(self, size):
+        self.size = size
+        self.dist = array('d', [INF]) * size
+        self.parent = array('q', [NO_PARENT]) * size
+        self.stamp = array('I', [0]) * size
+        self.done = array('I', [0]) * size
+        self.heap = []
+        self.generation = 0
+        self.retired = False
+
+    def reset(self):
+        self.generation += 1
+        if self.generation >= max_generation:
+            self.stamp = array('I', [0]) * self.size
+            self.done = array('I', [0]) * self.size
+            self.generation = 1
+        self.heap.clear()
+        return self.generation
+
+    def retire(self):
+        # A worker may still write into this state; never hand it out again
+        self.retired = True
+
+    def distance(self, i):
+        return self.dist[i] if self.stamp[i] == self.generation else INF
+
+    def path_to(self, i):
+        path = []
+        while i != NO_PARENT:
+            path.append(i)
+            i = self.parent[i]
+        path.reverse()
+        return path
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.dist, self.parent, self.stamp, self.done))
+
+class SearchStatePool:
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.free = []
+        self.lock = threading.Lock()
+        self.created = 0
+
+    @contextmanager
+    def borrow(self):
+        with self.lock:
+            state = self.free.pop() if self.free else None
+            if state is None:
+                self.created += 1
+        if state is None:
+            state = SearchState(len(self.nodes))
+        state.reset()
+        try:
+            yield state
+        finally:
+            if not state.retired:
+                with self.lock:
+                    self.free.append(state)
+
+    def memory_usage(self):
+        with self.lock:
+            states = list(self.free)
+        return {
+            'states_created': self.created,
+            'states_idle': len(states),
+            'bytes_per_state': SearchState(1).nbytes() * len(self.nodes)
+        }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool_for(graph):
+    # Obstacles only ever remove edges, so one node numbering serves the
+    # live graph and every copy of it
+    global _pool
+    pool = _pool
+    if pool is None or len(pool.nodes) != graph.number_of_nodes():
+        with _pool_lock:
+            pool = _pool
+            if pool is None or len(pool.nodes) != graph.number_of_nodes():
+                pool = SearchStatePool(graph.nodes)
+                _pool = pool
+    return pool
@@ -0,0 +1,28 @@
+import random
+
+import networkx as nx
+
+import search_state
+
+def grid_graph(size, seed=0, parallel=0):
+    # Two-way streets on a size x size grid with random lengths, never shorter
+    # than the straight line the A* heuristics measure (degrees * 100000). `parallel`
+    # extra roads join random neighbours a second time, some shorter, some longer.
+    rng = random.Random(seed)
+    graph = nx.MultiDiGraph()
+    for row in range(size):
+        for col in range(size):
+            graph.add_node(row * size + col, y=48.0 + row * 0.0005, x=11.0 + col * 0.0005)
+    for row in range(size):
+        for col in range(size):
+            node = row * size + col
+            for other in ((node + 1) if col + 1 < size else None, (node + size) if row + 1 < size else None):
+                if other is not None:
+                    graph.add_edge(node, other, length=rng.uniform(50, 150))
+                    graph.add_edge(other, node, length=rng.uniform(50, 150))
+    edges = sorted({(u, v) for u, v in graph.edges()})
+    for u, v in rng.sample(edges, parallel):
+        graph.add_edge(u, v, length=rng.uniform(50, 180), name='Parallel Road')
+    # The node numbering is shared process-wide and only renewed when the node count changes
+    search_state._pool = None
+    return graph
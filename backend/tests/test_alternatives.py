@@ -0,0 +1,51 @@
+import itertools
+
+import networkx as nx
+import pytest
+
+from roads import grid_graph
+from routing import find_alternative_routes, path_length
+
+def simple_graph(graph):
+    # shortest_simple_paths does not take multigraphs
+    simple = nx.DiGraph()
+    for u, v, data in graph.edges(data=True):
+        if not simple.has_edge(u, v) or data['length'] < simple[u][v]['length']:
+            simple.add_edge(u, v, length=data['length'])
+    return simple
+
+@pytest.mark.parametrize('source,target', [(0, 48), (6, 42), (10, 31)])
+def test_yen_routes_match_shortest_simple_paths(source, target):
+    graph = grid_graph(7, seed=11)
+    result = find_alternative_routes(graph, source, target, k=6, method='yen',
+                                     max_overlap=1.0, max_stretch=float('inf'), budget=30)
+    expected = [path_length(graph, path) for path in itertools.islice(
+        nx.shortest_simple_paths(simple_graph(graph), source, target, weight='length'), 6)]
+    assert [route['length'] for route in result['routes']] == pytest.approx(expected)
+    for route in result['routes']:
+        nodes = route['nodes']
+        assert nodes[0] == source and nodes[-1] == target
+        assert len(set(nodes)) == len(nodes)
+        assert path_length(graph, nodes) == pytest.approx(route['length'])
+
+@pytest.mark.parametrize('method', ['yen', 'penalty'])
+def test_alternatives_respect_overlap_and_stretch(method):
+    graph = grid_graph(8, seed=12)
+    source, target = 0, 63
+    best = nx.shortest_path_length(graph, source, target, weight='length')
+    result = find_alternative_routes(graph, source, target, k=3, method=method,
+                                     max_overlap=0.7, max_stretch=1.4, budget=30)
+    routes = result['routes']
+    assert routes and routes[0]['length'] == pytest.approx(best)
+    for route in routes:
+        nodes = route['nodes']
+        assert nodes[0] == source and nodes[-1] == target
+        assert all(graph.has_edge(u, v) for u, v in zip(nodes, nodes[1:]))
+        assert route['length'] == pytest.approx(path_length(graph, nodes))
+        assert route['stretch'] <= 1.4 and route['overlap'] <= 0.7
+    assert len({tuple(route['nodes']) for route in routes}) == len(routes)
+
+def test_unreachable_target_has_no_alternatives():
+    graph = grid_graph(4, seed=13)
+    graph.add_node(99, y=48.1, x=11.1)
+    assert find_alternative_routes(graph, 0, 99) is None
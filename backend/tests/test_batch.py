@@ -0,0 +1,57 @@
+import random
+
+import networkx as nx
+import pytest
+
+import main
+from algorithms import GraphView
+from lean_graph import NodePositions, RoadArrays
+from roads import grid_graph
+from routing import path_length
+from traffic import TrafficWeights
+
+INF = float('inf')
+
+@pytest.fixture
+def view(monkeypatch):
+    graph = grid_graph(9, seed=4, parallel=20)
+    arrays = RoadArrays(graph)
+    weights = TrafficWeights()
+    weights.load(arrays)
+    # The A* heuristic of lone pairs reads the module's node positions
+    monkeypatch.setattr(main, 'node_positions', NodePositions(arrays))
+    return GraphView(graph, arrays, weights.current())
+
+def vehicle_pairs(graph):
+    # A shared depot, a shared drop-off and some lone pairs
+    rng = random.Random(8)
+    nodes = list(graph.nodes)
+    pairs = [(0, rng.choice(nodes)) for _ in range(6)]
+    pairs += [(rng.choice(nodes), 80) for _ in range(5)]
+    pairs += [(rng.choice(nodes), rng.choice(nodes)) for _ in range(6)]
+    return pairs
+
+def plan(view, pairs, backend, deadline=INF):
+    routes = {}
+    search_view = view if backend == 'csgraph' else None
+    for key, indexes in main.group_vehicle_pairs(pairs).items():
+        routes.update(main.plan_vehicle_group(view.graph, key, indexes, pairs, deadline, search_view))
+    return routes
+
+@pytest.mark.parametrize('backend', ['python', 'csgraph'])
+def test_batch_distances_match_networkx(view, backend):
+    pairs = vehicle_pairs(view.graph)
+    routes = plan(view, pairs, backend)
+    assert sorted(routes) == list(range(len(pairs)))
+    for i, (origin, destination) in enumerate(pairs):
+        distance, path = routes[i]
+        expected = nx.shortest_path_length(view.graph, origin, destination, weight='length')
+        assert path[0] == origin and path[-1] == destination
+        # csgraph runs on the float32 lengths of the road arrays
+        assert distance == pytest.approx(expected, rel=1e-5)
+        assert path_length(view.graph, path) == pytest.approx(expected, rel=1e-5)
+
+def test_csgraph_groups_after_the_deadline_time_out(view):
+    pairs = vehicle_pairs(view.graph)
+    routes = plan(view, pairs, 'csgraph', deadline=0)
+    assert routes == {i: None for i in range(len(pairs))}
@@ -0,0 +1,49 @@
+import random
+
+import networkx as nx
+
+import search_state
+from connectivity import ConnectivityIndex
+
+def road_graph(edges):
+    graph = nx.MultiDiGraph()
+    graph.add_nodes_from({node for edge in edges for node in edge})
+    for u, v in edges:
+        graph.add_edge(u, v, length=1)
+    # The node numbering is shared process-wide and only renewed when the node count changes
+    search_state._pool = None
+    return graph
+
+def remove(graph, index, edges):
+    removed = [(u, v, key) for u, v in edges for key in list(graph[u][v])]
+    graph.remove_edges_from(removed)
+    index.remove_edges(graph, removed)
+
+def assert_matches_has_path(graph, index):
+    for source in graph.nodes:
+        for target in graph.nodes:
+            assert index.can_reach(graph, source, target) == nx.has_path(graph, source, target), (source, target)
+
+def test_split_off_drops_old_cross_edges():
+    graph = road_graph([(1, 0), (1, 5), (3, 2), (3, 4), (3, 5), (4, 0), (4, 3), (4, 5), (5, 4)])
+    index = ConnectivityIndex()
+    index.load(graph)
+    remove(graph, index, [(5, 4)])
+    assert not index.dirty
+    assert not index.can_reach(graph, 1, 2)
+    assert_matches_has_path(graph, index)
+
+def test_random_removals_match_has_path():
+    rng = random.Random(7)
+    for _ in range(200):
+        count = rng.randint(4, 12)
+        edges = {(rng.randrange(count), rng.randrange(count)) for _ in range(count * 3)}
+        graph = road_graph([(u, v) for u, v in edges if u != v])
+        index = ConnectivityIndex()
+        index.load(graph)
+        for _ in range(3):
+            if not graph.number_of_edges():
+                break
+            present = sorted({(u, v) for u, v, _ in graph.edges(keys=True)})
+            remove(graph, index, rng.sample(present, min(len(present), rng.randint(1, 3))))
+            assert_matches_has_path(graph, index)
@@ -0,0 +1,68 @@
+import networkx as nx
+import pytest
+
+from algorithms import AlgorithmRegistry, CSGraphBackend, GraphView
+from lean_graph import RoadArrays
+from roads import grid_graph
+from routing import path_length
+from traffic import TrafficWeights
+
+@pytest.fixture
+def roads():
+    graph = grid_graph(6, seed=41, parallel=8)
+    weights = TrafficWeights()
+    weights.load(RoadArrays(graph))
+    return graph, weights
+
+def view_of(graph, weights):
+    return GraphView(graph, weights.arrays, weights.current())
+
+def test_length_matrix_survives_traffic_but_not_closures(roads):
+    graph, weights = roads
+    backend = CSGraphBackend()
+    length = backend.matrix(view_of(graph, weights))
+    travel_time = backend.matrix(view_of(graph, weights), 'travel_time')
+
+    weights.apply([0], [1], [0], factor=[0.5])
+    assert backend.matrix(view_of(graph, weights)) is length
+    assert backend.matrix(view_of(graph, weights), 'travel_time') is not travel_time
+
+    weights.block_edges([(0, 1, 0, {})])
+    closed = backend.matrix(view_of(graph, weights))
+    assert closed is not length
+    assert backend.matrix(view_of(graph, weights)) is closed
+    assert backend.report()['matrices']['length'] == weights.current().blocked_version
+
+    weights.reset_blocked()
+    assert backend.matrix(view_of(graph, weights)) is not closed
+
+def test_paths_skip_closed_roads_and_match_networkx(roads):
+    graph, weights = roads
+    backend = CSGraphBackend()
+    closed = [(u, v, key, data) for u, v, key, data in graph.edges(keys=True, data=True) if u in (0, 7)]
+    weights.block_edges(closed)
+    graph.remove_edges_from([(u, v, key) for u, v, key, _ in closed])
+
+    view = view_of(graph, weights)
+    for source, target in ((0, 35), (14, 0), (30, 5)):
+        path, _ = backend.shortest_path(view, source, target)
+        if not nx.has_path(graph, source, target):
+            assert path is None
+            continue
+        expected = nx.shortest_path_length(graph, source, target, weight='length')
+        assert path_length(graph, path) == pytest.approx(expected, rel=1e-5)
+
+    results = backend.paths_from(view, 35, {1, 8, 20}, reverse=True)
+    for origin, (distance, path) in results.items():
+        assert path[0] == origin and path[-1] == 35
+        assert distance == pytest.approx(nx.shortest_path_length(graph, origin, 35, weight='length'), rel=1e-5)
+
+def test_registry_select_keeps_registration_order():
+    registry = AlgorithmRegistry()
+    registry.add('first', None)
+    registry.add('second', None, weight='travel_time')
+    assert [algorithm.name for algorithm in registry.select(['second', 'first'])] == ['first', 'second']
+    with pytest.raises(KeyError):
+        registry.select(['third'])
+    with pytest.raises(ValueError):
+        registry.add('first', None)
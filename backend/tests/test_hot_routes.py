@@ -0,0 +1,56 @@
+import networkx as nx
+import pytest
+
+import hot_routes
+from algorithms import CSGraphBackend, GraphView
+from hot_routes import HotRoutes
+from lean_graph import RoadArrays
+from roads import grid_graph
+from routing import path_length
+from traffic import TrafficWeights
+
+@pytest.fixture
+def view():
+    graph = grid_graph(8, seed=2)
+    arrays = RoadArrays(graph)
+    weights = TrafficWeights()
+    weights.load(arrays)
+    return GraphView(graph, arrays, weights.current())
+
+@pytest.fixture
+def hot(tmp_path, monkeypatch):
+    # One origin keeps its tree, the other pairs only their route
+    monkeypatch.setattr(hot_routes, 'tree_origin_limit', 1)
+    hot = HotRoutes(path=str(tmp_path / 'hot_pairs.json'))
+    for source, target, count in ((0, 63, 3), (0, 7, 1), (9, 40, 2), (50, 5, 1)):
+        for _ in range(count):
+            hot.record(source, target)
+    return hot
+
+def test_warm_routes_are_shortest(view, hot):
+    assert hot.warm(view, CSGraphBackend(), hot.current_epoch())
+    assert hot.report()['trees'] == 1 and hot.report()['routes'] == 2
+    # From the tree origin any destination is answered, not only the recorded ones
+    for source, target in ((0, 63), (0, 7), (0, 33), (9, 40), (50, 5)):
+        path = hot.route(source, target)
+        assert path[0] == source and path[-1] == target
+        expected = nx.shortest_path_length(view.graph, source, target, weight='length')
+        assert path_length(view.graph, path) == pytest.approx(expected, rel=1e-5)
+    assert hot.route(9, 41) is None
+    assert hot.report()['hits'] == 5 and hot.report()['misses'] == 1
+
+def test_invalidate_drops_warm_routes(view, hot):
+    assert hot.warm(view, CSGraphBackend(), hot.current_epoch())
+    hot.invalidate()
+    assert hot.report()['status'] == 'cold'
+    assert hot.route(0, 63) is None and hot.route(9, 40) is None
+
+def test_warm_up_for_an_older_map_is_discarded(view, hot):
+    # The epoch is read before the view is taken; an obstacle in between makes it stale
+    epoch = hot.current_epoch()
+    hot.invalidate()
+    assert not hot.warm(view, CSGraphBackend(), epoch)
+    assert hot.report()['status'] == 'cold'
+    assert hot.route(0, 63) is None
+    assert hot.warm(view, CSGraphBackend(), hot.current_epoch())
+    assert hot.route(0, 63) is not None
@@ -0,0 +1,85 @@
+import networkx as nx
+import pytest
+
+import search_state
+from algorithms import GraphView
+from lean_graph import NodePositions, RoadArrays
+from roads import grid_graph
+from search_state import pool_for
+from traffic import TrafficWeights
+
+@pytest.mark.parametrize('shared_index', [False, True])
+def test_node_positions_match_the_graph(shared_index):
+    graph = grid_graph(6)
+    arrays = RoadArrays(graph)
+    positions = NodePositions(arrays, pool_for(graph).index if shared_index else None)
+    assert len(positions) == graph.number_of_nodes()
+    assert set(positions) == set(graph.nodes)
+    for node, data in graph.nodes(data=True):
+        assert positions[node] == (data['y'], data['x'])
+    with pytest.raises(KeyError):
+        positions[-1]
+
+@pytest.fixture
+def parallel_roads():
+    # 1 -> 2 by a straight avenue and a shorter but slower bypass that bends
+    # through (48.001, 11.0015); 2 -> 3 by one road
+    from shapely.geometry import LineString
+    graph = nx.MultiDiGraph()
+    for node, (lat, lng) in {1: (48.0, 11.0), 2: (48.0, 11.003), 3: (48.002, 11.003)}.items():
+        graph.add_node(node, y=lat, x=lng)
+    graph.add_edge(1, 2, 0, length=220.0, speed_kph=60)
+    graph.add_edge(1, 2, 1, length=200.0, speed_kph=20,
+                   geometry=LineString([(11.0, 48.0), (11.0015, 48.001), (11.003, 48.0)]))
+    graph.add_edge(2, 3, 0, length=230.0, speed_kph=40)
+    search_state._pool = None
+    return graph
+
+def edge_keys(arrays, edges):
+    return [(int(arrays.node_ids[arrays.edge_source[e]]), int(arrays.node_ids[arrays.edge_target[e]]),
+             int(arrays.edge_key[e])) for e in edges]
+
+def test_edge_path_picks_the_cheapest_open_parallel_road(parallel_roads):
+    arrays = RoadArrays(parallel_roads)
+    weights = TrafficWeights()
+    weights.load(arrays)
+    travel_time = weights.current().travel_time
+
+    edges = arrays.edge_path([1, 2, 3], travel_time)
+    assert edge_keys(arrays, edges) == [(1, 2, 1), (2, 3, 0)]
+    assert arrays.route_length(edges) == pytest.approx(430.0)
+    assert arrays.route_points(edges) == [[48.0, 11.0], [48.001, 11.0015], [48.0, 11.003], [48.002, 11.003]]
+
+    fastest = arrays.edge_path([1, 2, 3], travel_time, weight='travel_time')
+    assert edge_keys(arrays, fastest) == [(1, 2, 0), (2, 3, 0)]
+    assert arrays.route_points(fastest) == [[48.0, 11.0], [48.0, 11.003], [48.002, 11.003]]
+
+    weights.block_edges([(1, 2, 1, {})])
+    edges = arrays.edge_path([1, 2, 3], weights.current().travel_time)
+    assert edge_keys(arrays, edges) == [(1, 2, 0), (2, 3, 0)]
+    assert arrays.route_length(edges) == pytest.approx(450.0)
+
+def test_route_points_without_geometry(parallel_roads):
+    arrays = RoadArrays(parallel_roads, keep_geometry=False)
+    edges = arrays.edge_path([1, 2, 3])
+    assert edge_keys(arrays, edges) == [(1, 2, 1), (2, 3, 0)]
+    assert arrays.route_points(edges) == [[48.0, 11.0], [48.0, 11.003], [48.002, 11.003]]
+    assert arrays.route_points(edges[:0]) == []
+
+def test_view_skips_roads_closed_after_its_snapshot(parallel_roads):
+    arrays = RoadArrays(parallel_roads)
+    weights = TrafficWeights()
+    weights.load(arrays)
+    view = GraphView(parallel_roads, arrays, weights.current(), weights)
+
+    # The search priced 1 -> 2 by the bypass, which an obstacle has closed since
+    weights.block_edges([(1, 2, 1, {})])
+    assert edge_keys(arrays, view.edge_path([1, 2, 3])) == [(1, 2, 0), (2, 3, 0)]
+    weights.block_edges([(1, 2, 0, {})])
+    assert view.edge_path([1, 2, 3]) is None
+    assert edge_keys(arrays, view.edge_path([2, 3])) == [(2, 3, 0)]
+
+    # Reopened roads count as open even where the snapshot had them closed
+    closed_view = GraphView(parallel_roads, arrays, weights.current(), weights)
+    weights.reset_blocked()
+    assert edge_keys(arrays, closed_view.edge_path([1, 2, 3])) == [(1, 2, 1), (2, 3, 0)]
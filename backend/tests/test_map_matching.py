@@ -0,0 +1,78 @@
+import math
+import random
+
+import networkx as nx
+import pytest
+
+from lean_graph import RoadArrays
+from map_matching import MapMatcher
+
+size = 8
+step_deg = 0.001
+ky = 110540.0
+kx = 111320.0 * math.cos(math.radians(48.0))
+
+def node_at(row, col):
+    return row * size + col
+
+@pytest.fixture
+def matcher():
+    # Two-way grid whose road lengths are the drawn lengths
+    graph = nx.MultiDiGraph()
+    for row in range(size):
+        for col in range(size):
+            graph.add_node(node_at(row, col), y=48.0 + row * step_deg, x=11.0 + col * step_deg)
+    for row in range(size):
+        for col in range(size):
+            for other, length in (((row, col + 1), step_deg * kx), ((row + 1, col), step_deg * ky)):
+                if other[0] < size and other[1] < size:
+                    graph.add_edge(node_at(row, col), node_at(*other), length=length)
+                    graph.add_edge(node_at(*other), node_at(row, col), length=length)
+    matcher = MapMatcher()
+    matcher.load(RoadArrays(graph))
+    return matcher
+
+def drive(junctions, spacing, noise, rng):
+    # GPS points every `spacing` metres along the junctions, with noise in metres
+    points = []
+    for (r0, c0), (r1, c1) in zip(junctions, junctions[1:]):
+        metres = math.hypot((c1 - c0) * step_deg * kx, (r1 - r0) * step_deg * ky)
+        for k in range(int(metres // spacing)):
+            f = k * spacing / metres
+            lat = 48.0 + (r0 + (r1 - r0) * f) * step_deg + rng.gauss(0, noise) / ky
+            lng = 11.0 + (c0 + (c1 - c0) * f) * step_deg + rng.gauss(0, noise) / kx
+            points.append((lat, lng))
+    return points
+
+def test_noisy_trace_is_matched_to_the_driven_roads(matcher):
+    # East along row 2, then north up column 5, with a turn at (2, 5)
+    corners = [(2, 0), (2, 5), (7, 5)]
+    junctions = [(2, col) for col in range(6)] + [(row, 5) for row in range(3, 8)]
+    driven = {(node_at(*a), node_at(*b)) for a, b in zip(junctions, junctions[1:])}
+    points = drive(corners, spacing=25, noise=4, rng=random.Random(61))
+
+    matched, unmatched = [], []
+    half = len(points) // 2
+    for chunk, final in ((points[:half], False), (points[half:], True)):
+        found, missing, pending = matcher.feed('car', chunk, final=final)
+        matched.extend(found)
+        unmatched.extend(missing)
+    assert not unmatched and pending == 0
+
+    indexes = [point['index'] for point in matched]
+    assert indexes == sorted(indexes) and indexes[0] == 0 and indexes[-1] == len(points) - 1
+    # The first point lies on junction (2, 0), the end of both directions of the first road
+    assert set(matched[0]['edge']) == {node_at(2, 0), node_at(2, 1)}
+    assert all(tuple(point['edge']) in driven for point in matched[1:])
+    assert all(point['error'] < 20 for point in matched)
+    assert matched[0]['start'] and not any(point['start'] for point in matched[1:])
+    # Every junction passed is reported in some route
+    passed = {(round(lat, 6), round(lng, 6)) for point in matched for lat, lng in point['route']}
+    assert {(round(48.0 + r * step_deg, 6), round(11.0 + c * step_deg, 6)) for r, c in junctions[1:-1]} <= passed
+    assert 'car' not in matcher.sessions
+
+def test_points_far_from_roads_are_unmatched(matcher):
+    points = [(48.0 + 2 * step_deg, 11.0005), (47.99, 10.99), (48.0 + 2 * step_deg, 11.0015)]
+    matched, unmatched, _ = matcher.feed('van', points, final=True)
+    assert unmatched == [1]
+    assert [point['index'] for point in matched] == [0, 2]
@@ -0,0 +1,47 @@
+import random
+
+import networkx as nx
+import pytest
+
+from overlay import MultiLevelOverlay
+from roads import grid_graph
+from routing import path_length
+
+def assert_matches_networkx(graph, overlay, pairs):
+    for source, target in pairs:
+        result = overlay.shortest_path(graph, source, target)
+        try:
+            expected = nx.shortest_path_length(graph, source, target, weight='length')
+        except nx.NetworkXNoPath:
+            assert result is None, (source, target)
+            continue
+        assert result is not None, (source, target)
+        length, path = result
+        assert path[0] == source and path[-1] == target
+        assert length == pytest.approx(expected)
+        assert path_length(graph, path) == pytest.approx(expected)
+
+@pytest.mark.parametrize('sizes', [None, (16, 64)])
+def test_obstacles_added_and_cleared(sizes):
+    # With the default sizes the whole graph is one coarse cell without boundary nodes
+    graph = grid_graph(20, seed=3)
+    overlay = MultiLevelOverlay(sizes)
+    overlay.load(graph, path=None)
+    rng = random.Random(5)
+    nodes = list(graph.nodes)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(40)]
+    assert_matches_networkx(graph, overlay, pairs)
+
+    removed = []
+    for _ in range(3):
+        blocked = rng.sample(sorted({(u, v) for u, v, _ in graph.edges(keys=True)}), 40)
+        batch = [(u, v, key, data) for u, v in blocked for key, data in list(graph[u][v].items())]
+        graph.remove_edges_from([(u, v, key) for u, v, key, _ in batch])
+        overlay.remove_edges(graph, batch)
+        removed.extend(batch)
+        assert_matches_networkx(graph, overlay, pairs)
+
+    graph.add_edges_from(removed)
+    overlay.reset_to_base(graph)
+    assert not overlay.touched
+    assert_matches_networkx(graph, overlay, pairs)
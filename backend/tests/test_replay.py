@@ -0,0 +1,23 @@
+from replay import diff_results
+
+def find_path(routes):
+    return {'operation': 'find_path', 'status': 200, 'result': routes}
+
+def route(distance, digest):
+    return {'distance': distance, 'points': 3, 'hash': digest}
+
+def test_equal_length_route_change_is_a_tie():
+    base = [find_path({'parallel_astar': route(1200.5, 'a'), 'dijkstra': route(1200.5, 'a')})]
+    new = [find_path({'parallel_astar': route(1200.5 + 1e-10, 'b'), 'dijkstra': route(1200.5, 'a')})]
+    assert [item['kind'] for item in diff_results(base, new)] == ['tie']
+
+def test_parallel_route_of_another_length_is_a_change():
+    base = [find_path({'parallel_dijkstra': route(1200.5, 'a')})]
+    new = [find_path({'parallel_dijkstra': route(1250.0, 'b')})]
+    differences = diff_results(base, new)
+    assert [(item['kind'], item['algorithm']) for item in differences] == [('route', 'parallel_dijkstra')]
+
+def test_lost_route_is_a_change():
+    base = [find_path({'dijkstra': route(900.0, 'a')})]
+    new = [find_path({'dijkstra': {'error': 'No path found'}})]
+    assert [item['kind'] for item in diff_results(base, new)] == ['route']
@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+import main
+
+def splice(old, change):
+    # What the frontend store does with a delta
+    return old[:change['start']] + change['insert'] + old[change['start'] + change['delete']:]
+
+def apply_changes(routes, changed):
+    routes = dict(routes)
+    for algorithm, change in changed.items():
+        if 'error' in change:
+            routes[algorithm] = {'error': change['error']}
+            continue
+        previous = routes.get(algorithm) or {}
+        fields = {key: value for key, value in change.items() if key not in ('start', 'delete', 'insert', 'edges')}
+        routes[algorithm] = {
+            **fields,
+            'path': splice(previous.get('path', []), change),
+            'edges': splice(previous.get('edges', []), change['edges'])
+        }
+    return routes
+
+def route(points, edges, distance):
+    return {'path': points, 'edges': edges, 'distance': distance, 'travel_time': {'hours': 0, 'minutes': 1}, 'time': 0.01}
+
+def test_path_delta_rebuilds_the_new_path():
+    rng = random.Random(31)
+    for _ in range(500):
+        old = [rng.randrange(6) for _ in range(rng.randint(0, 12))]
+        new = [rng.randrange(6) for _ in range(rng.randint(0, 12))]
+        if rng.random() < 0.5 and old:
+            # Detour in the middle of a route, the usual obstacle case
+            a = rng.randrange(len(old))
+            b = rng.randrange(a, len(old))
+            new = old[:a] + new + old[b:]
+        change = main.path_delta(old, new)
+        assert splice(old, change) == new
+        assert change['start'] + change['delete'] <= len(old)
+
+def test_path_delta_keeps_shared_ends():
+    change = main.path_delta([1, 2, 3, 4, 5], [1, 2, 9, 4, 5])
+    assert change == {'start': 2, 'delete': 1, 'insert': [9]}
+
+def test_route_changes_list_only_moved_routes():
+    old = {
+        'dijkstra': route([[0, 0], [0, 1], [1, 1]], [4, 7], 1.5),
+        'astar': route([[0, 0], [0, 1], [1, 1]], [4, 7], 1.5),
+        'overlay': {'error': 'No path found or timeout'}
+    }
+    new = {
+        'dijkstra': route([[0, 0], [0, 1], [1, 1]], [4, 7], 1.5),
+        'astar': route([[0, 0], [0.5, 0.5], [0, 1], [1, 1]], [5, 6, 7], 1.8),
+        'overlay': route([[0, 0], [1, 1]], [3], 2.0)
+    }
+    changed = main.route_changes(old, new)
+    assert set(changed) == {'astar', 'overlay'}
+    assert changed['astar']['distance'] == 1.8 and 'time' in changed['astar']
+    assert apply_changes(old, changed) == new
+
+    failed = dict(new, astar={'error': 'No path found or timeout'})
+    assert main.route_changes(new, failed) == {'astar': {'error': 'No path found or timeout'}}
+    assert main.route_changes(failed, failed) == {}
+
+class Loop:
+    def call_soon_threadsafe(self, func, *args):
+        func(*args)
+
+class Queue(list):
+    def put_nowait(self, message):
+        self.append(message)
+
+@pytest.fixture
+def messages(monkeypatch):
+    queue = Queue()
+    monkeypatch.setattr(main, 'route_subscribers', [(Loop(), queue)])
+    monkeypatch.setattr(main, 'published_routes', {})
+    monkeypatch.setattr(main, 'routes_version', 0)
+    return queue
+
+def test_publish_routes_sends_deltas_and_resyncs_after_an_error(messages):
+    first = {'dijkstra': route([[0, 0], [1, 1]], [1], 1.0)}
+    detour = {'dijkstra': route([[0, 0], [0, 1], [1, 1]], [2, 3], 1.4)}
+    main.publish_routes(first, 'find_path')
+    main.publish_routes(detour, 'obstacles')
+    main.publish_routes(detour, 'obstacles')
+    main.publish_routes({'error': 'No path exists'}, 'obstacles')
+    main.publish_routes(first, 'obstacles')
+
+    assert [message['type'] for message in messages] == ['routes', 'delta', 'error', 'routes']
+    assert [message['version'] for message in messages] == [1, 2, 3, 4]
+    assert messages[1]['base_version'] == 1
+    assert apply_changes(first, messages[1]['changed']) == detour
+    assert messages[3]['paths'] == first
@@ -0,0 +1,71 @@
+import random
+
+import networkx as nx
+import pytest
+
+import search_state
+from roads import grid_graph
+from routing import path_length, shortest_path_tree_to, shortest_paths_from
+
+def straight_distance(graph):
+    def heuristic(u, v):
+        a, b = graph.nodes[u], graph.nodes[v]
+        return ((a['y'] - b['y']) ** 2 + (a['x'] - b['x']) ** 2) ** 0.5 * 100000
+    return heuristic
+
+def assert_shortest(graph, results, source, targets, reverse=False):
+    assert set(results) == set(targets)
+    for target, (distance, path) in results.items():
+        origin, destination = (target, source) if reverse else (source, target)
+        expected = nx.shortest_path_length(graph, origin, destination, weight='length')
+        assert path[0] == origin and path[-1] == destination
+        assert distance == pytest.approx(expected)
+        assert path_length(graph, path) == pytest.approx(expected)
+
+def test_reused_states_match_networkx():
+    # Many queries on one pooled state: labels of earlier queries must never leak
+    graph = grid_graph(9, seed=21)
+    heuristic = straight_distance(graph)
+    rng = random.Random(22)
+    nodes = list(graph.nodes)
+    for _ in range(60):
+        source = rng.choice(nodes)
+        targets = set(rng.sample(nodes, rng.randint(1, 5)))
+        reverse = rng.random() < 0.5
+        results = shortest_paths_from(graph, source, targets, reverse=reverse,
+                                      heuristic=heuristic if len(targets) == 1 else None)
+        assert_shortest(graph, results, source, targets, reverse)
+    assert search_state.pool_for(graph).created == 1
+
+def test_reverse_tree_matches_networkx():
+    graph = grid_graph(7, seed=23)
+    for target in (0, 24, 48):
+        tree_dist, next_hop = shortest_path_tree_to(graph, target)
+        expected = nx.single_source_dijkstra_path_length(graph.reverse(copy=False), target, weight='length')
+        assert tree_dist.keys() == expected.keys()
+        for node, distance in expected.items():
+            assert tree_dist[node] == pytest.approx(distance)
+            hop = next_hop[node]
+            if hop is not None:
+                assert tree_dist[node] == pytest.approx(path_length(graph, [node, hop]) + tree_dist[hop])
+
+def test_generation_wrap_clears_old_labels(monkeypatch):
+    monkeypatch.setattr(search_state, 'max_generation', 4)
+    graph = grid_graph(6, seed=24)
+    for source, target in [(0, 35), (35, 0), (5, 30), (30, 5), (12, 23), (0, 35), (7, 28)]:
+        assert_shortest(graph, shortest_paths_from(graph, source, {target}), source, {target})
+
+def test_unreachable_targets_are_left_out():
+    graph = grid_graph(5, seed=25)
+    graph.add_node(99, y=48.1, x=11.1)
+    results = shortest_paths_from(graph, 0, {24, 99})
+    assert set(results) == {24}
+
+def test_nested_borrows_get_separate_states():
+    graph = grid_graph(4, seed=26)
+    pool = search_state.pool_for(graph)
+    with pool.borrow() as first, pool.borrow() as second:
+        assert first is not second
+    with pool.borrow() as again:
+        assert again in (first, second)
+    assert pool.created == 2
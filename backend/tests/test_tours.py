@@ -0,0 +1,58 @@
+import itertools
+import math
+import random
+
+import pytest
+
+from tours import INF, nearest_insertion, order_stops, tour_cost, two_opt
+
+def random_costs(rng, count, one_way=False):
+    points = [(rng.random(), rng.random()) for _ in range(count)]
+    cost = [[math.dist(a, b) for b in points] for a in points]
+    if one_way:
+        cost = [[c * rng.uniform(1, 1.5) for c in row] for row in cost]
+    return cost
+
+def single_reversals(order, fixed_end):
+    last = len(order) - 2 if fixed_end else len(order) - 1
+    for i in range(1, last):
+        for j in range(i + 1, last + 1):
+            yield order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+
+@pytest.mark.parametrize('fixed_end,round_trip', [(False, False), (True, False), (False, True)])
+def test_two_opt_leaves_no_improving_reversal(fixed_end, round_trip):
+    rng = random.Random(51)
+    for _ in range(40):
+        count = rng.randint(3, 8)
+        cost = random_costs(rng, count, one_way=rng.random() < 0.5)
+        start = [0] + rng.sample(range(1, count - 1), count - 2) + [count - 1] if fixed_end \
+            else [0] + rng.sample(range(1, count), count - 1)
+        order = two_opt(cost, start, fixed_end, round_trip)
+
+        assert sorted(order) == list(range(count)) and order[0] == 0
+        if fixed_end:
+            assert order[-1] == count - 1
+        best = tour_cost(cost, order, round_trip)
+        assert best <= tour_cost(cost, start, round_trip) + 1e-9
+        for candidate in single_reversals(order, fixed_end):
+            assert tour_cost(cost, candidate, round_trip) >= best - 1e-9
+
+def test_two_opt_uncrosses_a_square():
+    corners = [(0, 0), (1, 1), (1, 0), (0, 1)]
+    cost = [[math.dist(a, b) for b in corners] for a in corners]
+    order = two_opt(cost, [0, 1, 2, 3], round_trip=True)
+    assert tour_cost(cost, order, round_trip=True) == pytest.approx(4.0)
+
+def test_order_stops_is_close_to_the_best_order():
+    rng = random.Random(52)
+    for _ in range(20):
+        cost = random_costs(rng, 7)
+        best = min(tour_cost(cost, [0, *rest]) for rest in itertools.permutations(range(1, 7)))
+        order = order_stops(cost)
+        assert tour_cost(cost, order) <= best * 1.25
+        assert tour_cost(cost, order) <= tour_cost(cost, nearest_insertion(cost)) + 1e-9
+
+def test_order_stops_puts_unreachable_stops_last():
+    # Stop 2 can be reached from stop 3 only
+    cost = [[0, 1, INF, 2], [1, 0, INF, 1], [INF, INF, 0, INF], [2, 1, 5, 0]]
+    assert order_stops(cost) == [0, 1, 3, 2]
@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+
+from traffic import TrafficFeed, parse_updates
+
+class RecordingWeights:
+    # Stands in for TrafficWeights: keeps what would be applied
+    def __init__(self):
+        self.applied = []
+
+    def apply(self, u, v, key, speed=None, factor=None):
+        self.applied.append((u.tolist(), v.tolist(), key.tolist(),
+                             None if speed is None else speed.tolist(),
+                             None if factor is None else factor.tolist()))
+        return len(self.applied)
+
+def test_parse_updates_skips_malformed_lines():
+    parsed, rejected = parse_updates(['1,2,0,30', 'garbage', '3,4,0,50', '5,6', '7,x,0,10'])
+    u, v, key, speed, factor = parsed
+    assert rejected == 3
+    assert u.tolist() == [1, 3]
+    assert v.tolist() == [2, 4]
+    assert speed.tolist() == [30, 50]
+    assert np.isnan(factor).all()
+
+def test_parse_updates_skips_malformed_json():
+    lines = [json.dumps({'u': 1, 'v': 2, 'factor': 0.5}), '{not json', {'v': 3}, {'u': 4, 'v': 5, 'speed_kph': 'fast'}]
+    parsed, rejected = parse_updates(lines)
+    u, v, key, speed, factor = parsed
+    assert rejected == 3
+    assert u.tolist() == [1]
+    assert factor.tolist() == [0.5]
+
+def test_parse_updates_without_valid_lines():
+    assert parse_updates(['garbage', '# comment', '']) == (None, 1)
+
+def test_apply_lines_applies_the_valid_rows_of_a_batch():
+    weights = RecordingWeights()
+    feed = TrafficFeed(weights)
+    version, rejected = feed.apply_lines(['1,2,0,30', 'garbage', '3,4,0,50'])
+    assert version == 1
+    assert rejected == 1
+    assert weights.applied == [([1, 3], [2, 4], [0, 0], [30.0, 50.0], None)]
+    assert feed.errors == 1
@@ -0,0 +1,73 @@
+import time
+
+INF = float('inf')
+# Stands in for a missing connection so insertion costs stay finite
+unreachable_cost = 1e12
+
+def tour_cost(cost, order, round_trip=False):
+    total = sum(cost[order[i]][order[i + 1]] for i in range(len(order) - 1))
+    if round_trip and len(order) > 1:
+        total += cost[order[-1]][order[0]]
+    return total
+
+def nearest_insertion(cost, fixed_end=False, round_trip=False):
+    # Stop 0 always comes first and, with fixed_end, the last stop last. The
+    # free stop closest to the tour goes in next, at the cheapest place.
+    # Costs may be asymmetric (one-way roads), so both directions count.
+    count = len(cost)
+    order = [0, count - 1] if fixed_end and count > 1 else [0]
+    free = [stop for stop in range(count) if stop not in order]
+
+    nearest = {stop: min(min(cost[t][stop], cost[stop][t]) for t in order) for stop in free}
+    while free:
+        stop = min(free, key=lambda s: nearest[s])
+        free.remove(stop)
+
+        best_position, best_added = None, INF
+        for position in range(1, len(order) + 1):
+            before = order[position - 1]
+            if position < len(order):
+                after = order[position]
+                added = cost[before][stop] + cost[stop][after] - cost[before][after]
+            elif fixed_end:
+                continue
+            elif round_trip:
+                added = cost[before][stop] + cost[stop][order[0]] - cost[before][order[0]]
+            else:
+                added = cost[before][stop]
+            if added < best_added:
+                best_position, best_added = position, added
+        order.insert(best_position, stop)
+
+        for other in free:
+            nearest[other] = min(nearest[other], cost[stop][other], cost[other][stop])
+    return order
+
+def two_opt(cost, order, fixed_end=False, round_trip=False, deadline=INF):
+    # Reverse segments while that shortens the tour. With one-way roads a
+    # reversed segment is driven the other way, so each candidate is costed
+    # in full rather than by its two changed edges.
+    order = list(order)
+    last = len(order) - 2 if fixed_end else len(order) - 1
+    best = tour_cost(cost, order, round_trip)
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for i in range(1, last):
+            for j in range(i + 1, last + 1):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_cost = tour_cost(cost, candidate, round_trip)
+                if candidate_cost < best - 1e-9:
+                    order, best = candidate, candidate_cost
+                    improved = True
+            if time.time() >= deadline:
+                break
+    return order
+
+def order_stops(cost, fixed_end=False, round_trip=False, deadline=INF):
+    # Visiting order of the stops as indexes into cost, starting with stop 0
+    if len(cost) <= 2:
+        return list(range(len(cost)))
+    cost = [[c if c != INF else unreachable_cost for c in row] for row in cost]
+    order = nearest_insertion(cost, fixed_end, round_trip)
+    return two_opt(cost, order, fixed_end, round_trip, deadline)
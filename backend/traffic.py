@@ -0,0 +1,404 @@
+import heapq
+import json
+import math
+import queue
+import socket
+import threading
+import time
+from array import array
+
+from search_state import pool_for, NO_PARENT
+
+INF = float('inf')
+EARTH_RADIUS = 6371000
+
+# Updates are applied in batches: whatever arrived within flush_interval,
+# at most max_batch lines, becomes one new snapshot
+flush_interval = 1.0
+max_batch = 50000
+# Feed speeds below this are treated as a standstill, not as a closed road
+min_speed_kph = 1.0
+
+class WeightSnapshot:
+    # Travel time in seconds per edge of the road arrays, read-only. A search
+    # takes the current snapshot once and keeps it for its whole run, so later
+    # updates never change the weights under it.
+    def __init__(self, version, speed, length, blocked, blocked_version=0):
+        import numpy as np
+        seconds = np.divide(length, speed / 3.6)
+        seconds[blocked] = INF
+        seconds.setflags(write=False)
+        self.version = version
+        # Changes only when roads are closed or reopened, not with traffic
+        self.blocked_version = blocked_version
+        self.created = time.time()
+        self.travel_time = seconds
+        # Same values as a flat array, which is much cheaper to index from Python
+        self.weights = array('d', seconds.tobytes())
+        open_roads = speed[~blocked]
+        self.max_speed = float(open_roads.max()) / 3.6 if len(open_roads) else 1.0
+
+class TrafficWeights:
+    # Live edge speeds on top of the free-flow speeds of the road arrays.
+    # Every applied batch publishes a new snapshot; old ones stay valid for
+    # the searches that hold them.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrays = None
+        self.snapshot = None
+        self.base_speed = None
+        self.speed = None
+        self.blocked = None
+        self.blocked_version = 0
+        self.length = None
+        self.edge_codes = None
+        self.edge_order = None
+        self.updated_edges = 0
+        self.updates = 0
+        self.unknown = 0
+        self.batches = 0
+        self.last_batch = None
+        self.last_apply_time = None
+
+    def load(self, arrays):
+        import numpy as np
+        with self.lock:
+            self.arrays = arrays
+            self.length = arrays.length.astype(np.float64)
+            self.base_speed = arrays.speed.astype(np.float64)
+            self.speed = self.base_speed.copy()
+            self.blocked = np.zeros(arrays.edge_count, dtype=np.bool_)
+            # Sorted (source, target, key) codes map feed roads to edge ids in one searchsorted
+            codes = self._codes(arrays.edge_source, arrays.edge_target, arrays.edge_key)
+            self.edge_order = np.argsort(codes, kind='stable')
+            self.edge_codes = codes[self.edge_order]
+            self.indptr = array('q', arrays.indptr.tobytes())
+            self.targets = array('i', arrays.edge_target.tobytes())
+            self.lat = array('d', np.radians(arrays.lat).tobytes())
+            self.lng = array('d', np.radians(arrays.lng).tobytes())
+            self._publish()
+
+    @property
+    def ready(self):
+        return self.snapshot is not None
+
+    def current(self):
+        return self.snapshot
+
+    def _codes(self, sources, targets, keys):
+        import numpy as np
+        node_count = self.arrays.node_count
+        return (sources.astype(np.int64) * node_count + targets) * 64 + np.minimum(keys, 63)
+
+    def edge_ids(self, u, v, key):
+        # Edge ids for OSM node pairs, -1 where the road is not in the graph
+        import numpy as np
+        arrays = self.arrays
+        u, v = np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64)
+        ui, vi = arrays.index_of(u), arrays.index_of(v)
+        ui, vi = np.minimum(ui, arrays.node_count - 1), np.minimum(vi, arrays.node_count - 1)
+        known = (arrays.node_ids[ui] == u) & (arrays.node_ids[vi] == v)
+        codes = self._codes(ui, vi, np.asarray(key, dtype=np.int64))
+        positions = np.minimum(np.searchsorted(self.edge_codes, codes), len(self.edge_codes) - 1)
+        known &= self.edge_codes[positions] == codes
+        return np.where(known, self.edge_order[positions], -1)
+
+    def _publish(self):
+        version = self.snapshot.version + 1 if self.snapshot else 1
+        self.snapshot = WeightSnapshot(version, self.speed, self.length, self.blocked, self.blocked_version)
+
+    def apply(self, u, v, key, speed=None, factor=None):
+        # Bulk update: speed in km/h, or factor times the free-flow speed.
+        # Later entries for the same road win.
+        import numpy as np
+        start_time = time.time()
+        with self.lock:
+            ids = self.edge_ids(u, v, key)
+            known = ids >= 0
+            ids = ids[known]
+            if speed is not None:
+                values = np.asarray(speed, dtype=np.float64)[known]
+            else:
+                values = self.base_speed[ids] * np.asarray(factor, dtype=np.float64)[known]
+            self.speed[ids] = np.maximum(values, min_speed_kph)
+            self._publish()
+            self.updates += len(known)
+            self.updated_edges = int(np.count_nonzero(self.speed != self.base_speed))
+            self.unknown += int(len(known) - len(ids))
+            self.batches += 1
+            self.last_batch = len(known)
+            self.last_apply_time = time.time() - start_time
+            return self.snapshot.version
+
+    def block_edges(self, removed):
+        # Roads taken out by an obstacle get an infinite travel time
+        if not removed:
+            return
+        u, v, key = zip(*[(u, v, k) for u, v, k, _ in removed])
+        with self.lock:
+            ids = self.edge_ids(u, v, key)
+            self.blocked[ids[ids >= 0]] = True
+            self.blocked_version += 1
+            self._publish()
+
+    def reset_blocked(self):
+        with self.lock:
+            if self.blocked.any():
+                self.blocked[:] = False
+                self.blocked_version += 1
+                self._publish()
+
+    def reset(self):
+        # Back to free-flow speeds
+        with self.lock:
+            self.speed = self.base_speed.copy()
+            self.updated_edges = 0
+            self._publish()
+            return self.snapshot.version
+
+    def shortest_path(self, graph, source, target, snapshot=None, deadline=INF):
+        # A* on travel time over the road arrays. The heuristic is the
+        # straight-line distance at the fastest speed in the snapshot.
+        # Returns (seconds, node path) or None.
+        snapshot = snapshot or self.snapshot
+        arrays = self.arrays
+        s, t = int(arrays.index_of(source)), int(arrays.index_of(target))
+        weights, indptr, targets = snapshot.weights, self.indptr, self.targets
+        lat, lng = self.lat, self.lng
+        inverse_speed = 1 / snapshot.max_speed
+        t_lat, t_lng = lat[t], lng[t]
+
+        def estimate(i):
+            # Equirectangular distance, scaled down a little so it stays below any road length
+            x = (lng[i] - t_lng) * math.cos((lat[i] + t_lat) / 2)
+            return math.hypot(x, lat[i] - t_lat) * EARTH_RADIUS * inverse_speed * 0.999
+
+        # The road arrays number nodes in their own order, but a pooled state
+        # only needs one slot per node
+        with pool_for(graph).borrow() as state:
+            dist, parent, stamp, done, heap = state.dist, state.parent, state.stamp, state.done, state.heap
+            gen = state.generation
+            dist[s] = 0
+            parent[s] = NO_PARENT
+            stamp[s] = gen
+            heap.append((estimate(s), s))
+            steps = 0
+
+            while heap:
+                _, i = heapq.heappop(heap)
+                if done[i] == gen:
+                    continue
+                done[i] = gen
+                if i == t:
+                    break
+                steps += 1
+                if steps & 1023 == 0 and time.time() > deadline:
+                    return None
+                d = dist[i]
+                for e in range(indptr[i], indptr[i + 1]):
+                    w = weights[e]
+                    if w == INF:
+                        continue
+                    j = targets[e]
+                    if done[j] == gen:
+                        continue
+                    new_dist = d + w
+                    if stamp[j] != gen or new_dist < dist[j]:
+                        dist[j] = new_dist
+                        parent[j] = i
+                        stamp[j] = gen
+                        heapq.heappush(heap, (new_dist + estimate(j), j))
+
+            if done[t] != gen:
+                return None
+            node_ids = arrays.node_ids
+            return dist[t], [int(node_ids[i]) for i in state.path_to(t)]
+
+    def report(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {'status': 'loading'}
+        return {
+            'status': 'ready',
+            'version': snapshot.version,
+            'snapshot_age': time.time() - snapshot.created,
+            'updated_edges': self.updated_edges,
+            'blocked_edges': int(self.blocked.sum()),
+            'updates': self.updates,
+            'unknown_roads': self.unknown,
+            'batches': self.batches,
+            'last_batch': self.last_batch,
+            'last_apply_time': self.last_apply_time
+        }
+
+def parse_updates(lines):
+    # Feed lines are 'u,v,key,speed_kph' or JSON objects with u, v, optional
+    # key and either speed_kph or factor (share of the free-flow speed).
+    # Returns (u, v, key, speed, factor) columns or None, and the number of
+    # malformed lines left out; speed is NaN where a factor was given.
+    import numpy as np
+    csv_lines, records = [], []
+    rejected = 0
+    for line in lines:
+        line = line.strip() if isinstance(line, str) else line
+        if not line or (isinstance(line, str) and line.startswith('#')):
+            continue
+        try:
+            if isinstance(line, dict):
+                record = line
+            elif line.startswith('{'):
+                record = json.loads(line)
+            else:
+                csv_lines.append(line)
+                continue
+            records.append((float(record['u']), float(record['v']), float(record.get('key', 0)),
+                            float(record.get('speed_kph', np.nan)), float(record.get('factor', np.nan))))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            rejected += 1
+
+    columns = []
+    if csv_lines:
+        rows = [line.split(',')[:4] for line in csv_lines]
+        try:
+            table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        except ValueError:
+            # Some line is malformed: convert line by line and leave those out
+            table = []
+            for row in rows:
+                try:
+                    if len(row) == 4:
+                        table.append([float(value) for value in row])
+                        continue
+                except ValueError:
+                    pass
+                rejected += 1
+            table = np.array(table, dtype=np.float64).reshape(-1, 4)
+        columns.append((table[:, 0], table[:, 1], table[:, 2], table[:, 3], np.full(len(table), np.nan)))
+    if records:
+        table = np.array(records, dtype=np.float64)
+        columns.append((table[:, 0], table[:, 1], table[:, 2], table[:, 3], table[:, 4]))
+    if not columns or not sum(len(parts[0]) for parts in columns):
+        return None, rejected
+    u, v, key, speed, factor = (np.concatenate(parts) for parts in zip(*columns))
+    return (u.astype(np.int64), v.astype(np.int64), key.astype(np.int64), speed, factor), rejected
+
+class TrafficFeed:
+    # Ingestion pipeline: sources push raw lines into one queue, a single
+    # applier thread drains it in batches and publishes one snapshot per batch
+    def __init__(self, weights):
+        self.weights = weights
+        self.lines = queue.Queue()
+        self.sources = []
+        self.stopped = threading.Event()
+        self.applier = None
+        self.errors = 0
+        self.last_error = None
+        self.received = 0
+
+    def start(self):
+        # A thread inherited through fork is not running in the child
+        if self.applier is None or not self.applier.is_alive():
+            self.applier = threading.Thread(target=self._apply_loop, name='traffic-applier', daemon=True)
+            self.applier.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def put(self, lines):
+        # The in-process queue source: lines or dicts, e.g. from POST /traffic
+        for line in lines:
+            self.lines.put(line)
+
+    def add_source(self, spec):
+        # 'file:<path>' follows a file like tail -f, 'tcp:<host>:<port>' reads
+        # lines from a feed server and reconnects when it drops
+        kind, _, target = spec.partition(':')
+        if kind == 'file':
+            reader = self._follow_file
+        elif kind == 'tcp':
+            reader = self._read_socket
+        else:
+            raise ValueError(f"Unknown traffic feed '{spec}', expected file:<path> or tcp:<host>:<port>")
+        thread = threading.Thread(target=reader, args=(target,), name=f'traffic-{kind}', daemon=True)
+        thread.start()
+        self.sources.append(spec)
+        self.start()
+
+    def _follow_file(self, path):
+        while not self.stopped.is_set():
+            try:
+                with open(path) as f:
+                    while not self.stopped.is_set():
+                        line = f.readline()
+                        if line:
+                            self.lines.put(line)
+                        else:
+                            time.sleep(0.2)
+            except OSError as e:
+                self._error(e)
+                self.stopped.wait(5)
+
+    def _read_socket(self, address):
+        host, _, port = address.rpartition(':')
+        while not self.stopped.is_set():
+            try:
+                with socket.create_connection((host or 'localhost', int(port)), timeout=30) as connection:
+                    for line in connection.makefile('r'):
+                        self.lines.put(line)
+                        if self.stopped.is_set():
+                            break
+            except OSError as e:
+                self._error(e)
+            self.stopped.wait(5)
+
+    def _error(self, error):
+        self.errors += 1
+        self.last_error = str(error)
+        print(f"Traffic feed error: {error}")
+
+    def _apply_loop(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.lines.get(timeout=flush_interval)]
+            except queue.Empty:
+                continue
+            # Collect for at most flush_interval so a busy feed still publishes regularly
+            flush_at = time.time() + flush_interval
+            while len(batch) < max_batch:
+                remaining = flush_at - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.lines.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.received += len(batch)
+            try:
+                self.apply_lines(batch)
+            except Exception as e:
+                self._error(e)
+
+    def apply_lines(self, lines):
+        # Applies the well-formed lines; returns the new version (None when
+        # nothing was applied) and the number of malformed lines
+        import numpy as np
+        parsed, rejected = parse_updates(lines)
+        if rejected:
+            self.errors += rejected
+            self.last_error = f'{rejected} malformed lines skipped'
+            print(f"Traffic feed: {rejected} malformed lines skipped")
+        if parsed is None:
+            return None, rejected
+        u, v, key, speed, factor = parsed
+        with_speed = ~np.isnan(speed)
+        version = None
+        if with_speed.any():
+            version = self.weights.apply(u[with_speed], v[with_speed], key[with_speed], speed=speed[with_speed])
+        with_factor = ~with_speed & ~np.isnan(factor)
+        if with_factor.any():
+            version = self.weights.apply(u[with_factor], v[with_factor], key[with_factor], factor=factor[with_factor])
+        return version, rejected
+
+    def report(self):
+        return dict(self.weights.report(), sources=self.sources, queued=self.lines.qsize(),
+                    received=self.received, errors=self.errors, last_error=self.last_error)
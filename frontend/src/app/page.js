@@ -87,12 +87,9 @@ export default function Home() {
 
   const handleClearObstacles = async () => {
     try {
+      // The backend replans and pushes the new routes over /ws/routes
       await pathfinderAPI.clearObstacles();
       clearObstacles();
-
-      if (startLocation && endLocation) {
-        setTimeout(() => handleFindPath(), 500);
-      }
     } catch (error) {
       console.error("Failed to clear obstacles:", error);
     }
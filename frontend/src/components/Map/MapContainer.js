@@ -14,6 +14,9 @@ const algorithmColors = {
   parallel_bellman_ford: '#FF9500',
   sequential_dijkstra: '#30D158',
   sequential_astar: '#FF2D55',
+  multilevel_overlay: '#AF52DE',
+  live_traffic: '#FFD60A',
+  csgraph_dijkstra: '#64D2FF',
 };
 
 export default function PathfinderMap() {
@@ -33,9 +36,12 @@ export default function PathfinderMap() {
     addObstacle, 
     setStartLocation,
     setEndLocation,
-    setPaths
+    applyRouteUpdate
   } = usePathfinderStore();
 
+  // Routes replanned after obstacle changes arrive over the WebSocket
+  useEffect(() => pathfinderAPI.subscribeRoutes(applyRouteUpdate), [applyRouteUpdate]);
+
   // Load Leaflet on client side only
   useEffect(() => {
     setIsClient(true);
@@ -160,14 +166,8 @@ export default function PathfinderMap() {
                 coordinates: e.latlng,
               });
               
-              if (result.updated_paths) {
-                console.log('Received updated paths from backend:', result.updated_paths);
-                const transformedPaths = {};
-                Object.entries(result.updated_paths).forEach(([algorithm, data]) => {
-                  transformedPaths[algorithm] = data.error ? null : data;
-                });
-                setPaths(transformedPaths);
-                console.log('Paths updated automatically due to obstacle');
+              if (result.replan_scheduled) {
+                console.log('Obstacle placed, updated paths will follow over the WebSocket');
               }
             }
           } catch (error) {
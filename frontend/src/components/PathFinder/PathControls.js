@@ -51,14 +51,9 @@ export default function PathControls({ className = '' }) {
   const handleClearObstacles = async () => {
     try {
       console.log('Clearing obstacles...');
+      // The backend replans and pushes the new routes over /ws/routes
       await pathfinderAPI.clearObstacles();
       clearObstacles();
-      
-      // Automatically recalculate if paths exist
-      if (startLocation && endLocation) {
-        console.log('Recalculating after clearing obstacles...');
-        setTimeout(() => handleFindPath(), 500);
-      }
     } catch (error) {
       console.error('Failed to clear obstacles:', error);
     }
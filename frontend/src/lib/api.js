@@ -35,6 +35,30 @@ export const pathfinderAPI = {
     const response = await api.post('/clear_obstacles');
     return response.data;
   },
+
+  // Pushes the current routes, then a delta whenever obstacles move them.
+  // Reconnects after a dropped connection; returns a function that stops it.
+  subscribeRoutes: (onMessage) => {
+    let socket;
+    let stopped = false;
+
+    const connect = () => {
+      socket = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/ws/routes`);
+      socket.onmessage = (event) => {
+        const resync = onMessage(JSON.parse(event.data)) === false;
+        if (resync) socket.send('snapshot');
+      };
+      socket.onclose = () => {
+        if (!stopped) setTimeout(connect, 2000);
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      socket.close();
+    };
+  },
 };
 
 // Keep your utility functions as they are...
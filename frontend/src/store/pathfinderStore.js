@@ -17,6 +17,7 @@ export const usePathfinderStore = create((set, get) => ({
   },
   isCalculating: false,
   fastestAlgorithm: null,
+  routesVersion: 0,
   
   // Obstacle state
   obstacles: [],
@@ -49,6 +50,54 @@ export const usePathfinderStore = create((set, get) => ({
       selectedAlgorithm: fastest // Auto-select fastest
     });
   },
+  // Apply a message from /ws/routes; returns false when a delta was missed
+  applyRouteUpdate: (message) => {
+    const { paths, routesVersion, setPaths } = get();
+
+    if (message.type === 'routes') {
+      if (Object.keys(message.paths).length) {
+        const transformedPaths = {};
+        Object.entries(message.paths).forEach(([algorithm, data]) => {
+          transformedPaths[algorithm] = data.error ? null : data;
+        });
+        setPaths(transformedPaths);
+      }
+    } else if (message.type === 'delta') {
+      if (message.base_version !== routesVersion) return false;
+      const nextPaths = { ...paths };
+      Object.entries(message.changed).forEach(([algorithm, change]) => {
+        if (change.error) {
+          nextPaths[algorithm] = null;
+          return;
+        }
+        const { start, delete: deleted, insert, edges, ...fields } = change;
+        const splice = (old, at, count, added) => [
+          ...old.slice(0, at),
+          ...added,
+          ...old.slice(at + count),
+        ];
+        nextPaths[algorithm] = {
+          ...fields,
+          path: splice(paths[algorithm]?.path || [], start, deleted, insert),
+          edges: edges
+            ? splice(paths[algorithm]?.edges || [], edges.start, edges.delete, edges.insert)
+            : [],
+        };
+      });
+      setPaths(nextPaths);
+    } else if (message.type === 'error') {
+      console.warn('Route update failed:', message.error);
+      // The server dropped its routes too; the next update is a full snapshot
+      const clearedPaths = {};
+      Object.keys(paths).forEach((algorithm) => {
+        clearedPaths[algorithm] = null;
+      });
+      setPaths(clearedPaths);
+    }
+
+    set({ routesVersion: message.version });
+    return true;
+  },
   setIsCalculating: (calculating) => set({ isCalculating: calculating }),
   addObstacle: (obstacle) => set((state) => ({ 
     obstacles: [...state.obstacles, obstacle] 